@@ -0,0 +1,187 @@
+''' Este módulo implementa el índice de agregados por columna de la hoja de cálculo.
+    Cada columna se resume en bloques de filas (suma, cuenta, mínimo, máximo) organizados en un árbol de
+    segmentos, de forma que las estadísticas de una selección rectangular se obtienen en O(cols x log filas).
+'''
+import math
+from typing import Any
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, the blocks are summarized in python without it
+    np = None
+
+AGG_BLOCK = 256         # Rows per block summary
+
+EMPTY = (0.0, 0, math.inf, -math.inf)       # (sum, count, min, max) of a block without numbers
+
+
+def combine(a: tuple, b: tuple) -> tuple:
+    return a[0] + b[0], a[1] + b[1], min(a[2], b[2]), max(a[3], b[3])
+
+
+def summarize(values: list[Any]) -> tuple:
+    """Returns the (sum, count, min, max) summary of the numeric values."""
+    numbers = []
+    for value in values:
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+            numbers.append(value)
+    if not numbers:
+        return EMPTY
+    return sum(numbers), len(numbers), min(numbers), max(numbers)
+
+
+class ColumnSummary:
+    """Segment tree over the block summaries of a column. Dirty blocks are recomputed when the column is queried."""
+    def __init__(self, nrows: int):
+        self.nrows = nrows
+        self.nblocks = max(1, -(-nrows // AGG_BLOCK))
+        self.size = 1 << (self.nblocks - 1).bit_length()
+        self.tree = [EMPTY] * (2 * self.size)
+        self.dirty = set()
+
+    def build(self, summaries: list[tuple]):
+        self.tree[self.size: self.size + len(summaries)] = summaries
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = combine(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def resize(self, nrows: int):
+        """Resizes the column to nrows keeping the block summaries. The blocks from the last one kept on are
+        dirty (the new ones and the one that was or becomes partial)."""
+        first = min(self.nblocks, max(1, -(-nrows // AGG_BLOCK))) - 1
+        leaves = self.tree[self.size: self.size + self.nblocks]
+        self.nrows = nrows
+        self.nblocks = max(1, -(-nrows // AGG_BLOCK))
+        self.size = 1 << (self.nblocks - 1).bit_length()
+        self.tree = [EMPTY] * (2 * self.size)
+        self.build(leaves[:self.nblocks])
+        self.dirty = {nblock for nblock in self.dirty if nblock < self.nblocks}
+        self.dirty.update(range(first, self.nblocks))
+
+    def update(self, nblock: int, summary: tuple):
+        node = self.size + nblock
+        self.tree[node] = summary
+        node //= 2
+        while node:
+            self.tree[node] = combine(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def query(self, b0: int, b1: int) -> tuple:
+        """Returns the combined summary of the blocks b0 to b1 (both included)."""
+        answ = EMPTY
+        lo, hi = b0 + self.size, b1 + self.size + 1
+        while lo < hi:
+            if lo & 1:
+                answ = combine(answ, self.tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                answ = combine(answ, self.tree[hi])
+            lo, hi = lo // 2, hi // 2
+        return answ
+
+
+class AggregateIndex:
+    """Per column block summaries of the numeric values in a SheetStore (formula cells count with their value).
+
+    The index listens to the store and to the formula engine: writes and recalculations mark the touched
+    blocks as dirty, row inserts and deletes mark dirty the blocks from the edit on and column edits shift the
+    summaries. A column whose number of rows changed is resized keeping its blocks. The summaries are built on
+    demand, so only the columns being queried are ever indexed.
+    """
+    def __init__(self, store, formulas=None):
+        self.store = store
+        self.formulas = formulas
+        self.columns: dict[int, ColumnSummary] = {}
+        store.add_listener(self.on_store_changed)
+        if formulas is not None:
+            formulas.add_listener(self.on_formulas_recalc)
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: marks as dirty the written blocks and the blocks shifted by row edits, and shifts the
+        columns on column edits."""
+        if kind == 'set':
+            # The blocks past the end of the column are added when it is resized
+            for x in range(x0, x1 + 1):
+                if (column := self.columns.get(x)) is not None:
+                    column.dirty.update(range((y0 - 1) // AGG_BLOCK, (y1 - 1) // AGG_BLOCK + 1))
+        elif kind in ('insert_rows', 'delete_rows'):
+            for column in self.columns.values():
+                column.dirty.update(range((y0 - 1) // AGG_BLOCK, column.nblocks))
+        elif kind == 'insert_cols':
+            n = x1 - x0 + 1
+            self.columns = {(x + n if x >= x0 else x): column for x, column in self.columns.items()}
+        elif kind == 'delete_cols':
+            n = x1 - x0 + 1
+            self.columns = {(x - n if x > x1 else x): column for x, column in self.columns.items() if not x0 <= x <= x1}
+
+    def on_formulas_recalc(self, cells: list[tuple[int, int]]):
+        """Formula engine listener: marks as dirty the blocks holding the recalculated cells."""
+        for x, y in cells:
+            if (column := self.columns.get(x)) is not None and y <= column.nrows:
+                column.dirty.add((y - 1) // AGG_BLOCK)
+
+    def values(self, x: int, y0: int, y1: int) -> list[Any]:
+        """Returns the values of column x from row y0 to row y1, with the formula cells replaced by their value."""
+        values = self.store.column_slice(x, y0, y1)
+        if self.formulas is not None and self.formulas.formulas:
+            for ndx, value in enumerate(values):
+                if isinstance(value, str) and value.startswith('='):
+                    values[ndx] = self.formulas.value(x, y0 + ndx)
+        return values
+
+    def block_summary(self, x: int, nblock: int, nrows: int) -> tuple:
+        y0 = nblock * AGG_BLOCK + 1
+        return summarize(self.values(x, y0, min(nrows, y0 + AGG_BLOCK - 1)))
+
+    def column(self, x: int) -> ColumnSummary:
+        """Returns the summary of column x, building it or refreshing its dirty blocks."""
+        nrows = self.store.nrows
+        column = self.columns.get(x)
+        if column is not None and column.nrows != nrows:
+            column.resize(nrows)
+        if column is None:
+            column = self.columns[x] = ColumnSummary(nrows)
+            data = self.store.column_array(x, 1, nrows) if np is not None and nrows else None
+            if data is not None:
+                # Typed column: all the blocks are summarized at once
+                data = np.concatenate([data, np.full(column.nblocks * AGG_BLOCK - nrows, np.nan)])
+                data = data.reshape(column.nblocks, AGG_BLOCK)
+                mask = ~np.isnan(data)
+                column.build(list(zip(
+                    np.where(mask, data, 0.0).sum(axis=1).tolist(),
+                    mask.sum(axis=1).tolist(),
+                    np.where(mask, data, math.inf).min(axis=1).tolist(),
+                    np.where(mask, data, -math.inf).max(axis=1).tolist(),
+                )))
+            else:
+                column.build([self.block_summary(x, nblock, nrows) for nblock in range(column.nblocks)])
+        elif column.dirty:
+            for nblock in column.dirty:
+                column.update(nblock, self.block_summary(x, nblock, nrows))
+            column.dirty.clear()
+        return column
+
+    def query(self, x0: int, y0: int, x1: int, y1: int) -> tuple[float, int, float | None, float | None]:
+        """Returns (sum, count, min, max) of the numeric values in the x0:x1, y0:y1 range."""
+        answ = EMPTY
+        y1 = min(y1, self.store.nrows)
+        for x in range(x0, min(x1, self.store.ncols) + 1):
+            if y0 > y1:
+                break
+            column = self.column(x)
+            b0, b1 = (y0 - 1) // AGG_BLOCK, (y1 - 1) // AGG_BLOCK
+            if b0 == b1:
+                answ = combine(answ, summarize(self.values(x, y0, y1)))
+                continue
+            # The partial blocks at both ends are scanned, the full blocks are taken from the tree
+            answ = combine(answ, summarize(self.values(x, y0, (b0 + 1) * AGG_BLOCK)))
+            answ = combine(answ, summarize(self.values(x, b1 * AGG_BLOCK + 1, y1)))
+            if b0 + 1 <= b1 - 1:
+                answ = combine(answ, column.query(b0 + 1, b1 - 1))
+        total, count, lo, hi = answ
+        return (total, count, lo, hi) if count else (0, 0, None, None)
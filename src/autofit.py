@@ -0,0 +1,164 @@
+''' Este módulo implementa el ajuste automático del ancho de las columnas y del alto de las filas.
+    Cada columna guarda por bloques de filas las filas con los valores más largos, de forma que el ancho de
+    una columna de millones de filas se calcula midiendo solo una muestra: los valores más largos, los
+    extremos numéricos y las filas visibles. Las medidas de la fuente se guardan en caché.
+'''
+import heapq
+import itertools
+from typing import Any, Callable
+
+from aggregates import AggregateIndex
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, the typed columns are ranked in python without it
+    np = None
+
+AUTOFIT_BLOCK = 1024        # Rows per block of the longest values index
+AUTOFIT_TOP = 16            # Longest values kept per block and measured per column
+MEASURE_CACHE = 8192        # (font, text) widths kept by TextMeasure
+DEFAULT_FONT = "TkDefaultFont"      # Font of the canvas texts without a style font
+
+
+def text_length(value: Any) -> int:
+    return 0 if value is None else len(str(value))
+
+
+class ColumnLongest:
+    """Rows of the AUTOFIT_TOP longest values of every block of a column. Dirty blocks are ranked again when
+    the column is queried."""
+    def __init__(self, nrows: int):
+        self.nrows = nrows
+        self.blocks: list[list[tuple[int, int]]] = [[] for _ in range(-(-nrows // AUTOFIT_BLOCK))]
+        self.dirty = set()
+        self.top: list[int] | None = None         # Merged rows of the column, dropped with any dirty block
+
+    def resize(self, nrows: int):
+        """Resizes the column to nrows keeping the ranked blocks. The blocks from the last one kept on are
+        dirty (the new ones and the one that was or becomes partial)."""
+        nblocks = -(-nrows // AUTOFIT_BLOCK)
+        first = max(0, min(len(self.blocks), nblocks) - 1)
+        self.nrows = nrows
+        self.blocks = self.blocks[:nblocks] + [[] for _ in range(nblocks - len(self.blocks))]
+        self.dirty = {nblock for nblock in self.dirty if nblock < nblocks}
+        self.dirty.update(range(first, nblocks))
+        self.top = None
+
+
+class LongestValues:
+    """Index of the longest display values of the columns of a SheetStore (formula cells with their value).
+
+    Like the AggregateIndex it listens to the store and the formula engine: writes and recalculations mark
+    the touched blocks as dirty, row inserts and deletes mark dirty the blocks from the edit on and column
+    edits shift the columns, which are ranked again on demand. A column whose number of rows changed is
+    resized keeping its blocks. The lengths are the characters of the unformatted value, so the caller
+    measures the formatted text of the returned rows.
+    """
+    def __init__(self, store, formulas=None, aggregates: AggregateIndex=None):
+        self.store = store
+        self.aggregates = aggregates if aggregates is not None else AggregateIndex(store, formulas)
+        self.columns: dict[int, ColumnLongest] = {}
+        store.add_listener(self.on_store_changed)
+        if formulas is not None:
+            formulas.add_listener(self.on_formulas_recalc)
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: marks as dirty the written blocks and the blocks shifted by row edits, and shifts the
+        columns on column edits."""
+        if kind == 'set':
+            # The blocks past the end of the column are added when it is resized
+            for x in range(x0, x1 + 1):
+                if (column := self.columns.get(x)) is not None:
+                    column.dirty.update(range((y0 - 1) // AUTOFIT_BLOCK, (y1 - 1) // AUTOFIT_BLOCK + 1))
+        elif kind in ('insert_rows', 'delete_rows'):
+            for column in self.columns.values():
+                column.dirty.update(range((y0 - 1) // AUTOFIT_BLOCK, len(column.blocks)))
+        elif kind == 'insert_cols':
+            n = x1 - x0 + 1
+            self.columns = {(x + n if x >= x0 else x): column for x, column in self.columns.items()}
+        elif kind == 'delete_cols':
+            n = x1 - x0 + 1
+            self.columns = {(x - n if x > x1 else x): column for x, column in self.columns.items() if not x0 <= x <= x1}
+
+    def on_formulas_recalc(self, cells: list[tuple[int, int]]):
+        """Formula engine listener: marks as dirty the blocks holding the recalculated cells."""
+        for x, y in cells:
+            if (column := self.columns.get(x)) is not None and y <= column.nrows:
+                column.dirty.add((y - 1) // AUTOFIT_BLOCK)
+
+    def block_longest(self, x: int, nblock: int, nrows: int) -> list[tuple[int, int]]:
+        """Returns the (length, row) of the longest values of the block."""
+        y0 = nblock * AUTOFIT_BLOCK + 1
+        values = self.aggregates.values(x, y0, min(nrows, y0 + AUTOFIT_BLOCK - 1))
+        return heapq.nlargest(AUTOFIT_TOP, zip(map(text_length, values), range(y0, y0 + len(values))))
+
+    def typed_longest(self, column: ColumnLongest, data) -> None:
+        """Ranks all the blocks of a typed column at once: the rows with the largest magnitudes of every block
+        (the widest integer parts) are the ones measured."""
+        k = min(AUTOFIT_TOP, AUTOFIT_BLOCK)
+        padded = np.concatenate([data, np.full(len(column.blocks) * AUTOFIT_BLOCK - len(data), np.nan)])
+        # Negative numbers take the width of one more digit for the sign
+        keys = np.nan_to_num(np.abs(padded) * np.where(padded < 0, 10.0, 1.0), nan=-1.0)
+        keys = keys.reshape(len(column.blocks), AUTOFIT_BLOCK)
+        ndxs = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+        rows = ndxs + (np.arange(len(column.blocks)) * AUTOFIT_BLOCK + 1)[:, None]
+        for nblock, block_rows in enumerate(rows.tolist()):
+            column.blocks[nblock] = [
+                (len(str(value)), y) for y in block_rows if y <= column.nrows and (value := data[y - 1]) == value
+            ]
+
+    def column(self, x: int) -> ColumnLongest:
+        """Returns the index of column x, building it or ranking again its dirty blocks."""
+        nrows = self.store.nrows
+        column = self.columns.get(x)
+        if column is not None and column.nrows != nrows:
+            column.resize(nrows)
+        if column is None:
+            column = self.columns[x] = ColumnLongest(nrows)
+            data = self.store.column_array(x, 1, nrows) if np is not None and nrows else None
+            if data is not None:
+                self.typed_longest(column, data)
+            else:
+                column.blocks = [self.block_longest(x, nblock, nrows) for nblock in range(len(column.blocks))]
+        elif column.dirty:
+            for nblock in column.dirty:
+                column.blocks[nblock] = self.block_longest(x, nblock, nrows)
+            column.dirty.clear()
+            column.top = None
+        return column
+
+    def longest(self, x: int) -> list[int]:
+        """Returns the storage rows of the AUTOFIT_TOP longest values of column x."""
+        if x > self.store.ncols or not self.store.nrows:
+            return []
+        column = self.column(x)
+        if column.top is None:
+            longest = heapq.nlargest(AUTOFIT_TOP, itertools.chain.from_iterable(column.blocks))
+            column.top = [y for length, y in longest if length]
+        return column.top
+
+
+class TextMeasure:
+    """Cached text widths and line heights of the fonts. measure is the text width function of the toolkit
+    (font, text) -> pixels and linespace the line height function font -> pixels."""
+    def __init__(self, measure: Callable[[str, str], int], linespace: Callable[[str], int]):
+        self._measure = measure
+        self._linespace = linespace
+        self.widths: dict[tuple[str, str], int] = {}
+        self.heights: dict[str, int] = {}
+
+    def width(self, font: str | None, text: str) -> int:
+        """Returns the width of the widest line of text."""
+        font = font or DEFAULT_FONT
+        if (answ := self.widths.get((font, text))) is None:
+            if len(self.widths) >= MEASURE_CACHE:
+                self.widths.clear()
+            answ = self.widths[(font, text)] = max(self._measure(font, line) for line in text.split('\n'))
+        return answ
+
+    def height(self, font: str | None, text: str='') -> int:
+        """Returns the height of the lines of text."""
+        font = font or DEFAULT_FONT
+        if (answ := self.heights.get(font)) is None:
+            answ = self.heights[font] = self._linespace(font)
+        return answ * (text.count('\n') + 1)
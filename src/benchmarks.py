@@ -0,0 +1,358 @@
+''' Este módulo reúne las pruebas de rendimiento de la hoja de cálculo.
+    Se ejecuta como script: python benchmarks.py
+'''
+import os
+import random
+import tempfile
+import time
+
+import formulas
+from autofit import TextMeasure
+from conditional import ConditionalFormats, Rule
+from formulas import FormulaEngine
+from numformat import compile_format
+from ranges import NamedRanges
+from search import SearchIndex
+from sheetfile import SheetFile, write_sheet
+from sheetio import TsvParser, tsv_chunks
+from sheetstore import SheetStore
+from styles import CellStyles, Style
+from tclbatch import CanvasBatch, TclCounter
+
+
+def timeit(fnc, repeat: int=3) -> float:
+    """Returns the best wall time of repeat calls to fnc, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fnc()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_range_functions(nrows: int=1_000_000):
+    """SUM over a whole column: typed column of a worksheet file vs python values in the overlay."""
+    store = SheetStore()
+    store.set_block(1, 1, [[float(y)] for y in range(1, nrows + 1)])
+    fname = os.path.join(tempfile.mkdtemp(), 'bench.wsh')
+    write_sheet(fname, store)
+    sheet = SheetFile(fname)
+    formula = f"=SUM(C1R1:C1R{nrows})"
+    results = {}
+    for label, base_store in (('typed column', SheetStore(sheet)), ('overlay', store)):
+        engine = FormulaEngine(base_store)
+        base_store.set(3, 1, formula)
+        results[label] = timeit(lambda: engine.recalc([(3, 1)]))
+        print(f"SUM of {nrows} rows, {label:<12}: {results[label] * 1000:9.2f} ms -> {engine.value(3, 1)}")
+    sheet.close()
+    os.remove(fname)
+    return results
+
+
+def bench_parallel_recalc(nrows: int=100_000):
+    """Full recalculation of a wide and shallow sheet (nrows independent chains), serial vs worker pools."""
+    store = SheetStore()
+    engine = FormulaEngine(store)
+    store.set_block(1, 1, [[y, f"=C1R{y} * 2 + C1R{y} ^ 2", f"=ROUND(C2R{y} / 3, 2)"] for y in range(1, nrows + 1)])
+    cells = list(engine.formulas)
+    results = {}
+    min_cells = formulas.PARALLEL_MIN_CELLS
+    for label, threshold in (('serial', len(cells) + 1), ('parallel', min_cells)):
+        formulas.PARALLEL_MIN_CELLS = threshold
+        results[label] = timeit(lambda: engine.recalc(cells))
+        print(f"Recalc of {len(cells)} formulas, {label:<8} ({formulas.PARALLEL_WORKERS} workers): "
+              f"{results[label] * 1000:9.2f} ms")
+    formulas.PARALLEL_MIN_CELLS = min_cells
+    formulas.shutdown_executors()
+    return results
+
+
+def bench_formula_shift(nrows: int=20_000):
+    """Insert and delete of a row in a column of nrows formulas, near the end and at the top of the sheet."""
+    store = SheetStore()
+    engine = FormulaEngine(store)
+    store.set_block(1, 1, [[y, f"=C1R{y} * 2 + SUM(C1R{max(1, y - 5)}:C1R{y})"] for y in range(1, nrows + 1)])
+    results = {}
+    for label, y0 in (('near the end', nrows - 10), ('at the top', 1)):
+        results[label] = timeit(lambda: (store.insert_rows(y0, y0), store.delete_rows(y0, y0)))
+        print(f"Insert + delete a row {label:<12} of {len(engine.formulas)} formulas: {results[label] * 1000:9.2f} ms")
+    return results
+
+
+def bench_search_shift(nrows: int=200_000, ncols: int=10):
+    """Find after a row insert + delete at the top of an indexed sheet: shifted index vs a rebuild."""
+    store = SheetStore()
+    store.set_block(1, 1, [[f"r{y}c{x}" for x in range(ncols)] for y in range(1, nrows + 1)])
+    index = SearchIndex(store)
+    results = {'build': timeit(lambda: (index.release(), index.find('r1c1')), repeat=1)}
+    results['shift'] = timeit(lambda: (store.insert_rows(1, 1), store.delete_rows(1, 1), index.find('r1c1')))
+    for label, seconds in results.items():
+        print(f"Find in {nrows * ncols} cells after a row insert + delete, {label:<5}: {seconds * 1000:9.2f} ms")
+    return results
+
+
+def bench_frozen_scroll(nsteps: int=500, nrows: int=40):
+    """Scroll of a sheet with frozen panes: quadrant geometry cached in the pane layout vs rebuilt on every lookup."""
+    from worksheetui import SheetLook, SheetState
+    look = SheetLook(None)
+    look.flags |= SheetState.FREEZE
+    look.coords_vportq1, look.viewport_q3 = (300, 100), (1, 1, 4, 5)
+
+    def scroll(cached: bool):
+        for step in range(nsteps):
+            look.viewport_q1 = (4, 5 + step, 20, 5 + step + nrows)
+            # The cells of every drawn row are located as setGUI and invalidate_cells do
+            for y in range(1, nrows):
+                if not cached:
+                    look._layout = None
+                look.area_coordinates(2, y, 20, y + 5)
+                look.cell_quadrant(2, y, isCoord=False)
+
+    results = {}
+    for label, cached in (('rebuilt', False), ('cached', True)):
+        results[label] = timeit(lambda: scroll(cached))
+        print(f"Frozen panes scroll of {nsteps} steps, {label:<7}: {results[label] * 1000:9.2f} ms")
+    return results
+
+
+def bench_named_ranges(nnames: int=10_000, nqueries: int=1000):
+    """Names covering a cell and names intersecting a viewport: R-tree vs a scan of all the names."""
+    rnd = random.Random(0)
+    names = NamedRanges()
+    for n in range(nnames):
+        x0, y0 = rnd.randint(1, 200), rnd.randint(1, 100_000)
+        names.add(f"name{n}", (x0, y0, x0 + rnd.randint(0, 10), y0 + rnd.randint(0, 500)))
+    cells = [(rnd.randint(1, 200), rnd.randint(1, 100_000)) for _ in range(nqueries)]
+
+    def scan(x0, y0, x1, y1):
+        return sorted(name for name, r in names.rects.items() if r[0] <= x1 and x0 <= r[2] and r[1] <= y1 and y0 <= r[3])
+
+    results = {}
+    for label, at, viewport in (
+        ('scan', lambda x, y: scan(x, y, x, y), lambda x, y: scan(x, y, x + 20, y + 40)),
+        ('r-tree', names.at, lambda x, y: names.intersecting(x, y, x + 20, y + 40)),
+    ):
+        results[label] = (
+            timeit(lambda: [at(x, y) for x, y in cells]) / nqueries,
+            timeit(lambda: [viewport(x, y) for x, y in cells]) / nqueries,
+        )
+        print(f"{nnames} named ranges, {label:<6}: cell {results[label][0] * 1000:7.3f} ms, "
+              f"viewport {results[label][1] * 1000:7.3f} ms per query")
+    return results
+
+
+def bench_style_runs(nrows: int=1_000_000, nbands: int=1000):
+    """Memory and lookup time of the style runs: a fully styled column and a column striped in nbands bands."""
+    styles = CellStyles()
+    styles.set_style(1, 1, 1, None, Style(fill="blue", anchor="e"))
+    band = nrows // nbands
+    for y in range(1, nrows + 1, 2 * band):
+        styles.set_style(2, y, 2, y + band - 1, Style(background="lightyellow"))
+    t_lookup = timeit(lambda: [styles.style_id(2, y) for y in range(1, nrows + 1, 97)]) / (nrows // 97 + 1)
+    print(f"Style runs of {nrows} rows: full column {len(styles.columns[1])} run, {nbands} bands "
+          f"{len(styles.columns[2])} runs, {styles.nbytes()} bytes, lookup {t_lookup * 1e6:.2f} us")
+    return styles.nbytes(), t_lookup
+
+
+def bench_conditional_formats(nrows: int=200_000, nvisible: int=40):
+    """Colour scale and duplicates over a column: first draw (builds the range statistics), scroll steps and
+    a write followed by a redraw of the visible cells."""
+    store = SheetStore()
+    store.set_block(1, 1, [[float(y % 1000)] for y in range(1, nrows + 1)])
+    conditional = ConditionalFormats(store)
+    conditional.add(Rule('scale', (1, 1, 1, nrows)))
+    conditional.add(Rule('duplicates', (1, 1, 1, nrows)))
+
+    def draw(y0):
+        return [conditional.format(1, y, store.get(1, y)) for y in range(y0, y0 + nvisible)]
+
+    results = {'first draw': timeit(lambda: (conditional.stats.clear(), conditional.counts.clear(), draw(1)), repeat=1)}
+    results['scroll step'] = timeit(lambda: [draw(y) for y in range(1, nrows - nvisible, nrows // 100)]) / 100
+    results['write + draw'] = timeit(lambda: (store.set(1, 5, 5000.0), draw(1)))
+    for label, seconds in results.items():
+        print(f"Conditional formats over {nrows} rows, {label:<12}: {seconds * 1000:9.3f} ms")
+    return results
+
+
+def bench_number_formats(nvalues: int=100_000):
+    """Display texts of numeric values: one call per cell vs one pass per column slice."""
+    rnd = random.Random(0)
+    distinct = [rnd.uniform(-1e6, 1e6) for _ in range(nvalues)]
+    repeated = [float(rnd.randrange(1000)) for _ in range(nvalues)]
+    results = {}
+    for code in ("#,##0.00", "0.0%", "yyyy-mm-dd hh:mm"):
+        fmt = compile_format(code)
+        for label, values in (('distinct', distinct), ('repeated', repeated)):
+            per_cell = timeit(lambda: [compile_format(code).format_value(value) for value in values])
+            per_column = timeit(lambda: fmt.format_column(values))
+            results[(code, label)] = (per_cell, per_column)
+            print(f"Format {nvalues} {label} values as {code!r:<20}: per cell {per_cell * 1000:8.2f} ms, "
+                  f"per column {per_column * 1000:8.2f} ms")
+    return results
+
+def bench_clipboard(nrows: int=50_000, ncols: int=10):
+    """TSV copy of a large range: one string of the whole range vs chunks of rows, then the background parse."""
+    store = SheetStore()
+    store.set_block(1, 1, [[f"r{y}c{x}" if x % 2 else float(y * x) for x in range(ncols)] for y in range(nrows)])
+    blocks = lambda chunk: store.iter_rows(1, 1, ncols, nrows, chunk=chunk)
+    whole = timeit(lambda: "".join(tsv_chunks(blocks(nrows))), repeat=1)
+    chunked = timeit(lambda: sum(map(len, tsv_chunks(blocks(4096)))), repeat=1)
+    text = "".join(tsv_chunks(blocks(nrows)))
+
+    def parse():
+        parser = TsvParser(text)
+        parser.start()
+        parser.join()
+        return parser.rows
+    parsed = timeit(parse, repeat=1)
+    print(f"Copy {nrows}x{ncols} cells: whole string {whole * 1000:8.2f} ms, chunks {chunked * 1000:8.2f} ms, "
+          f"parse {parsed * 1000:8.2f} ms")
+    return whole, chunked, parsed
+
+def bench_autofit(nrows: int=1_000_000):
+    """Autofit of a typed column: every display value measured vs the sample of the longest values index."""
+    from worksheetui import SheetLook
+    store = SheetStore()
+    rnd = random.Random(0)
+    store.set_block(1, 1, [[rnd.uniform(-1e6, 1e6)] for _ in range(nrows)])
+    fname = os.path.join(tempfile.mkdtemp(), 'bench.wsh')
+    write_sheet(fname, store)
+    sheet = SheetFile(fname)
+    look = SheetLook(None, store=SheetStore(sheet))
+    look.styles.update_style(1, 1, 1, None, number_format="#,##0.00")
+    # Character widths stand for the toolkit font measure
+    measure = TextMeasure(lambda font, text: 7 * len(text), lambda font: 15)
+    fmt = compile_format("#,##0.00")
+
+    def full_scan():
+        return max(measure.width(None, text) for text in fmt.format_column(look.store.column_slice(1, 1, nrows)))
+
+    def sampled():
+        return max(measure.width(font, text) for font, text in look.autofit_texts(1))
+    results = {'full scan': timeit(full_scan, repeat=1), 'first sample': timeit(sampled, repeat=1),
+               'sample': timeit(sampled)}
+    for label, seconds in results.items():
+        print(f"Autofit of {nrows} rows, {label:<12}: {seconds * 1000:9.2f} ms")
+    assert full_scan() == sampled()
+    sheet.close()
+    os.remove(fname)
+    return results
+
+def bench_tcl_batch(ncols: int=20, nrows: int=40):
+    """Paint pass of a frame over a Tcl stand-in of the canvas: one call per command vs one batched script.
+    The crossings are the round trips a remote display pays for."""
+    import tkinter
+    from types import SimpleNamespace
+    tcl = tkinter.Tcl()
+    tcl.eval("proc .canvas {args} {switch -- [lindex $args 0] {create {incr ::n} bbox {list 0 0 30 10}}}")
+    counter = TclCounter(tcl)
+    canvas = SimpleNamespace(_w=".canvas", tk=counter)
+    cells = [(x * 60, y * 20, f"C{x}R{y}") for x in range(ncols) for y in range(nrows)]
+
+    def per_call():
+        for x0, y0, text in cells:
+            tid = counter.call(".canvas", "create", "text", x0 + 30, y0 + 10, "-text", text, "-tags", "cell_content")
+            counter.call(".canvas", "bbox", tid)
+
+    batch = CanvasBatch(canvas)
+
+    def batched():
+        with batch.batched():
+            for x0, y0, text in cells:
+                batch.clip(batch.create('text', x0 + 30, y0 + 10, text=text, tags="cell_content"), 60)
+    results = {}
+    for label, fnc in (('per call', per_call), ('batched', batched)):
+        ncalls = counter.ncalls
+        results[label] = timeit(fnc)
+        print(f"Paint {len(cells)} cells, {label:<8}: {results[label] * 1000:8.2f} ms, "
+              f"{(counter.ncalls - ncalls) // 3} Tcl crossings")
+    return results
+
+
+def bench_headless_paint(width: int=1200, height: int=800, nsteps: int=50):
+    """Layout and paint of the sheet on the recording canvas, without a display: first frame, scroll steps and
+    the snapshot export."""
+    import logging
+    from worksheetui import HeadlessSheetUI
+    logging.getLogger().setLevel(logging.INFO)
+    ui = HeadlessSheetUI(width, height)
+    start = time.perf_counter()
+    ui.redraw_sheet(width=width, height=height)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for step in range(nsteps):
+        ui.yview('scroll', '1' if step % 2 == 0 else '-1', 'units')
+    scroll = (time.perf_counter() - start) / nsteps
+    svg, ppm = timeit(ui.export_svg), timeit(ui.export_ppm)
+    print(f"Headless {width}x{height}: first frame {first * 1000:.1f} ms ({len(ui.items)} items), "
+          f"scroll step {scroll * 1000:.2f} ms, svg {svg * 1000:.1f} ms, ppm {ppm * 1000:.1f} ms")
+    return first, scroll
+
+
+def bench_snapshot(width: int=1200, height: int=800):
+    """Snapshot digest of a drawn frame, taken after every macro step, against a full dump of the items. The
+    hashes of the items not redrawn by the step are taken from the previous snapshot."""
+    import logging
+    from worksheetui import HeadlessSheetUI
+    logging.getLogger().setLevel(logging.INFO)
+    ui = HeadlessSheetUI(width, height)
+    ui.redraw_sheet(width=width, height=height)
+    cold = timeit(lambda: ui.snapshot_hashes.clear() or ui.snapshot(), repeat=10)
+    digest = float('inf')
+    for y in range(1, 11):
+        ui.set_cell(2, y, 'edited')
+        digest = min(digest, timeit(ui.snapshot, repeat=1))
+    dump = timeit(lambda: repr(sorted(map(repr, ui.item_records()))), repeat=10)
+    line = ui.snapshot().to_line()
+    print(f"Snapshot of {len(ui.items)} items: digest {cold * 1000:.2f} ms, after a cell edit {digest * 1000:.2f} ms "
+          f"({len(line)} bytes), full dump {dump * 1000:.2f} ms ({len(repr(ui.item_records()))} bytes)")
+    return digest, dump
+
+
+def bench_event_recorder(nevents: int=100_000):
+    """Recording of a fast drag: structured records in the ring buffer, then saved as JSONL and binary, and
+    rendered as text actions only on demand."""
+    import tkinter
+    from eventrec import EventRing, record_event, save_binary, save_jsonl, to_action
+    event = tkinter.Event()
+    event.type, event.widget, event.state, event.keysym, event.num, event.delta = (
+        tkinter.EventType.Motion, ".!frame.sheetui", 0x100, "??", "??", 0)
+    ring = EventRing()
+
+    def record():
+        for n in range(nevents):
+            event.x, event.y = n % 800, n % 600
+            ring.append(record_event(event))
+    per_event = timeit(record, repeat=1) / nevents
+    render = timeit(lambda: list(map(to_action, ring)), repeat=1) / len(ring)
+    with tempfile.TemporaryDirectory() as tmp:
+        sizes = {}
+        for ext, save in (('jsonl', save_jsonl), ('evb', save_binary)):
+            fname = os.path.join(tmp, f"events.{ext}")
+            elapsed = timeit(lambda: save(fname, ring), repeat=1)
+            sizes[ext] = (os.path.getsize(fname), elapsed)
+    print(f"Record {nevents} events: {per_event * 1e6:.2f} us/event, render {render * 1e6:.2f} us/event, "
+          + ", ".join(f"{ext} {size / len(ring):.0f} B/event in {elapsed * 1000:.0f} ms" for ext, (size, elapsed) in sizes.items()))
+    return per_event, render
+
+
+def main():
+    bench_range_functions()
+    bench_parallel_recalc()
+    bench_formula_shift()
+    bench_search_shift()
+    bench_frozen_scroll()
+    bench_named_ranges()
+    bench_style_runs()
+    bench_conditional_formats()
+    bench_number_formats()
+    bench_clipboard()
+    bench_autofit()
+    bench_tcl_batch()
+    bench_headless_paint()
+    bench_snapshot()
+    bench_event_recorder()
+
+
+if __name__ == '__main__':
+    main()
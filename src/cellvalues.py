@@ -0,0 +1,27 @@
+''' Este módulo reúne las conversiones de los valores de las celdas que comparten los módulos de la hoja
+    (formato condicional, formatos de número, edición y reemplazo de celdas...).
+'''
+import re
+from typing import Any
+
+NUMBER_TEXT = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+
+
+def number(value: Any) -> float | None:
+    """Returns value as a float (numeric strings included), None if it is not a number."""
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+        return float(value)
+    return None
+
+
+def parse_input(value: Any) -> Any:
+    """Returns the value written in a cell as it is stored: numeric text as an int or a float, anything else
+    (text, formulas) as it is."""
+    if isinstance(value, str) and NUMBER_TEXT.fullmatch(text := value.strip()):
+        return float(text) if any(c in text for c in '.eE') else int(text)
+    return value
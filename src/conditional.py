@@ -0,0 +1,213 @@
+''' Este módulo implementa el formato condicional de la hoja de cálculo.
+    Las reglas (umbrales, escalas de color, barras de datos y duplicados) se evalúan solo para las celdas
+    que se dibujan. Las estadísticas del rango que necesita una regla (mínimo y máximo, recuento de valores)
+    se guardan en caché y se invalidan de forma incremental con las escrituras.
+'''
+import collections
+import operator
+from typing import Any, Literal, NamedTuple
+
+from aggregates import AggregateIndex
+from cellvalues import number
+from ranges import intersects, shift_span
+
+CF_SCALE_STEPS = 32     # Colours of a colour scale, so that the scaled styles stay few once interned
+
+OPERATORS = {
+    '>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '==': operator.eq, '!=': operator.ne,
+    'between': lambda value, lo, hi: lo <= value <= hi,
+}
+
+Kind = Literal['threshold', 'scale', 'bar', 'duplicates']
+
+
+class Rule(NamedTuple):
+    kind: Kind
+    rect: tuple[int, int, int, int]                 # (x0, y0, x1, y1) storage cells
+    op: str = '>'                                   # Threshold operator, see OPERATORS
+    value: float = 0.0
+    value2: float = 0.0                             # Upper bound of the 'between' threshold
+    background: str | None = "#ffc7ce"              # Background of the threshold and duplicates matches
+    fill: str | None = None                         # Text color of the threshold and duplicates matches
+    colors: tuple[str, str] = ("#f8696b", "#63be7b")    # Scale colours of the minimum and the maximum, bar colour
+
+
+def value_key(value: Any) -> Any:
+    """Returns the key comparing the values for duplicates: numbers by value, text without case."""
+    if (answ := number(value)) is not None:
+        return answ
+    return value.casefold() if isinstance(value, str) and value else None
+
+
+def blend(color0: str, color1: str, t: float) -> str:
+    """Interpolates the #rrggbb colours, t is quantized to CF_SCALE_STEPS steps."""
+    t = round(max(0.0, min(1.0, t)) * (CF_SCALE_STEPS - 1)) / (CF_SCALE_STEPS - 1)
+    rgb0 = [int(color0[i: i + 2], 16) for i in (1, 3, 5)]
+    rgb1 = [int(color1[i: i + 2], 16) for i in (1, 3, 5)]
+    return "#" + "".join(f"{round(c0 + (c1 - c0) * t):02x}" for c0, c1 in zip(rgb0, rgb1))
+
+
+class ConditionalFormats:
+    """Conditional formatting rules over ranges of a SheetStore.
+
+    format() evaluates the rules covering a cell when it is drawn. The minimum and maximum used by the colour
+    scales and data bars come from the AggregateIndex and are cached per rule until a write or recalculation
+    touches its range. The value counts of the duplicates rules are built on the first draw and then updated
+    cell by cell. Structural edits shift the rule ranges; the rules changed by the last delete are saved in
+    clipped, so that undo can restore them.
+    """
+    def __init__(self, store, formulas=None, aggregates: AggregateIndex=None):
+        self.store = store
+        self.aggregates = aggregates if aggregates is not None else AggregateIndex(store, formulas)
+        self.rules: dict[int, Rule] = {}
+        self.next_id = 1
+        self.stats: dict[int, tuple[float, float] | None] = {}              # Rule id -> (min, max)
+        self.counts: dict[int, tuple[dict, collections.Counter]] = {}       # Rule id -> (cell -> key, key counts)
+        self.clipped: list[tuple[int, Rule]] = []                          # (rule id, rule) before the last delete
+        store.add_listener(self.on_store_changed)
+        if formulas is not None:
+            formulas.add_listener(self.on_formulas_recalc)
+
+    def add(self, rule: Rule) -> int:
+        rid, self.next_id = self.next_id, self.next_id + 1
+        self.rules[rid] = rule
+        return rid
+
+    def remove(self, rid: int):
+        self.rules.pop(rid, None)
+        self.forget(rid)
+
+    def forget(self, rid: int):
+        """Drops the cached statistics of the rule."""
+        self.stats.pop(rid, None)
+        self.counts.pop(rid, None)
+
+    def restore(self, rules: list[tuple[int, Rule]]):
+        """Restores the (rule id, rule) pairs returned by clipped or to_list."""
+        for rid, rule in rules:
+            self.rules[rid] = rule
+            self.forget(rid)
+            self.next_id = max(self.next_id, rid + 1)
+
+    def covers(self, x: int, y: int) -> bool:
+        return any(r[0] <= x <= r[2] and r[1] <= y <= r[3] for r in (rule.rect for rule in self.rules.values()))
+
+    def range_stats(self, rid: int) -> tuple[float, float] | None:
+        """Returns the cached (min, max) of the numeric values in the range of the rule."""
+        if rid not in self.stats:
+            total, count, lo, hi = self.aggregates.query(*self.rules[rid].rect)
+            self.stats[rid] = (lo, hi) if count else None
+        return self.stats[rid]
+
+    def duplicate_counts(self, rid: int) -> tuple[dict, collections.Counter]:
+        """Returns the cached (cell -> value key, value key counts) of the range of the rule."""
+        if rid not in self.counts:
+            x0, y0, x1, y1 = self.rules[rid].rect
+            y1 = min(y1, self.store.nrows)
+            keys, counts = {}, collections.Counter()
+            for x in range(x0, min(x1, self.store.ncols) + 1):
+                for y, value in enumerate(self.aggregates.values(x, y0, y1) if y0 <= y1 else (), start=y0):
+                    if (key := value_key(value)) is not None:
+                        keys[(x, y)] = key
+                        counts[key] += 1
+            self.counts[rid] = keys, counts
+        return self.counts[rid]
+
+    def format(self, x: int, y: int, value: Any) -> dict:
+        """Returns the options the rules covering the (x, y) storage cell give to its value: background, fill
+        and bar, a (fraction, colour) data bar. The first rule giving an option wins."""
+        answ = {}
+        for rid, rule in self.rules.items():
+            r = rule.rect
+            if not (r[0] <= x <= r[2] and r[1] <= y <= r[3]):
+                continue
+            options = {}
+            if rule.kind == 'duplicates':
+                keys, counts = self.duplicate_counts(rid)
+                if counts[keys.get((x, y))] > 1:
+                    options = dict(background=rule.background, fill=rule.fill)
+            elif (num := number(value)) is None:
+                continue
+            elif rule.kind == 'threshold':
+                bounds = (rule.value, rule.value2) if rule.op == 'between' else (rule.value,)
+                if OPERATORS[rule.op](num, *bounds):
+                    options = dict(background=rule.background, fill=rule.fill)
+            elif (stats := self.range_stats(rid)) is not None:
+                lo, hi = stats
+                t = (num - lo) / (hi - lo) if hi > lo else 1.0
+                if rule.kind == 'scale':
+                    options = dict(background=blend(*rule.colors, t))
+                else:
+                    options = dict(bar=(t, rule.colors[1]))
+            for key, option in options.items():
+                if option is not None:
+                    answ.setdefault(key, option)
+        return answ
+
+    def depends(self, x0: int, y0: int, x1: int, y1: int) -> list[tuple[int, int, int, int]]:
+        """Returns the ranges of the rules whose format depends on the whole range and intersect x0:x1, y0:y1."""
+        return [
+            rule.rect for rule in self.rules.values()
+            if rule.kind != 'threshold' and intersects(rule.rect, (x0, y0, x1, y1))
+        ]
+
+    def update_rule(self, rid: int, cells):
+        """Invalidates the (min, max) of the rule and updates its value counts with the written cells."""
+        self.stats.pop(rid, None)
+        if (cached := self.counts.get(rid)) is not None:
+            keys, counts = cached
+            for x, y in cells:
+                if (key := keys.pop((x, y), None)) is not None:
+                    counts[key] -= 1
+                if (key := value_key(self.aggregates.values(x, y, y)[0])) is not None:
+                    keys[(x, y)] = key
+                    counts[key] += 1
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: updates the statistics of the written rules and shifts the rules on structural edits."""
+        if not self.rules:
+            return
+        if kind in ('set', 'append'):
+            for rid, rule in self.rules.items():
+                r = rule.rect
+                if intersects(r, (x0, y0, x1, y1)):
+                    self.update_rule(rid, [
+                        (x, y) for x in range(max(x0, r[0]), min(x1, r[2]) + 1)
+                        for y in range(max(y0, r[1]), min(y1, r[3]) + 1)
+                    ] if rid in self.counts else ())
+            return
+        self.clipped = []
+        axis = 0 if kind.endswith('cols') else 1
+        start, end = ((x0, x1), (y0, y1))[axis]
+        n = (end - start + 1) * (1 if kind.startswith('insert') else -1)
+        for rid, rule in list(self.rules.items()):
+            self.forget(rid)
+            r = rule.rect
+            span = shift_span(r[axis], r[axis + 2], start, n)
+            if n < 0 and (span is None or span[1] - span[0] != r[axis + 2] - r[axis]):
+                self.clipped.append((rid, rule))
+            if span is None:
+                del self.rules[rid]
+            else:
+                rect = (span[0], r[1], span[1], r[3]) if axis == 0 else (r[0], span[0], r[2], span[1])
+                self.rules[rid] = rule._replace(rect=rect)
+
+    def on_formulas_recalc(self, cells: list[tuple[int, int]]):
+        """Formula engine listener: updates the statistics of the rules covering the recalculated cells."""
+        for rid, rule in self.rules.items():
+            r = rule.rect
+            if touched := [(x, y) for x, y in cells if r[0] <= x <= r[2] and r[1] <= y <= r[3]]:
+                self.update_rule(rid, touched)
+
+    def to_list(self) -> list:
+        """Returns the rules as a json serializable list."""
+        return [[rid, list(rule)] for rid, rule in self.rules.items()]
+
+    def load(self, rules: list):
+        """Restores the rules returned by to_list."""
+        self.rules.clear()
+        self.stats.clear()
+        self.counts.clear()
+        for rid, (kind, rect, *params) in rules:
+            rule = Rule(kind, tuple(rect), *params)
+            self.restore([(rid, rule._replace(colors=tuple(rule.colors)))])
@@ -0,0 +1,155 @@
+''' Este módulo implementa el grabador de eventos de las macros.
+    Cada evento se guarda como un registro estructurado en un buffer circular en memoria, sin convertirlo a
+    texto. Los registros se guardan en JSONL o en un formato binario compacto (.evb) y se convierten a las
+    líneas de macro de texto (event_generate) solo cuando se muestran en la consola o se exportan.
+
+    Estructura del archivo binario:
+        cabecera  -> HEADER (magic, version, nstrings, nrecords)
+        cadenas   -> nstrings veces: longitud uint16, utf-8 (tipos, rutas de widget y keysyms)
+        registros -> nrecords RECORD (índices de las cadenas, x, y, state, num, delta, width, height, time)
+'''
+import collections
+import json
+import struct
+import time
+from typing import Iterable, NamedTuple
+
+EVENT_RING_SIZE = 65536     # Records kept by the recorder, the oldest are dropped
+EVENT_RENDER_MS = 250       # Throttle of the recorder status shown while recording
+
+MAGIC = b'SHEVENTS'
+VERSION = 1
+HEADER = struct.Struct('<8sIII')
+STRING_LEN = struct.Struct('<H')
+RECORD = struct.Struct('<HHHiiIhiiid')
+
+BUTTON_EVENTS = ('ButtonPress', 'ButtonRelease')
+
+
+class EventRecord(NamedTuple):
+    kind: str           # Event type name: ButtonPress, KeyPress, Motion, Configure...
+    widget: str         # Widget path
+    x: int = 0
+    y: int = 0
+    state: int = 0      # Modifiers mask. For Configure 1 if the toplevel is zoomed
+    keysym: str = ''
+    num: int = 0        # Mouse button
+    delta: int = 0      # Mouse wheel
+    width: int = 0      # Configure: toplevel geometry, x and y hold its position
+    height: int = 0
+    time: float = 0.0   # time.monotonic() seconds
+
+
+def int_field(value) -> int:
+    """Returns the event field as an int, 0 for the fields Tk does not fill ('??')."""
+    return value if isinstance(value, int) else 0
+
+
+def record_event(event) -> EventRecord:
+    """Returns the record of a Tk event. The Configure events record the geometry of the toplevel, the one
+    restored when the macro runs."""
+    kind = getattr(event.type, 'name', str(event.type))
+    if kind == 'Configure':
+        top = event.widget.winfo_toplevel()
+        return EventRecord(kind, str(top), top.winfo_x(), top.winfo_y(), int(top.state() == 'zoomed'),
+                           width=top.winfo_width(), height=top.winfo_height(), time=time.monotonic())
+    keysym = event.keysym if isinstance(event.keysym, str) and event.keysym != '??' else ''
+    return EventRecord(kind, str(event.widget), int_field(event.x), int_field(event.y), int_field(event.state),
+                       keysym, int_field(event.num), int_field(event.delta), time=time.monotonic())
+
+
+class EventRing:
+    """Ring buffer of the last EVENT_RING_SIZE records. total counts all the records appended, so that a
+    reader remembering the count it reached gets the new records with since()."""
+    def __init__(self, capacity: int=EVENT_RING_SIZE):
+        self.records: collections.deque[EventRecord] = collections.deque(maxlen=capacity)
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def append(self, record: EventRecord):
+        self.records.append(record)
+        self.total += 1
+
+    def extend(self, records: Iterable[EventRecord]):
+        for record in records:
+            self.append(record)
+
+    def clear(self):
+        self.records.clear()
+        self.total = 0
+
+    def since(self, count: int) -> tuple[int, list[EventRecord]]:
+        """Returns the records appended after the first count ones: (records dropped by the ring, records)."""
+        first = self.total - len(self.records)
+        dropped = max(0, first - count)
+        return dropped, list(self.records)[max(0, count - first):]
+
+
+def to_action(record: EventRecord) -> str:
+    """Returns the text macro line replaying the record (see MacrosUI.action_cmds)."""
+    if record.kind == 'Configure':
+        # <Configure> is a system event, Tk ignores the attempts to generate it: the geometry is set instead
+        if record.state:
+            return 'self.state("zoomed")'
+        return f'self.state("normal")\nself.geometry("{record.width}x{record.height}+{record.x}+{record.y}")'
+    sequence = f"{record.kind}-{record.num}" if record.kind in BUTTON_EVENTS else record.kind
+    kwargs = []
+    if record.state:
+        kwargs.append(f"state=0x{record.state:05x}")
+    if record.keysym:
+        kwargs.append(f"keysym='{record.keysym}'")
+    if record.delta:
+        kwargs.append(f"delta={record.delta}")
+    kwargs += [f"x={record.x}", f"y={record.y}"]
+    return f"{record.widget.rsplit('.', 1)[-1]}.event_generate('<{sequence}>', {', '.join(kwargs)})"
+
+
+def save_jsonl(fname: str, records: Iterable[EventRecord]):
+    with open(fname, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record._asdict(), separators=(',', ':')) + '\n')
+
+
+def load_jsonl(fname: str) -> list[EventRecord]:
+    with open(fname) as f:
+        return [EventRecord(**json.loads(line)) for line in f if line.strip()]
+
+
+def save_binary(fname: str, records: Iterable[EventRecord]):
+    """Writes the records in the binary format, the strings once in the string table."""
+    strings: dict[str, int] = {}
+    packed = []
+    for r in records:
+        ndxs = [strings.setdefault(text, len(strings)) for text in (r.kind, r.widget, r.keysym)]
+        packed.append(RECORD.pack(*ndxs, r.x, r.y, r.state, r.num, r.delta, r.width, r.height, r.time))
+    with open(fname, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(strings), len(packed)))
+        for text in strings:
+            blob = text.encode('utf-8')
+            f.write(STRING_LEN.pack(len(blob)) + blob)
+        f.write(b''.join(packed))
+
+
+def load_binary(fname: str) -> list[EventRecord]:
+    """Reads the records written by save_binary. Raises ValueError if the file is not an event file."""
+    with open(fname, 'rb') as f:
+        data = f.read()
+    magic, version, nstrings, nrecords = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{fname} is not an event records file")
+    offset, strings = HEADER.size, []
+    for _ in range(nstrings):
+        length, = STRING_LEN.unpack_from(data, offset)
+        offset += STRING_LEN.size
+        strings.append(data[offset: offset + length].decode('utf-8'))
+        offset += length
+    return [
+        EventRecord(strings[kind], strings[widget], x, y, state, strings[keysym], num, delta, width, height, t)
+        for kind, widget, keysym, x, y, state, num, delta, width, height, t
+        in RECORD.iter_unpack(data[offset: offset + nrecords * RECORD.size])
+    ]
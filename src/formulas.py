@@ -0,0 +1,714 @@
+''' Este módulo implementa el motor de fórmulas de la hoja de cálculo.
+    Las fórmulas usan el direccionamiento de la hoja (C<columna>R<fila>), p.ej. "=SUM(C1R1:C1R100) * 2".
+    Un grafo de dependencias permite recalcular solo los dependientes transitivos de una celda modificada.
+'''
+import ast
+import collections
+import functools
+import math
+import multiprocessing
+import os
+import queue
+import re
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, the ranges are aggregated in python without it
+    np = None
+
+RANGE_BUCKET = 1024     # Rows per bucket in the index of range dependencies
+RANGE_CHUNK = 65536     # Rows per column chunk when aggregating a range
+TEMPLATE_CACHE = 4096   # Compiled formula templates kept in memory
+PARALLEL_MIN_CELLS = 4096               # Dirty formulas needed to split the recalculation among workers
+PARALLEL_WORKERS = os.cpu_count() or 1  # Workers per pool
+
+TOKEN = re.compile(r'''\s*(?:
+    (?P<range>C(\d+)R(\d+):C(\d+)R(\d+)) |
+    (?P<ref>C(\d+)R(\d+)) |
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?) |
+    (?P<string>"(?:[^"]|"")*") |
+    (?P<referr>\#REF!) |
+    (?P<name>[A-Za-z_]\w*)(?=\s*\() |
+    (?P<op><=|>=|<>|[-+*/^(),<>=%])
+    )''', re.X | re.I)
+
+OPERATORS = {'^': '**', '<>': '!=', '=': '==', '%': '/100'}
+
+
+class FormulaError(Exception):
+    """Error value of a formula, e.g. FormulaError('#DIV/0!')."""
+
+
+class ErrorValue(str):
+    """Error code computed by a formula, e.g. ErrorValue('#DIV/0!'). Tells the errors apart from text values
+    starting with '#'."""
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class CellRange:
+    """Lazy range argument of a formula function. The aggregate functions reduce it column by column in chunks:
+    typed (float) columns of the base source are reduced with numpy, any other column is iterated in python."""
+    def __init__(self, engine: 'FormulaEngine', x0: int, y0: int, x1: int, y1: int):
+        self.engine = engine
+        self.area = (x0, y0, x1, y1)
+
+    def __iter__(self):
+        x0, y0, x1, y1 = self.area
+        for x in range(x0, x1 + 1):
+            for cy0 in range(y0, y1 + 1, RANGE_CHUNK):
+                yield from self.engine.column_values(x, cy0, min(y1, cy0 + RANGE_CHUNK - 1))
+
+    def aggregate(self) -> tuple[float, int, float | None, float | None]:
+        """Returns (sum, count, min, max) of the numeric values in the range."""
+        x0, y0, x1, y1 = self.area
+        total, count, lo, hi = 0, 0, None, None
+        for x in range(x0, x1 + 1):
+            for cy0 in range(y0, y1 + 1, RANGE_CHUNK):
+                cy1 = min(y1, cy0 + RANGE_CHUNK - 1)
+                data = self.engine.store.column_array(x, cy0, cy1) if np is not None else None
+                if data is not None:
+                    data = data[~np.isnan(data)]
+                    if not len(data):
+                        continue
+                    part = (float(data.sum()), len(data), float(data.min()), float(data.max()))
+                else:
+                    values = [value for value in self.engine.column_values(x, cy0, cy1) if _is_number(value)]
+                    if not values:
+                        continue
+                    part = (sum(values), len(values), min(values), max(values))
+                total, count = total + part[0], count + part[1]
+                lo = part[2] if lo is None else min(lo, part[2])
+                hi = part[3] if hi is None else max(hi, part[3])
+        return total, count, lo, hi
+
+
+def _aggregate(args: Iterable[Any]) -> tuple[float, int, float | None, float | None]:
+    """Returns (sum, count, min, max) of the numeric values in the function arguments."""
+    total, count, lo, hi = 0, 0, None, None
+    for arg in args:
+        if isinstance(arg, CellRange):
+            part = arg.aggregate()
+        elif _is_number(arg):
+            part = (arg, 1, arg, arg)
+        else:
+            continue
+        if part[1]:
+            total, count = total + part[0], count + part[1]
+            lo = part[2] if lo is None else min(lo, part[2])
+            hi = part[3] if hi is None else max(hi, part[3])
+    return total, count, lo, hi
+
+
+def _average(*args):
+    total, count, lo, hi = _aggregate(args)
+    if not count:
+        raise FormulaError('#DIV/0!')
+    return total / count
+
+
+FUNCTIONS: dict[str, Callable] = {
+    'SUM': lambda *args: _aggregate(args)[0],
+    'AVERAGE': _average,
+    'MIN': lambda *args: _aggregate(args)[2] or 0,
+    'MAX': lambda *args: _aggregate(args)[3] or 0,
+    'COUNT': lambda *args: _aggregate(args)[1],
+    'ABS': abs,
+    'ROUND': lambda value, ndigits=0: round(value, int(ndigits)),
+}
+
+
+def is_formula(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith('=') and len(value) > 1
+
+
+def tokenize(text: str) -> list[tuple[str, re.Match]]:
+    """Splits the formula text (without the leading '=') in (kind, match) tokens."""
+    tokens = []
+    pos, text = 0, text.rstrip()
+    while pos < len(text):
+        m = TOKEN.match(text, pos)
+        if not m or m.end() == pos:
+            raise FormulaError('#ERROR!')
+        tokens.append((m.lastgroup, m))
+        pos = m.end()
+    return tokens
+
+
+def parse(text: str, host: tuple[int, int]) -> tuple[str, set[tuple[int, int]], list[tuple[int, int, int, int]]]:
+    """Translates the formula in the host cell to a python expression template with the references relative
+    to the host cell (_x, _y). Returns (template, references, ranges)."""
+    hx, hy = host
+    refs, ranges, expr = set(), [], []
+    # calls: the open parentheses, True for the function calls; signs: parenthesis depth of the unary signs
+    # waiting for their operand
+    calls, signs, prev = [], [], None
+
+    def operand_done():
+        # A unary sign binds tighter than '^' (-2^2 = 4): the sign and its operand are closed in parentheses
+        while signs and signs[-1] == len(calls):
+            signs.pop()
+            expr.append(')')
+
+    for kind, m in tokenize(text[1:]):
+        if kind == 'range':
+            x0, y0, x1, y1 = map(int, m.group(2, 3, 4, 5))
+            x0, x1, y0, y1 = min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1)
+            ranges.append((x0, y0, x1, y1))
+            expr.append(f"_rng(_x{x0 - hx:+d}, _y{y0 - hy:+d}, _x{x1 - hx:+d}, _y{y1 - hy:+d})")
+            operand_done()
+        elif kind == 'ref':
+            x, y = map(int, m.group(7, 8))
+            refs.add((x, y))
+            expr.append(f"_ref(_x{x - hx:+d}, _y{y - hy:+d})")
+            operand_done()
+        elif kind == 'name':
+            name = m.group(kind).upper()
+            if name not in FUNCTIONS:
+                raise FormulaError('#NAME?')
+            expr.append(f"_fnc[{name!r}]")
+        elif kind == 'op':
+            op = m.group(kind)
+            if op in ('+', '-') and (prev is None or (prev[0] == 'op' and prev[1] not in (')', '%'))):
+                expr.append('(' + op)
+                signs.append(len(calls))
+            else:
+                # Commas only separate function arguments: (1,2) would be a python tuple
+                if op == ',' and not (calls and calls[-1]):
+                    raise FormulaError('#ERROR!')
+                if op == ')' and (not calls or (not calls[-1] and prev == ('op', '('))):
+                    raise FormulaError('#ERROR!')
+                expr.append(OPERATORS.get(op, op))
+                if op == '(':
+                    calls.append(prev is not None and prev[0] == 'name')
+                elif op == ')':
+                    calls.pop()
+                    operand_done()
+        elif kind == 'string':
+            expr.append(repr(m.group(kind)[1:-1].replace('""', '"')))
+            operand_done()
+        elif kind == 'referr':
+            # Reference clipped by a delete (see FormulaEngine.shift)
+            raise FormulaError('#REF!')
+        else:
+            expr.append(m.group(kind))
+            operand_done()
+        prev = (kind, m.group(kind))
+    return ' '.join(expr), refs, ranges
+
+
+def _pow(base, exponent):
+    """The '^' operator. Numbers are raised as floats, so that huge powers overflow (#NUM!) instead of growing an
+    exact integer; the integer powers a float holds exactly stay integers."""
+    if not (_is_number(base) and _is_number(exponent)):
+        return base ** exponent
+    if base == 0 and exponent < 0:
+        raise ZeroDivisionError
+    try:
+        answ = math.pow(base, exponent)
+    except ValueError:      # Negative base and fractional exponent
+        raise FormulaError('#NUM!')
+    if isinstance(base, int) and isinstance(exponent, int) and exponent >= 0 and abs(answ) < 2 ** 53:
+        return base ** exponent
+    return answ
+
+
+class PowerCalls(ast.NodeTransformer):
+    """Rewrites the '**' operators of a compiled template as _pow calls, keeping the python precedence."""
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            return ast.Call(ast.Name('_pow', ast.Load()), [node.left, node.right], [])
+        return node
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE)
+def compile_template(template: str) -> Callable:
+    """Compiles a formula template once. Copied formulas with relative references share the same template.
+    The '**' operators are compiled as _pow calls."""
+    tree = ast.parse(f"lambda _x, _y, _ref, _rng, _fnc: {template}", mode='eval')
+    if not isinstance(tree.body, ast.Lambda) or any(isinstance(node, ast.Tuple) for node in ast.walk(tree)):
+        raise FormulaError('#ERROR!')
+    tree = ast.fix_missing_locations(PowerCalls().visit(tree))
+    fnc = eval(compile(tree, '<formula>', 'eval'), {'__builtins__': {}, '_pow': _pow})
+    fnc.template = template
+    return fnc
+
+
+def compile_formula(text: str, host: tuple[int, int]) -> tuple[Callable, set, list]:
+    """Returns (function, references, ranges) for the formula in the host cell. Invalid formulas compile
+    to a function raising its error code."""
+    try:
+        template, refs, ranges = parse(text, host)
+        return compile_template(template), refs, ranges
+    except FormulaError as e:
+        error = e
+    except SyntaxError:
+        error = FormulaError('#ERROR!')
+
+    def fnc(*args):
+        raise error
+    fnc.template = None
+    return fnc, set(), []
+
+
+def evaluate_formula(fnc: Callable, cell: tuple[int, int], _ref: Callable, _rng: Callable) -> Any:
+    """Evaluates a compiled formula in cell, returning its value or an error code."""
+    try:
+        value = fnc(*cell, _ref, _rng, FUNCTIONS)
+    except FormulaError as e:
+        return ErrorValue(e)
+    except ZeroDivisionError:
+        return ErrorValue('#DIV/0!')
+    except OverflowError:
+        return ErrorValue('#NUM!')
+    except Exception:
+        return ErrorValue('#ERROR!')
+    if isinstance(value, float) and not math.isfinite(value):
+        return ErrorValue('#NUM!')
+    if isinstance(value, CellRange):
+        # A bare range (=C1R1:C1R2) is only valid as a function argument
+        return ErrorValue('#VALUE!')
+    return value
+
+
+def evaluate_batch(formulas: list[tuple[tuple[int, int], str]], inputs: dict[tuple[int, int], Any]) -> list[Any]:
+    """Process pool task: evaluates the (cell, template) formulas, in topological order and without ranges.
+    inputs holds the values of the referenced cells outside the batch (FormulaError instances for error values)."""
+    values = dict(inputs)
+
+    def _ref(x, y):
+        value = values.get((x, y))
+        if isinstance(value, FormulaError):
+            raise value
+        return 0 if value is None else value
+
+    answ = []
+    for cell, template in formulas:
+        value = evaluate_formula(compile_template(template), cell, _ref, None)
+        values[cell] = FormulaError(value) if isinstance(value, ErrorValue) else value
+        answ.append(value)
+    return answ
+
+
+_executors = {}
+
+
+def executor(kind: str):
+    """Returns the shared 'thread' or 'process' worker pool, creating it on first use."""
+    if kind not in _executors:
+        if kind == 'thread':
+            _executors[kind] = ThreadPoolExecutor(PARALLEL_WORKERS, thread_name_prefix='recalc')
+        else:
+            # Workers are spawned: forking a process holding a Tk interpreter is not safe
+            _executors[kind] = ProcessPoolExecutor(PARALLEL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executors[kind]
+
+
+def shutdown_executors():
+    while _executors:
+        _executors.popitem()[1].shutdown(wait=False, cancel_futures=True)
+
+
+class FormulaEngine:
+    """Keeps the dependency graph of the formulas in a SheetStore and their computed values.
+
+    The engine listens to the store: writing a formula text ("=...") registers the formula and writing any
+    cell recalculates only its transitive dependents, in topological order and with cycle detection.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.formulas: dict[tuple[int, int], tuple[str, set, list]] = {}    # cell -> (text, references, ranges)
+        self.compiled: dict[tuple[int, int], Callable] = {}            # cell -> compiled template
+        self.values: dict[tuple[int, int], Any] = {}
+        self.dependents = collections.defaultdict(set)                 # precedent cell -> formula cells
+        self.range_dependents = collections.defaultdict(set)           # (x, row bucket) -> {(range, cell)}
+        self.listeners: list[Callable[[list[tuple[int, int]]], None]] = []
+        self.clipped: list[tuple[tuple[int, int], str]] = []           # (cell, text) before the last shift clipped it
+        # Parallel recalculation: scheduler() asks for a later call to poll() (from the Tk event loop); without a
+        # scheduler the recalculation waits for the worker pools
+        self.scheduler: Callable[[], Any] | None = None
+        self.inflight: dict[Future, tuple[list[tuple[int, int]], int]] = {}   # future -> (batch cells, generation)
+        self.done = queue.SimpleQueue()                                # Finished futures, put by the workers
+        self.generation = 0                                            # Store changes seen, to detect stale batches
+        self.poll_scheduled = False
+        store.add_listener(self.on_store_changed)
+
+    def add_listener(self, fnc: Callable[[list[tuple[int, int]]], None]):
+        """Registers fnc(cells) to be called with the recalculated cells."""
+        self.listeners.append(fnc)
+
+    def value(self, x: int, y: int) -> Any:
+        return self.values.get((x, y))
+
+    def register(self, cell: tuple[int, int], text: str):
+        """Compiles the formula in cell and adds it to the dependency graph."""
+        self.link(cell, text, *compile_formula(text, cell))
+
+    def link(self, cell: tuple[int, int], text: str, fnc: Callable, refs: set, ranges: list):
+        """Adds the compiled formula in cell to the dependency graph."""
+        self.compiled[cell] = fnc
+        self.formulas[cell] = (text, refs, ranges)
+        for ref in refs:
+            self.dependents[ref].add(cell)
+        for rng in ranges:
+            x0, y0, x1, y1 = rng
+            for x in range(x0, x1 + 1):
+                for nbucket in range(y0 // RANGE_BUCKET, y1 // RANGE_BUCKET + 1):
+                    self.range_dependents[(x, nbucket)].add((rng, cell))
+
+    def unregister(self, cell: tuple[int, int]):
+        """Removes the formula in cell from the dependency graph."""
+        text, refs, ranges = self.formulas.pop(cell)
+        self.compiled.pop(cell)
+        self.values.pop(cell, None)
+        for ref in refs:
+            self.dependents[ref].discard(cell)
+            if not self.dependents[ref]:
+                del self.dependents[ref]
+        for rng in ranges:
+            x0, y0, x1, y1 = rng
+            for x in range(x0, x1 + 1):
+                for nbucket in range(y0 // RANGE_BUCKET, y1 // RANGE_BUCKET + 1):
+                    bucket = self.range_dependents[(x, nbucket)]
+                    bucket.discard((rng, cell))
+                    if not bucket:
+                        del self.range_dependents[(x, nbucket)]
+
+    def load(self, cells: Iterable[tuple[int, int]]):
+        """Registers the formulas stored in cells (e.g. after opening a worksheet file) and computes them."""
+        cells = [tuple(cell) for cell in cells]
+        for cell in cells:
+            if is_formula(text := self.store.get(*cell)):
+                self.register(cell, text)
+        self.recalc(cells)
+
+    def cell_dependents(self, cell: tuple[int, int]) -> set[tuple[int, int]]:
+        """Returns the formula cells that reference cell directly or through a range."""
+        x, y = cell
+        answ = set(self.dependents.get(cell, ()))
+        for (x0, y0, x1, y1), fcell in self.range_dependents.get((x, y // RANGE_BUCKET), ()):
+            if y0 <= y <= y1:
+                answ.add(fcell)
+        return answ
+
+    def topological_order(self, cells: Iterable[tuple[int, int]]) -> tuple[list[tuple[int, int]], set]:
+        """Returns the changed cells and their transitive dependents in topological order, and the cells in cycles."""
+        order, state, cycles = [], {}, set()
+        for root in cells:
+            if root in state:
+                continue
+            state[root] = 1
+            stack = [(root, iter(self.cell_dependents(root)))]
+            while stack:
+                node, deps = stack[-1]
+                for dep in deps:
+                    if (dep_state := state.get(dep)) is None:
+                        state[dep] = 1
+                        stack.append((dep, iter(self.cell_dependents(dep))))
+                        break
+                    elif dep_state == 1:
+                        # Back edge: the cells in the stack from dep to node are in a cycle
+                        nodes = [item[0] for item in stack]
+                        cycles.update(nodes[nodes.index(dep):])
+                else:
+                    stack.pop()
+                    state[node] = 2
+                    order.append(node)
+        order.reverse()
+        return order, cycles
+
+    def components(self, order: list[tuple[int, int]]) -> list[list[tuple[int, int]]]:
+        """Splits the dirty formula cells (in topological order) in independent connected components, each one
+        kept in topological order."""
+        parent = {cell: cell for cell in order}
+
+        def find(cell):
+            while parent[cell] != cell:
+                parent[cell] = parent[parent[cell]]
+                cell = parent[cell]
+            return cell
+
+        for cell in order:
+            for dep in self.cell_dependents(cell):
+                if dep in parent:
+                    parent[find(dep)] = find(cell)
+        groups = collections.defaultdict(list)
+        for cell in order:
+            groups[find(cell)].append(cell)
+        return list(groups.values())
+
+    def recalc(self, cells: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+        """Recomputes the transitive dependents of the changed cells and returns the recalculated cells."""
+        order, cycles = self.topological_order(cells)
+        recalculated = [cell for cell in order if cell in self.formulas]
+        if len(recalculated) >= PARALLEL_MIN_CELLS and not cycles and PARALLEL_WORKERS > 1:
+            self.recalc_parallel(recalculated)
+        else:
+            for cell in recalculated:
+                self.values[cell] = ErrorValue('#CYCLE!') if cell in cycles else self.evaluate(cell)
+        for fnc in self.listeners:
+            fnc(recalculated)
+        return recalculated
+
+    def recalc_parallel(self, order: list[tuple[int, int]]):
+        """Evaluates the independent components of the dirty cells on the worker pools: components with ranges
+        on threads (numpy releases the GIL), the rest on processes, which receive the compiled templates and the
+        values of their inputs. The results are merged in the caller (Tk) thread by poll()."""
+        batches = {'thread': [[]], 'process': [[]]}
+        batch_size = -(-len(order) // (4 * PARALLEL_WORKERS))
+        for component in self.components(order):
+            ranges = any(self.formulas[cell][2] or self.compiled[cell].template is None for cell in component)
+            kind = 'thread' if ranges else 'process'
+            batch = batches[kind][-1]
+            batch.extend(component)
+            if len(batch) >= batch_size:
+                batches[kind].append([])
+        futures = {}
+        for batch in filter(None, batches['process']):
+            in_batch = set(batch)
+            inputs = {}
+            for cell in batch:
+                for ref in self.formulas[cell][1]:
+                    if ref not in in_batch and ref not in inputs:
+                        try:
+                            inputs[ref] = self.cell_value(*ref)
+                        except FormulaError as e:
+                            inputs[ref] = e
+            formulas = [(cell, self.compiled[cell].template) for cell in batch]
+            futures[executor('process').submit(evaluate_batch, formulas, inputs)] = batch
+        for batch in filter(None, batches['thread']):
+            formulas = [(cell, self.compiled[cell]) for cell in batch]
+            futures[executor('thread').submit(BatchScope(self).evaluate_batch, formulas)] = batch
+        if self.scheduler is None:
+            for future, batch in futures.items():
+                self.merge(batch, future)
+            return
+        for future, batch in futures.items():
+            self.inflight[future] = (batch, self.generation)
+            future.add_done_callback(self.done.put)
+        self.schedule_poll()
+
+    def schedule_poll(self):
+        if not self.poll_scheduled:
+            self.poll_scheduled = True
+            self.scheduler()
+
+    def merge(self, batch: list[tuple[int, int]], future: Future):
+        """Stores the values computed by a finished batch. A failed batch is evaluated in this thread."""
+        try:
+            self.values.update(zip(batch, future.result()))
+        except Exception:
+            for cell in batch:
+                self.values[cell] = self.evaluate(cell)
+
+    def poll(self) -> list[tuple[int, int]]:
+        """Merges the finished parallel batches and notifies the listeners. The batches that started before a
+        later store change are recalculated again. Returns the merged cells, polling again while batches are
+        in flight."""
+        self.poll_scheduled = False
+        merged, stale = [], []
+        while not self.done.empty():
+            future = self.done.get()
+            if (entry := self.inflight.pop(future, None)) is None:
+                continue        # Dropped by a structural edit
+            batch, generation = entry
+            if generation != self.generation:
+                stale.extend(cell for cell in batch if cell in self.formulas)
+                continue
+            self.merge(batch, future)
+            merged.extend(batch)
+        if merged:
+            for fnc in self.listeners:
+                fnc(merged)
+        if stale:
+            merged.extend(self.recalc(stale))
+        if self.inflight:
+            self.schedule_poll()
+        return merged
+
+    def cell_value(self, x: int, y: int) -> Any:
+        """Returns the value of the cell as seen by the formulas."""
+        if (x, y) in self.formulas:
+            value = self.values.get((x, y))
+            if isinstance(value, ErrorValue):
+                raise FormulaError(value)
+            return value
+        value = self.store.get(x, y)
+        if isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        return value
+
+    def column_values(self, x: int, y0: int, y1: int) -> list[Any]:
+        """Returns the values of column x from row y0 to row y1 as seen by the formulas."""
+        values = self.store.column_slice(x, y0, y1)
+        for ndx, value in enumerate(values):
+            if isinstance(value, str):
+                values[ndx] = self.cell_value(x, y0 + ndx)
+        return values
+
+    def _ref(self, x: int, y: int) -> Any:
+        value = self.cell_value(x, y)
+        return 0 if value is None else value
+
+    def _rng(self, x0: int, y0: int, x1: int, y1: int) -> CellRange:
+        return CellRange(self, x0, y0, x1, y1)
+
+    def evaluate(self, cell: tuple[int, int]) -> Any:
+        """Evaluates the formula in cell, returning its value or an error code."""
+        return evaluate_formula(self.compiled[cell], cell, self._ref, self._rng)
+
+    def shift(self, x0: int, n: int, axis: int=0):
+        """Moves the formulas after a structural edit of n headings at x0 (n < 0 for deletes), adjusting their references.
+        Only the formulas whose cell or references reach x0 are rewritten, and only those whose references were clipped
+        or whose ranges changed size are recalculated (with their dependents); the rest keep their values.
+        The formulas whose references fall in deleted headings are saved in clipped with their previous address and text."""
+        nclipped = nresized = 0
+
+        def move(addr: int) -> int | None:
+            if addr < x0:
+                return addr
+            if n < 0 and addr < x0 - n:
+                return None
+            return addr + n
+
+        def adjust(m: re.Match) -> str:
+            nonlocal nclipped, nresized
+            if m.lastgroup == 'range':
+                x_0, y_0, x_1, y_1 = map(int, m.group(2, 3, 4, 5))
+                # The bounds may be written in any order (C1R9:C1R1), as in parse
+                x_0, x_1, y_0, y_1 = min(x_0, x_1), max(x_0, x_1), min(y_0, y_1), max(y_0, y_1)
+                lo, hi = ((x_0, x_1), (y_0, y_1))[axis]
+                if move(lo) is None or move(hi) is None:
+                    nclipped += 1
+                if lo < x0 <= hi:
+                    nresized += 1
+                new_lo = move(lo) or (x0 if n < 0 else lo)
+                new_hi = move(hi) or (x0 - 1)
+                if new_hi < new_lo:
+                    return '#REF!'
+                if axis == 0:
+                    return f"C{new_lo}R{y_0}:C{new_hi}R{y_1}"
+                return f"C{x_0}R{new_lo}:C{x_1}R{new_hi}"
+            if m.lastgroup == 'ref':
+                x, y = map(int, m.group(7, 8))
+                addr = move((x, y)[axis])
+                if addr is None:
+                    nclipped += 1
+                    return '#REF!'
+                return f"C{addr}R{y}" if axis == 0 else f"C{x}R{addr}"
+            return m.group(0)
+
+        def reaches(cell: tuple[int, int], refs: set, ranges: list) -> bool:
+            # Formulas that failed to compile have no references parsed, their text is always adjusted
+            return (cell[axis] >= x0 or any(ref[axis] >= x0 for ref in refs)
+                    or any(rng[axis + 2] >= x0 for rng in ranges) or self.compiled[cell].template is None)
+
+        # The batches in flight hold the old addresses: their results are dropped and their cells recalculated here
+        pending = {cell for batch, generation in self.inflight.values() for cell in batch}
+        self.inflight.clear()
+        moved = []
+        for cell in [cell for cell, (text, refs, ranges) in self.formulas.items() if reaches(cell, refs, ranges)]:
+            moved.append((cell, *self.formulas[cell][1:], self.compiled[cell], self.values.get(cell)))
+            self.unregister(cell)
+        changed = []
+        for (x, y), refs, ranges, fnc, value in moved:
+            addr = move((x, y)[axis])
+            if addr is None:
+                continue
+            cell = (addr, y) if axis == 0 else (x, addr)
+            # The store has already moved the formula text to its new address
+            text = self.store.get(*cell)
+            if not is_formula(text):
+                continue
+            old_text, nclipped, nresized = text, 0, 0
+            text = '=' + ''.join(adjust(m) for kind, m in self._tokens(text[1:]))
+            if nclipped:
+                self.clipped.append(((x, y), old_text))
+            if text != old_text:
+                self.store.columns.setdefault(cell[0], {})[cell[1]] = text
+            if (not nclipped and fnc.template is not None and (x, y)[axis] >= x0
+                    and all(ref[axis] >= x0 for ref in refs) and all(rng[axis] >= x0 for rng in ranges)):
+                # The cell moved with all its references: same relative template, the references are moved as well
+                delta = (n, 0) if axis == 0 else (0, n)
+                refs = {(rx + delta[0], ry + delta[1]) for rx, ry in refs}
+                ranges = [(rx0 + delta[0], ry0 + delta[1], rx1 + delta[0], ry1 + delta[1])
+                          for rx0, ry0, rx1, ry1 in ranges]
+                self.link(cell, text, fnc, refs, ranges)
+            else:
+                self.register(cell, text)
+            if nclipped or nresized or value is None or (x, y) in pending:
+                changed.append(cell)
+            else:
+                self.values[cell] = value
+        changed.extend(pending.intersection(self.formulas).difference(cell for cell, *rest in moved))
+        self.recalc(changed)
+
+    @staticmethod
+    def _tokens(text: str) -> list[tuple[str, re.Match]]:
+        try:
+            return tokenize(text)
+        except FormulaError:
+            return [('string', re.match(r'.*', text, re.S))]
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: (un)registers the written formulas and recalculates their dependents."""
+        self.generation += 1
+        if kind == 'set':
+            changed = []
+            for x in range(x0, x1 + 1):
+                for y, value in enumerate(self.store.column_slice(x, y0, y1), start=y0):
+                    cell = (x, y)
+                    if cell in self.formulas:
+                        if self.formulas[cell][0] == value:
+                            # Same formula text: the compiled template is kept
+                            changed.append(cell)
+                            continue
+                        self.unregister(cell)
+                    if is_formula(value):
+                        self.register(cell, value)
+                    changed.append(cell)
+            self.recalc(changed)
+        elif kind in ('insert_rows', 'delete_rows', 'insert_cols', 'delete_cols'):
+            self.clipped = []
+            if not self.formulas:
+                return
+            axis = 0 if kind.endswith('cols') else 1
+            start, end = ((x0, x1), (y0, y1))[axis]
+            n = end - start + 1
+            self.shift(start, n if kind.startswith('insert') else -n, axis=axis)
+
+
+class BatchScope:
+    """Values seen by a thread pool batch: the values computed by the batch are kept here for its next cells and
+    the rest are read from the engine, whose values are only written by the Tk thread."""
+    def __init__(self, engine: FormulaEngine):
+        self.engine = engine
+        self.store = engine.store
+        self.values: dict[tuple[int, int], Any] = {}
+
+    def cell_value(self, x: int, y: int) -> Any:
+        if (value := self.values.get((x, y), self)) is self:
+            return self.engine.cell_value(x, y)
+        if isinstance(value, ErrorValue):
+            raise FormulaError(value)
+        return value
+
+    column_values = FormulaEngine.column_values
+    _ref = FormulaEngine._ref
+    _rng = FormulaEngine._rng
+
+    def evaluate_batch(self, formulas: list[tuple[tuple[int, int], Callable]]) -> list[Any]:
+        """Thread pool task: evaluates the (cell, compiled formula) pairs in order."""
+        answ = []
+        for cell, fnc in formulas:
+            self.values[cell] = value = evaluate_formula(fnc, cell, self._ref, self._rng)
+            answ.append(value)
+        return answ
@@ -0,0 +1,67 @@
+''' Este módulo implementa el historial de deshacer/rehacer de la hoja de cálculo.
+    Cada acción guarda solo su delta inverso (p.ej. "filas 10..5000 borradas" más las dimensiones y
+    celdas desplazadas) y el historial se limita por memoria descartando primero las acciones más antiguas.
+'''
+import collections
+from typing import Callable, NamedTuple
+
+JOURNAL_BYTES = 16 << 20    # Memory budget of the undo history
+ENTRY_BYTES = 96            # Estimated size of a saved cell or heading dimension
+
+
+class Record(NamedTuple):
+    label: str
+    undo: Callable[[], None]
+    redo: Callable[[], None]
+    nbytes: int
+
+
+def delta_size(*containers) -> int:
+    """Estimates the memory used by the saved deltas (dicts of cells are counted by their cells)."""
+    nbytes = 0
+    for container in containers:
+        for item in (container.values() if isinstance(container, dict) else container):
+            nbytes += ENTRY_BYTES * (len(item) if isinstance(item, dict) else 1)
+    return nbytes + ENTRY_BYTES
+
+
+class Journal:
+    """Undo/redo stacks of records. Recording a new action clears the redo stack."""
+    def __init__(self, max_bytes: int=JOURNAL_BYTES):
+        self.max_bytes = max_bytes
+        self.undo_stack = collections.deque()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def record(self, label: str, undo: Callable[[], None], redo: Callable[[], None], nbytes: int=ENTRY_BYTES):
+        self.undo_stack.append(Record(label, undo, redo, nbytes))
+        self.nbytes += nbytes
+        self.redo_stack.clear()
+        # The oldest records are dropped to stay within the memory budget
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.popleft().nbytes
+
+    def undo(self) -> str | None:
+        """Undoes the last action, returning its label (None if there is nothing to undo)."""
+        if not self.undo_stack:
+            return None
+        record = self.undo_stack.pop()
+        self.nbytes -= record.nbytes
+        record.undo()
+        self.redo_stack.append(record)
+        return record.label
+
+    def redo(self) -> str | None:
+        """Redoes the last undone action, returning its label (None if there is nothing to redo)."""
+        if not self.redo_stack:
+            return None
+        record = self.redo_stack.pop()
+        record.redo()
+        self.undo_stack.append(record)
+        self.nbytes += record.nbytes
+        return record.label
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
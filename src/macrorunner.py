@@ -0,0 +1,158 @@
+''' Este módulo ejecuta en paralelo la biblioteca de macros de regresión.
+    Se arrancan N displays virtuales (Xvfb) y un pool de N procesos; cada proceso abre su propio SheetViewer
+    en su display y reproduce las macros que le tocan con MacrosUI, comprobando las huellas grabadas (ver
+    snapshot.py). Los resultados, tiempos y huellas finales de cada macro se reúnen en un único informe json.
+    Uso: python macrorunner.py macros/*.txt -j 4 -o report.json
+'''
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+XVFB_FIRST_DISPLAY = 99             # First display number tried for the Xvfb servers
+XVFB_SCREEN = "1280x1024x24"        # Screen of the Xvfb servers
+XVFB_START_TIMEOUT = 10.0           # Seconds waiting for an Xvfb server socket
+ERROR_MARK = "Traceback (most recent call last)"   # Written by Frontend.execute for the failed actions
+
+viewer = None                       # SheetViewer of the worker process
+macros = None                       # Its MacrosUI
+
+
+def start_displays(n: int, first: int=XVFB_FIRST_DISPLAY) -> list[tuple[int, subprocess.Popen]]:
+    """Starts n Xvfb servers on free display numbers. Returns the (display number, process) pairs."""
+    if shutil.which("Xvfb") is None:
+        raise RuntimeError("Xvfb not found, install it (apt-get install xvfb) to run the macros in parallel")
+    displays = []
+    num = first
+    try:
+        while len(displays) < n:
+            if os.path.exists(f"/tmp/.X{num}-lock"):
+                num += 1
+                continue
+            proc = subprocess.Popen(
+                ["Xvfb", f":{num}", "-screen", "0", XVFB_SCREEN, "-nolisten", "tcp"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            deadline = time.monotonic() + XVFB_START_TIMEOUT
+            while not os.path.exists(f"/tmp/.X11-unix/X{num}") and proc.poll() is None:
+                if time.monotonic() > deadline:
+                    proc.kill()
+                    raise RuntimeError(f"Xvfb :{num} did not start")
+                time.sleep(0.05)
+            if proc.poll() is None:
+                displays.append((num, proc))
+            num += 1
+    except BaseException:
+        stop_displays(displays)
+        raise
+    return displays
+
+
+def stop_displays(displays: list[tuple[int, subprocess.Popen]]):
+    for num, proc in displays:
+        proc.terminate()
+    for num, proc in displays:
+        try:
+            proc.wait(timeout=XVFB_START_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def init_worker(display_queue):
+    """Pool initializer: binds the worker to a display of its own and opens the viewer and its MacrosUI."""
+    global viewer, macros
+    os.environ["DISPLAY"] = f":{display_queue.get()}"
+    import worksheetui
+    logging.getLogger().setLevel(logging.WARNING)
+    viewer = worksheetui.SheetViewer()
+    macros = viewer.create_macrosui()
+    viewer.update()
+
+
+def run_macro(fname: str) -> dict:
+    """Runs the macro file from a clean sheet in the worker viewer. Returns its result for the report."""
+    sheetui = viewer.sheetui
+    output = macros.front_end.output
+    macros.action_cmds('reset_history')
+    macros.load_macro(fname)
+    macros.action_cmds('reset_sheet')
+    viewer.update()
+    nactions = sum(1 for line in macros.action_stack if line.strip() and not line.lstrip().startswith('#'))
+    start = time.perf_counter()
+    macros.action_cmds('run')
+    viewer.update()
+    seconds = time.perf_counter() - start
+    errors = output.get("1.0", "end").count(ERROR_MARK)
+    return dict(
+        macro=fname,
+        display=os.environ["DISPLAY"],
+        ok=not macros.mismatch and not errors,
+        mismatch=macros.mismatch,
+        errors=errors,
+        actions=nactions,
+        seconds=round(seconds, 4),
+        digest=sheetui.snapshot().digest,
+    )
+
+
+def run_suite(fnames: list[str], njobs: int=None, report: str=None) -> dict:
+    """Runs the macro files on njobs Xvfb displays and worker processes (the cpu count by default)."""
+    njobs = max(1, min(njobs or os.cpu_count() or 1, len(fnames)))
+    start = time.perf_counter()
+    displays = start_displays(njobs)
+    results = []
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        display_queue = ctx.Queue()
+        for num, proc in displays:
+            display_queue.put(num)
+        with ProcessPoolExecutor(njobs, mp_context=ctx, initializer=init_worker, initargs=(display_queue,)) as pool:
+            futures = {pool.submit(run_macro, fname): fname for fname in fnames}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = dict(macro=futures[future], ok=False, error=repr(e))
+                logging.info(f"{'ok  ' if result['ok'] else 'FAIL'} {result['macro']} {result.get('seconds', '')}")
+                results.append(result)
+    finally:
+        stop_displays(displays)
+    results.sort(key=lambda result: result['macro'])
+    answ = dict(
+        jobs=njobs,
+        wall=round(time.perf_counter() - start, 4),
+        busy=round(sum(result.get('seconds', 0) for result in results), 4),
+        failed=[result['macro'] for result in results if not result['ok']],
+        results=results,
+    )
+    if report:
+        with open(report, "w") as f:
+            json.dump(answ, f, indent=2)
+    return answ
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the macro regression files in parallel on Xvfb displays.")
+    parser.add_argument("macros", nargs="+", help="macro files or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes and displays (cpu count)")
+    parser.add_argument("-o", "--report", default=None, help="json report file")
+    args = parser.parse_args()
+    fnames = sorted({fname for pattern in args.macros for fname in (glob.glob(pattern) or [pattern])})
+    answ = run_suite(fnames, njobs=args.jobs, report=args.report)
+    for result in answ['results']:
+        detail = '; '.join(result.get('mismatch') or ()) or result.get('error', '')
+        print(f"{'ok  ' if result['ok'] else 'FAIL'} {result['macro']:<40} {result.get('seconds', 0):8.3f} s "
+              f"{result.get('digest', '')} {detail}")
+    print(f"{len(answ['results'])} macros, {len(answ['failed'])} failed, {answ['jobs']} jobs: "
+          f"wall {answ['wall']:.2f} s, busy {answ['busy']:.2f} s")
+    return 1 if answ['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
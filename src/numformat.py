@@ -0,0 +1,126 @@
+''' Este módulo implementa los formatos de presentación de números y fechas de la hoja de cálculo.
+    Un código de formato (p.ej. "#,##0.00", "0%", "yyyy-mm-dd") se compila una sola vez a un objeto que
+    convierte de una pasada todos los valores de un tramo de columna en los textos que se muestran.
+'''
+import datetime
+import functools
+import re
+from itertools import repeat
+
+from cellvalues import number
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, the column slices are converted in python without it
+    np = None
+
+NUMFORMAT_CACHE = 256                   # Compiled format codes kept
+DATE_EPOCH = datetime.datetime(1899, 12, 30)   # Day 0 of the spreadsheet date serial numbers
+MAX_SERIAL = 2958466                    # First serial number after 9999-12-31
+OVERFLOW_TEXT = "#"                     # Shown for the values the format can not represent
+
+NUMBER_CODE = re.compile(r'(?P<prefix>[^#0.,]*?)(?P<body>[#0,]*(?:\.[#0]*)?)(?P<exp>E\+0+)?(?P<suffix>[^#0.,]*)')
+DATE_TOKEN = re.compile(r'yyyy|yy|mmmm|mmm|mm|m|dddd|ddd|dd|d|hh|h|ss|s|"[^"]*"|\\.|.', re.IGNORECASE)
+DATE_CODES = {
+    'yyyy': '%Y', 'yy': '%y', 'mmmm': '%B', 'mmm': '%b', 'mm': '%m', 'm': '%m',
+    'dddd': '%A', 'ddd': '%a', 'dd': '%d', 'd': '%d', 'hh': '%H', 'h': '%H', 'ss': '%S', 's': '%S',
+}
+
+
+def literal(text: str) -> str:
+    """Returns the literal text of a format code part, without quotes and escapes."""
+    return re.sub(r'"([^"]*)"|\\(.)', lambda m: m.group(1) if m.group(1) is not None else m.group(2), text)
+
+
+class NumberFormat:
+    """Compiled format code: 'general' (values as they are), 'number', 'percent', 'scientific' or 'date'.
+    Raises ValueError for the codes it does not understand."""
+    def __init__(self, code: str | None):
+        self.code = code
+        self.kind, self.pattern, self.scale, self.strftime = 'general', '{}', 1.0, None
+        self.signed_prefix = False      # The sign goes before the prefix: -$1.00
+        if not code or code.lower() == 'general':
+            return
+        if re.search(r'[yYdDhHsS]', code) and not re.search(r'[#0]', code):
+            self.kind = 'date'
+            self.strftime = self.compile_date(code)
+            return
+        if (match := NUMBER_CODE.fullmatch(code)) is None or not match['body'].strip(','):
+            raise ValueError(f"Unsupported number format: {code!r}")
+        body, exp = match['body'], match['exp']
+        decimals = len(body.partition('.')[2])
+        prefix, suffix = literal(match['prefix']), literal(match['suffix'])
+        if exp:
+            self.kind, spec = 'scientific', f".{decimals}E"
+        else:
+            spec = f"{',' if ',' in body.partition('.')[0] else ''}.{decimals}f"
+            if '%' in suffix:
+                self.kind, self.scale = 'percent', 100.0
+            else:
+                self.kind = 'number'
+        escape = lambda text: text.replace('{', '{{').replace('}', '}}')
+        self.pattern = f"{escape(prefix)}{{:{spec}}}{escape(suffix)}"
+        self.signed_prefix = bool(prefix)
+
+    @staticmethod
+    def compile_date(code: str) -> str:
+        """Translates a date code to a strftime pattern ("m" is minutes after hours or before seconds)."""
+        tokens = DATE_TOKEN.findall(code)
+        answ = []
+        for ndx, token in enumerate(tokens):
+            low = token.lower()
+            if low in ('mm', 'm'):
+                previous = next((t.lower() for t in reversed(tokens[:ndx]) if t.lower() in DATE_CODES), '')
+                following = next((t.lower() for t in tokens[ndx + 1:] if t.lower() in DATE_CODES), '')
+                answ.append('%M' if previous.startswith('h') or following.startswith('s') else '%m')
+            elif low in DATE_CODES:
+                answ.append(DATE_CODES[low])
+            else:
+                answ.append(literal(token).replace('%', '%%'))
+        return ''.join(answ)
+
+    def format_column(self, values: list) -> list[str | None]:
+        """Returns the display texts of a column slice in one pass, formatting once each distinct number of the
+        slice. Empty cells stay None and the values that are not numbers are shown as they are."""
+        answ = [None if value is None else str(value) for value in values]
+        if self.kind == 'general':
+            return answ
+        ndxs, numbers = [], []
+        for ndx, value in enumerate(values):
+            if (num := value if type(value) is float and value == value else number(value)) is not None:
+                ndxs.append(ndx)
+                numbers.append(num)
+        if not numbers:
+            return answ
+        distinct = list(dict.fromkeys(numbers))
+        if self.kind == 'date':
+            texts = self.format_dates(distinct)
+        else:
+            scaled = (np.asarray(distinct) * self.scale).tolist() if np is not None else [num * self.scale for num in distinct]
+            texts = list(map(self.pattern.format, scaled))
+            if self.signed_prefix:
+                texts = ['-' + self.pattern.format(-num) if num < 0 else text for num, text in zip(scaled, texts)]
+        texts = dict(zip(distinct, texts))
+        for ndx, num in zip(ndxs, numbers):
+            answ[ndx] = texts[num]
+        return answ
+
+    def format_dates(self, serials: list[float]) -> list[str]:
+        valid = [0 <= serial < MAX_SERIAL for serial in serials]
+        if np is not None:
+            seconds = np.rint(np.where(valid, serials, 0.0) * 86400).astype('int64')
+            stamps = (np.datetime64(DATE_EPOCH, 's') + seconds.astype('timedelta64[s]')).astype(object).tolist()
+        else:
+            stamps = [DATE_EPOCH + datetime.timedelta(seconds=round(serial * 86400)) if ok else DATE_EPOCH
+                      for serial, ok in zip(serials, valid)]
+        texts = list(map(datetime.datetime.strftime, stamps, repeat(self.strftime)))
+        return [text if ok else OVERFLOW_TEXT for text, ok in zip(texts, valid)]
+
+    def format_value(self, value) -> str | None:
+        return self.format_column([value])[0]
+
+
+@functools.lru_cache(maxsize=NUMFORMAT_CACHE)
+def compile_format(code: str | None) -> NumberFormat:
+    """Returns the compiled format code, compiled once and cached."""
+    return NumberFormat(code)
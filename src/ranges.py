@@ -0,0 +1,163 @@
+''' Este módulo implementa los rangos con nombre de la hoja de cálculo.
+    Los rangos se guardan en un R-tree empaquetado con Sort-Tile-Recursive, de forma que los nombres que
+    contienen una celda o que cortan el área visible se obtienen sin recorrer todos los nombres. Los rangos
+    se desplazan o recortan al insertar o borrar filas y columnas.
+'''
+import math
+from typing import Iterator
+
+RTREE_NODE = 16         # Entries per R-tree node
+RTREE_PENDING = 64      # Names added since the last build, scanned one by one until the tree is rebuilt
+
+Rect = tuple[int, int, int, int]    # (x0, y0, x1, y1) cells, both corners included
+
+
+def intersects(a: Rect, b: Rect) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def bounds(rects: list[Rect]) -> Rect:
+    return min(r[0] for r in rects), min(r[1] for r in rects), max(r[2] for r in rects), max(r[3] for r in rects)
+
+
+def str_pack(entries: list[tuple[Rect, object]]) -> list[tuple[Rect, list]]:
+    """Packs the (rect, item) entries in (bounds, entries) nodes of RTREE_NODE entries (Sort-Tile-Recursive)."""
+    nslices = math.ceil(math.sqrt(math.ceil(len(entries) / RTREE_NODE)))
+    per_slice = nslices * RTREE_NODE
+    entries = sorted(entries, key=lambda entry: entry[0][0] + entry[0][2])
+    nodes = []
+    for i in range(0, len(entries), per_slice):
+        tile = sorted(entries[i: i + per_slice], key=lambda entry: entry[0][1] + entry[0][3])
+        for j in range(0, len(tile), RTREE_NODE):
+            children = tile[j: j + RTREE_NODE]
+            nodes.append((bounds([rect for rect, _ in children]), children))
+    return nodes
+
+
+def shift_span(a: int, b: int, start: int, n: int) -> tuple[int, int] | None:
+    """Shifts the a:b span for n headings inserted (n > 0) or deleted (n < 0) at start.
+    Returns None if the whole span is deleted."""
+    if n > 0:
+        return a + n * (a >= start), b + n * (b >= start)
+    end = start - n - 1
+    if start <= a and b <= end:
+        return None
+    a = a if a < start else (start if a <= end else a + n)
+    b = b if b < start else (start - 1 if b <= end else b + n)
+    return a, b
+
+
+class NamedRanges:
+    """Named cell ranges of a SheetStore, indexed in an R-tree.
+
+    The tree is built on the first query. Names added later are kept in a pending list scanned one by one, and
+    every tree entry is verified against the current ranges, so removed names are harmless until the tree is
+    rebuilt. Structural edits of the store shift the ranges; the ones changed by the last delete are saved in
+    clipped with their previous range, so that undo can restore them.
+    """
+    def __init__(self, store=None, ranges: dict=None):
+        self.rects: dict[str, Rect] = {}
+        self.tree: list | None = None
+        self.height = 0
+        self.pending: list[tuple[Rect, str]] = []
+        self.nremoved = 0                               # Tree entries of removed or moved names
+        self.clipped: list[tuple[str, Rect]] = []       # (name, range) before the last delete changed it
+        if ranges:
+            self.update(ranges)
+        if store is not None:
+            store.add_listener(self.on_store_changed)
+
+    def __len__(self) -> int:
+        return len(self.rects)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.rects)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.rects
+
+    def __getitem__(self, name: str) -> Rect:
+        return self.rects[name]
+
+    def add(self, name: str, rect: Rect):
+        """Names the x0:x1, y0:y1 range, replacing the previous range of the name."""
+        x0, y0, x1, y1 = map(int, rect)
+        rect = min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+        self.remove(name)
+        self.rects[name] = rect
+        self.pending.append((rect, name))
+
+    def remove(self, name: str):
+        if self.rects.pop(name, None) is not None:
+            self.nremoved += 1
+
+    def update(self, ranges: dict):
+        for name, rect in ranges.items():
+            self.add(name, rect)
+
+    def to_dict(self) -> dict[str, list[int]]:
+        """Returns the ranges as a json serializable dict."""
+        return {name: list(rect) for name, rect in self.rects.items()}
+
+    def ensure_tree(self):
+        """Builds the tree if there is none or the pending and removed entries are too many."""
+        if self.tree is not None and len(self.pending) <= RTREE_PENDING and self.nremoved <= len(self.rects):
+            return
+        level = [(rect, name) for name, rect in self.rects.items()]
+        self.height = 0
+        while len(level) > RTREE_NODE:
+            level = str_pack(level)
+            self.height += 1
+        self.tree = level
+        self.pending = []
+        self.nremoved = 0
+
+    def search(self, rect: Rect) -> set[str]:
+        """Returns the names whose range intersects rect."""
+        self.ensure_tree()
+        answ = set()
+        stack = [(self.tree, self.height)]
+        while stack:
+            entries, height = stack.pop()
+            for entry_rect, item in entries:
+                if not intersects(entry_rect, rect):
+                    continue
+                if height:
+                    stack.append((item, height - 1))
+                elif self.rects.get(item) == entry_rect:
+                    answ.add(item)
+        for entry_rect, name in self.pending:
+            if intersects(entry_rect, rect) and self.rects.get(name) == entry_rect:
+                answ.add(name)
+        return answ
+
+    def at(self, x: int, y: int) -> list[str]:
+        """Returns the sorted names whose range contains the (x, y) cell."""
+        return sorted(self.search((x, y, x, y)))
+
+    def intersecting(self, x0: int, y0: int, x1: int, y1: int) -> list[str]:
+        """Returns the sorted names whose range intersects the x0:x1, y0:y1 range."""
+        return sorted(self.search((x0, y0, x1, y1)))
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: shifts the ranges after the insert/delete of rows or columns."""
+        if kind not in ('insert_rows', 'delete_rows', 'insert_cols', 'delete_cols'):
+            return
+        self.clipped = []
+        axis = 0 if kind.endswith('cols') else 1
+        start, end = ((x0, x1), (y0, y1))[axis]
+        self.shift(start, (end - start + 1) * (1 if kind.startswith('insert') else -1), axis=axis)
+
+    def shift(self, start: int, n: int, axis: int=0):
+        """Shifts the ranges for n headings inserted (n > 0) or deleted (n < 0) at heading start."""
+        rects = {}
+        for name, rect in self.rects.items():
+            span = shift_span(rect[axis], rect[axis + 2], start, n)
+            if span is None:
+                self.clipped.append((name, rect))
+                continue
+            if n < 0 and span[1] - span[0] != rect[axis + 2] - rect[axis]:
+                self.clipped.append((name, rect))
+            rects[name] = (span[0], rect[1], span[1], rect[3]) if axis == 0 else (rect[0], span[0], rect[2], span[1])
+        self.rects = rects
+        self.tree = None
@@ -0,0 +1,440 @@
+''' Este módulo define la interfaz de dibujo de la hoja y un canvas de grabación en memoria.
+    SheetPainter dibuja sobre cualquier objeto con la interfaz Renderer: el tk.Canvas en la aplicación o
+    RecordingCanvas, que guarda los elementos y el registro de operaciones sin servidor X, de forma que la
+    maquetación y el dibujo se pueden medir y comparar (SVG o PPM) en pruebas y benchmarks.
+'''
+import itertools
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Callable, Protocol
+from xml.sax.saxutils import escape
+
+CHAR_WIDTH = 7          # Text width per character of the recording canvas, in pixels
+LINE_HEIGHT = 15        # Text line height of the recording canvas, in pixels
+AFTER_LIMIT = 10_000    # Callbacks run by one RecordingCanvas.update, a guard against callbacks rescheduling forever
+
+COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'green': (0, 128, 0), 'blue': (0, 0, 255),
+    'yellow': (255, 255, 0), 'lightblue': (173, 216, 230), 'lightgray': (211, 211, 211), 'gray': (190, 190, 190),
+    'grey': (190, 190, 190), 'magenta': (255, 0, 255),
+}
+DEFAULT_OPTIONS = {
+    'rectangle': dict(fill='', outline='black', width=1, state='', tags=()),
+    'line': dict(fill='black', width=1, state='', tags=()),
+    'text': dict(fill='black', text='', anchor='center', font='', state='', tags=()),
+}
+
+
+class Renderer(Protocol):
+    """Canvas operations used by SheetPainter: the tk.Canvas subset implemented by RecordingCanvas."""
+    def create_rectangle(self, *coords, **options) -> int: ...
+    def create_line(self, *coords, **options) -> int: ...
+    def create_text(self, *coords, **options) -> int: ...
+    def coords(self, tag_or_id, *coords) -> list[float]: ...
+    def move(self, tag_or_id, dx: float, dy: float): ...
+    def itemconfigure(self, tag_or_id, **options): ...
+    def itemcget(self, tag_or_id, option: str) -> str: ...
+    def delete(self, *tags_or_ids): ...
+    def find_withtag(self, tag_or_id) -> tuple[int, ...]: ...
+    def find_enclosed(self, x0: float, y0: float, x1: float, y1: float) -> tuple[int, ...]: ...
+    def find_overlapping(self, x0: float, y0: float, x1: float, y1: float) -> tuple[int, ...]: ...
+    def bbox(self, tag_or_id) -> tuple[int, int, int, int] | None: ...
+    def font_measure(self, desc: str, text: str) -> int: ...
+    def font_linespace(self, desc: str) -> int: ...
+
+
+def rgb(color: str) -> tuple[int, int, int] | None:
+    """Returns the (r, g, b) of a Tk colour name or #rrggbb, None for no colour."""
+    if not color:
+        return None
+    if color.startswith('#') and len(color) == 7:
+        return int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16)
+    return COLORS.get(color.lower().replace(' ', ''), COLORS['gray'])
+
+
+class Item:
+    __slots__ = ('kind', 'coords', 'options')
+
+    def __init__(self, kind: str, coords: list[float], options: dict):
+        self.kind = kind
+        self.coords = coords
+        self.options = options
+
+
+class RecordingBatch:
+    """CanvasBatch interface of the recording canvas: the commands run at once, so there is nothing to flush."""
+    def __init__(self, canvas: 'RecordingCanvas'):
+        self.canvas = canvas
+        self.ncreated = 0
+
+    def call(self, command: str, *args):
+        {'raise': self.canvas.tag_raise, 'lower': self.canvas.tag_lower}.get(command, getattr(self.canvas, command))(*args)
+
+    def create(self, kind: str, *coords, **options) -> int:
+        getattr(self.canvas, f"create_{kind}")(*coords, **options)
+        self.ncreated += 1
+        return self.canvas.last_id
+
+    def itemconfigure(self, tag_or_id, **options):
+        self.canvas.itemconfigure(tag_or_id, **options)
+
+    def clip(self, tid: int, width: int):
+        tx0, ty0, tx1, ty1 = self.canvas.bbox(tid)
+        if tx1 - tx0 > width:
+            self.canvas.itemconfigure(tid, text="*")
+
+    def move_enclosed(self, area: tuple, dx: int, dy: int):
+        for item in self.canvas.find_enclosed(*area):
+            self.canvas.move(item, dx, dy)
+
+    def delete_enclosed(self, area: tuple):
+        self.canvas.delete(*self.canvas.find_enclosed(*area))
+
+    def resize_lines(self, tag: str, axis: int, lo: int, hi: int):
+        for item in self.canvas.find_withtag(tag):
+            x0, y0, x1, y1 = self.canvas.coords(item)
+            self.canvas.coords(item, *((lo, y0, hi, y1) if axis == 0 else (x0, lo, x1, hi)))
+
+    def flush(self) -> list[int]:
+        self.ncreated = 0
+        return []
+
+    @contextmanager
+    def batched(self):
+        yield self
+
+
+class RecordingCanvas:
+    """In-memory canvas: keeps the items in stacking order and a log of the operations.
+
+    It implements the Renderer operations with the tk.Canvas semantics the sheet relies on (tags, hidden items
+    skipped by the area searches, bounding boxes bloated by the outline) plus the widget calls of SheetPainter
+    (event_generate, after, clipboard, winfo sizes). Texts are measured with a fixed width per character.
+    """
+    def __init__(self, width: int=600, height: int=400, char_width: int=CHAR_WIDTH, line_height: int=LINE_HEIGHT):
+        self.width, self.height = width, height
+        self.char_width, self.line_height = char_width, line_height
+        self.items: dict[int, Item] = {}            # Stacking order, the last item on top
+        self.ops: list[tuple] = []                  # (operation, arguments...) log
+        self.last_id = 0
+        self.handlers: dict[str, list[Callable]] = {}
+        self.pending: dict[str, tuple] = {}         # after id -> (callback, args)
+        self.after_ids = itertools.count(1)
+        self.clipboard = ""
+        self.batch = RecordingBatch(self)
+
+    # Items
+    def create(self, kind: str, coords, options: dict) -> int:
+        self.last_id += 1
+        coords = list(map(float, coords[0] if len(coords) == 1 else coords))
+        item_options = dict(DEFAULT_OPTIONS[kind])
+        item_options.update(self.normalize(options))
+        self.items[self.last_id] = Item(kind, coords, item_options)
+        self.ops.append(('create', kind, self.last_id, tuple(coords)))
+        return self.last_id
+
+    def create_rectangle(self, *coords, **options) -> int:
+        return self.create('rectangle', coords, options)
+
+    def create_line(self, *coords, **options) -> int:
+        return self.create('line', coords, options)
+
+    def create_text(self, *coords, **options) -> int:
+        return self.create('text', coords, options)
+
+    @staticmethod
+    def normalize(options: dict) -> dict:
+        answ = {key.rstrip('_'): value for key, value in options.items()}
+        if isinstance(tags := answ.get('tags'), str):
+            answ['tags'] = tuple(tags.split())
+        elif tags is not None:
+            answ['tags'] = tuple(tags)
+        return answ
+
+    def find_withtag(self, tag_or_id) -> tuple[int, ...]:
+        if isinstance(tag_or_id, int) or (isinstance(tag_or_id, str) and tag_or_id.isdigit()):
+            return (int(tag_or_id),) if int(tag_or_id) in self.items else ()
+        if tag_or_id == 'all':
+            return tuple(self.items)
+        return tuple(tid for tid, item in self.items.items() if tag_or_id in item.options['tags'])
+
+    def find_all(self) -> tuple[int, ...]:
+        return tuple(self.items)
+
+    def coords(self, tag_or_id, *coords) -> list[float]:
+        items = self.find_withtag(tag_or_id)
+        if coords:
+            coords = list(map(float, coords[0] if len(coords) == 1 else coords))
+            for tid in items[:1]:
+                self.items[tid].coords = coords
+                self.ops.append(('coords', tid, tuple(coords)))
+            return []
+        return list(self.items[items[0]].coords) if items else []
+
+    def move(self, tag_or_id, dx: float, dy: float):
+        for tid in self.find_withtag(tag_or_id):
+            item = self.items[tid]
+            item.coords = [c + (dx if ndx % 2 == 0 else dy) for ndx, c in enumerate(item.coords)]
+            self.ops.append(('move', tid, dx, dy))
+
+    def itemconfigure(self, tag_or_id, **options):
+        options = self.normalize(options)
+        for tid in self.find_withtag(tag_or_id):
+            self.items[tid].options.update(options)
+            self.ops.append(('itemconfigure', tid, tuple(options.items())))
+
+    itemconfig = itemconfigure
+
+    def itemcget(self, tag_or_id, option: str) -> str:
+        items = self.find_withtag(tag_or_id)
+        if not items:
+            return ''
+        value = self.items[items[0]].options.get(option, '')
+        return ' '.join(value) if option == 'tags' else str(value)
+
+    def gettags(self, tag_or_id) -> tuple[str, ...]:
+        items = self.find_withtag(tag_or_id)
+        return self.items[items[0]].options['tags'] if items else ()
+
+    def type(self, tag_or_id) -> str | None:
+        items = self.find_withtag(tag_or_id)
+        return self.items[items[0]].kind if items else None
+
+    def addtag_withtag(self, newtag: str, tag_or_id):
+        for tid in self.find_withtag(tag_or_id):
+            if newtag not in (tags := self.items[tid].options['tags']):
+                self.items[tid].options['tags'] = tags + (newtag,)
+
+    def dtag(self, tag_or_id, tag_to_delete: str=None):
+        tag_to_delete = tag_to_delete if tag_to_delete is not None else tag_or_id
+        for tid in self.find_withtag(tag_or_id):
+            item = self.items[tid]
+            item.options['tags'] = tuple(tag for tag in item.options['tags'] if tag != tag_to_delete)
+
+    def delete(self, *tags_or_ids):
+        for tag_or_id in tags_or_ids:
+            for tid in self.find_withtag(tag_or_id):
+                del self.items[tid]
+                self.ops.append(('delete', tid))
+
+    def restack(self, moved: tuple[int, ...], anchor: int | None, above: bool):
+        """Moves the items just above (or below) the anchor item, at the top (bottom) if anchor is None."""
+        if not moved:
+            return
+        rest = [tid for tid in self.items if tid not in moved]
+        if anchor is None or anchor in moved:
+            ndx = len(rest) if above else 0
+        else:
+            ndx = rest.index(anchor) + int(above)
+        order = rest[:ndx] + list(moved) + rest[ndx:]
+        self.items = {tid: self.items[tid] for tid in order}
+        self.ops.append(('raise' if above else 'lower', moved))
+
+    def tag_raise(self, tag_or_id, above=None):
+        anchor = self.find_withtag(above)[-1:] if above is not None else ()
+        if above is None or anchor:
+            self.restack(self.find_withtag(tag_or_id), anchor[0] if anchor else None, True)
+
+    def tag_lower(self, tag_or_id, below=None):
+        anchor = self.find_withtag(below)[:1] if below is not None else ()
+        if below is None or anchor:
+            self.restack(self.find_withtag(tag_or_id), anchor[0] if anchor else None, False)
+
+    lift = tag_raise
+    lower = tag_lower
+
+    # Geometry
+    def item_bbox(self, item: Item) -> tuple[int, int, int, int]:
+        if item.kind == 'text':
+            lines = str(item.options['text']).split('\n')
+            width = max(self.font_measure(item.options['font'], line) for line in lines)
+            height = self.font_linespace(item.options['font']) * len(lines)
+            x, y = item.coords[:2]
+            anchor = item.options['anchor']
+            x0 = x - (0 if 'w' in anchor else width if 'e' in anchor else width // 2)
+            y0 = y - (0 if anchor.startswith('n') else height if anchor.startswith('s') else height // 2)
+            return int(x0), int(y0), int(x0 + width), int(y0 + height)
+        xs, ys = item.coords[::2], item.coords[1::2]
+        bloat = (int(float(item.options['width'])) + 1) // 2 if item.kind == 'line' or item.options['outline'] else 0
+        return int(min(xs)) - bloat, int(min(ys)) - bloat, int(max(xs)) + bloat, int(max(ys)) + bloat
+
+    def bbox(self, *tags_or_ids) -> tuple[int, int, int, int] | None:
+        boxes = [self.item_bbox(self.items[tid]) for tag_or_id in tags_or_ids for tid in self.find_withtag(tag_or_id)]
+        if not boxes:
+            return None
+        return min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+
+    def find_area(self, area: tuple, enclosed: bool) -> tuple[int, ...]:
+        x0, y0, x1, y1 = area
+        answ = []
+        for tid, item in self.items.items():
+            if item.options['state'] == 'hidden':
+                continue
+            bx0, by0, bx1, by1 = self.item_bbox(item)
+            if enclosed:
+                found = x0 <= bx0 and y0 <= by0 and bx1 <= x1 and by1 <= y1
+            else:
+                found = bx0 <= x1 and x0 <= bx1 and by0 <= y1 and y0 <= by1
+            if found:
+                answ.append(tid)
+        return tuple(answ)
+
+    def find_enclosed(self, x0: float, y0: float, x1: float, y1: float) -> tuple[int, ...]:
+        return self.find_area((x0, y0, x1, y1), enclosed=True)
+
+    def find_overlapping(self, x0: float, y0: float, x1: float, y1: float) -> tuple[int, ...]:
+        return self.find_area((x0, y0, x1, y1), enclosed=False)
+
+    def font_measure(self, desc: str, text: str) -> int:
+        return self.char_width * len(text)
+
+    def font_linespace(self, desc: str) -> int:
+        return self.line_height
+
+    # Widget
+    def winfo_width(self) -> int:
+        return self.width
+
+    def winfo_height(self) -> int:
+        return self.height
+
+    def winfo_rootx(self) -> int:
+        return 0
+
+    def winfo_rooty(self) -> int:
+        return 0
+
+    def winfo_pointerx(self) -> int:
+        return 0
+
+    def winfo_pointery(self) -> int:
+        return 0
+
+    def cget(self, option: str) -> str:
+        return ''
+
+    def focus_set(self):
+        pass
+
+    def crossings(self) -> int:
+        """Returns the operations recorded, the counterpart of the Tcl crossings of the Tk backend."""
+        return len(self.ops)
+
+    def bind(self, sequence: str, fnc: Callable):
+        self.handlers.setdefault(sequence, []).append(fnc)
+
+    def event_generate(self, sequence: str, **kwargs):
+        self.ops.append(('event', sequence))
+        event = SimpleNamespace(widget=self, **kwargs)
+        for fnc in self.handlers.get(sequence, ()):
+            fnc(event)
+
+    def after(self, ms: int, fnc: Callable=None, *args) -> str:
+        after_id = f"after#{next(self.after_ids)}"
+        self.pending[after_id] = (fnc, args)
+        return after_id
+
+    def after_idle(self, fnc: Callable, *args) -> str:
+        return self.after(0, fnc, *args)
+
+    def after_cancel(self, after_id: str):
+        self.pending.pop(after_id, None)
+
+    def update(self):
+        """Runs the pending after callbacks, the ones they schedule included."""
+        for _ in range(AFTER_LIMIT):
+            if not self.pending:
+                break
+            fnc, args = self.pending.pop(next(iter(self.pending)))
+            fnc(*args)
+
+    def clipboard_clear(self):
+        self.clipboard = ""
+
+    def clipboard_append(self, text: str):
+        self.clipboard += text
+
+    def clipboard_get(self) -> str:
+        return self.clipboard
+
+    # Snapshots
+    def visible_items(self):
+        return [(tid, item) for tid, item in self.items.items() if item.options['state'] != 'hidden']
+
+    def export_svg(self, fname: str=None) -> str:
+        """Returns the visible items as an SVG document, written to fname if given."""
+        lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}">']
+        text_anchor = {'w': 'start', 'e': 'end'}
+        for tid, item in self.visible_items():
+            opts = item.options
+            if item.kind == 'rectangle':
+                x0, y0, x1, y1 = item.coords
+                stroke = f' stroke="{opts["outline"]}"' if opts['outline'] else ''
+                lines.append(f'<rect x="{x0:g}" y="{y0:g}" width="{x1 - x0:g}" height="{y1 - y0:g}" '
+                             f'fill="{opts["fill"] or "none"}"{stroke}/>')
+            elif item.kind == 'line':
+                x0, y0, x1, y1 = item.coords[:4]
+                lines.append(f'<line x1="{x0:g}" y1="{y0:g}" x2="{x1:g}" y2="{y1:g}" stroke="{opts["fill"]}"/>')
+            else:
+                x, y = item.coords[:2]
+                anchor = text_anchor.get(opts['anchor'][-1:], 'middle')
+                lines.append(f'<text x="{x:g}" y="{y:g}" fill="{opts["fill"]}" text-anchor="{anchor}" '
+                             f'dominant-baseline="middle">{escape(str(opts["text"]))}</text>')
+        lines.append('</svg>')
+        svg = '\n'.join(lines)
+        if fname:
+            with open(fname, 'w', encoding='utf-8') as f:
+                f.write(svg)
+        return svg
+
+    def export_ppm(self, fname: str=None) -> bytes:
+        """Returns the visible items rasterized as a binary PPM image, written to fname if given. Texts are drawn
+        as their bounding boxes, so the image compares layouts and not fonts."""
+        width, height = self.width, self.height
+        pixels = bytearray(b'\xff' * (3 * width * height))
+
+        def fill(x0, y0, x1, y1, color):
+            x0, x1 = max(0, int(x0)), min(width, int(x1))
+            if color is None or x0 >= x1:
+                return
+            row = bytes(color) * (x1 - x0)
+            for y in range(max(0, int(y0)), min(height, int(y1))):
+                start = 3 * (y * width + x0)
+                pixels[start: start + len(row)] = row
+
+        for tid, item in self.visible_items():
+            opts = item.options
+            if item.kind == 'rectangle':
+                x0, y0, x1, y1 = item.coords
+                fill(x0, y0, x1, y1, rgb(opts['fill']))
+                if (outline := rgb(opts['outline'])) is not None and int(float(opts['width'])):
+                    for box in ((x0, y0, x1, y0 + 1), (x0, y1 - 1, x1, y1), (x0, y0, x0 + 1, y1), (x1 - 1, y0, x1, y1)):
+                        fill(*box, outline)
+            elif item.kind == 'line':
+                x0, y0, x1, y1 = item.coords[:4]
+                fill(min(x0, x1), min(y0, y1), max(x0, x1) + 1, max(y0, y1) + 1, rgb(opts['fill']))
+            elif opts['text']:
+                bx0, by0, bx1, by1 = self.item_bbox(item)
+                fill(bx0, (by0 + by1) // 2, bx1, (by0 + by1) // 2 + 1, rgb(opts['fill']))
+        ppm = b'P6\n%d %d\n255\n' % (width, height) + bytes(pixels)
+        if fname:
+            with open(fname, 'wb') as f:
+                f.write(ppm)
+        return ppm
+
+    def dump(self) -> list[tuple]:
+        """Returns the (kind, coords, text, tags) of the visible items in stacking order, for comparisons."""
+        return [
+            (item.kind, tuple(item.coords), str(item.options.get('text', '')), item.options['tags'])
+            for tid, item in self.visible_items()
+        ]
+
+    def item_records(self) -> list[tuple]:
+        """Returns the (kind, coords, text, tags, state) of all the items in stacking order, see snapshot.py."""
+        return [
+            (item.kind, tuple(item.coords), str(item.options.get('text', '')), item.options['tags'], item.options['state'])
+            for item in self.items.values()
+        ]
+
+    def options_of(self, tid: int) -> dict[str, Any]:
+        return dict(self.items[tid].options)
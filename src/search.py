@@ -0,0 +1,233 @@
+''' Este módulo implementa la búsqueda de texto en la hoja de cálculo.
+    Un índice invertido de trigramas sobre los valores mostrados de las celdas permite encontrar las
+    coincidencias (subcadena, celda completa o expresión regular) sin recorrer todas las celdas.
+'''
+import bisect
+import collections
+import re
+from array import array
+from typing import Any, Iterable, Literal
+
+from cellvalues import parse_input
+from ranges import shift_span
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, the addresses are shifted in python without it
+    np = None
+
+SEARCH_CHUNK = 4096     # Rows per column chunk when the index is built
+COLUMN_MASK = 0xFFFFFF  # Column bits of a cell key
+
+Mode = Literal['substring', 'whole', 'regex']
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i: i + 3] for i in range(len(text) - 2)}
+
+
+def cell_key(x: int, y: int) -> int:
+    """Packs the cell address in an int ordered by rows (the order of Find Next)."""
+    return (y << 24) | x
+
+
+def key_cell(key: int) -> tuple[int, int]:
+    return key & COLUMN_MASK, key >> 24
+
+
+class SearchIndex:
+    """Trigram inverted index over the display values of the cells of a SheetStore.
+
+    The index is built on the first search and kept up to date with the store and formula engine listeners:
+    written and recalculated cells are re-indexed, appended rows are indexed on the next search and
+    structural edits shift the indexed addresses.
+
+    Every indexed text has a slot. The postings are append-only arrays of slots and slot_keys holds the cell
+    key of every slot (0 once the cell is overwritten or deleted), so a structural edit rewrites slot_keys and
+    the cell -> slot dict but not the postings. The dead slots are skipped by the searches and the index is
+    rebuilt when they outnumber the indexed cells.
+    """
+    def __init__(self, store, formulas=None):
+        self.store = store
+        self.formulas = formulas
+        self.cells: dict[int, int] = {}                                # cell key -> slot of its display text
+        self.slot_keys = array('Q')                                    # slot -> cell key, 0 for the dead slots
+        self.slot_texts: list[str | None] = []                         # slot -> display text
+        self.postings = collections.defaultdict(lambda: array('I'))    # trigram -> slots
+        self.exact = collections.defaultdict(lambda: array('I'))       # folded display text -> slots
+        self.pending: list[tuple[int, int, int, int]] = []             # Appended areas to index
+        self.nreplaced = 0                                             # Slots dead since the last build
+        self.stale = True
+        # The addresses are shifted before the formula engine reports the cells recalculated by a structural edit
+        store.add_listener(self.on_store_changed, first=True)
+        if formulas is not None:
+            formulas.add_listener(self.on_formulas_recalc)
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: re-indexes the written cells and shifts the addresses on structural edits."""
+        if self.stale:
+            return
+        if kind == 'set':
+            self.index_area(x0, y0, x1, y1)
+        elif kind == 'append':
+            self.pending.append((x0, y0, x1, y1))
+        else:
+            self.shift(kind, x0, y0, x1, y1)
+
+    def on_formulas_recalc(self, cells: list[tuple[int, int]]):
+        """Formula engine listener: re-indexes the recalculated cells."""
+        if self.stale:
+            return
+        for x, y in cells:
+            self.index_cell(x, y, self.display_text(x, y, self.store.get(x, y)))
+
+    def shift(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Moves the indexed addresses after a structural edit, the slots of the deleted cells die."""
+        axis = 0 if kind.endswith('cols') else 1
+        start, end = ((x0, x1), (y0, y1))[axis]
+        n = (end - start + 1) * (1 if kind.startswith('insert') else -1)
+        pending = []
+        for area in self.pending:
+            if (span := shift_span(area[axis], area[axis + 2], start, n)) is not None:
+                pending.append((span[0], area[1], span[1], area[3]) if axis == 0 else (area[0], span[0], area[2], span[1]))
+        self.pending = pending
+        step = n if axis == 0 else n << 24
+        if np is not None and self.slot_keys:
+            keys = np.frombuffer(self.slot_keys, dtype=np.uint64)
+            addr = keys & COLUMN_MASK if axis == 0 else keys >> 24      # The dead slots have address 0
+            moved = np.flatnonzero(addr > end if n < 0 else addr >= start)
+            dead = np.flatnonzero((addr >= start) & (addr <= end)) if n < 0 else moved[:0]
+            old = keys[np.concatenate((dead, moved))].tolist()
+            keys[dead] = 0
+            keys[moved] = keys[moved] + np.uint64(step) if n > 0 else keys[moved] - np.uint64(-step)
+            new = keys[moved].tolist()
+            if len(old) > len(self.cells) // 2:
+                live = np.flatnonzero(keys)
+                self.cells = dict(zip(keys[live].tolist(), live.tolist()))
+            else:
+                # Edits near the end of the sheet move a few cells: the dict is updated in place
+                for key in old:
+                    del self.cells[key]
+                self.cells.update(zip(new, moved.tolist()))
+            del keys
+            for slot in dead.tolist():
+                self.slot_texts[slot] = None
+            self.nreplaced += len(dead)
+            return
+        cells = {}
+        for key, slot in self.cells.items():
+            if (addr := key & COLUMN_MASK if axis == 0 else key >> 24) >= start:
+                if n < 0 and addr <= end:
+                    self.slot_keys[slot] = 0
+                    self.slot_texts[slot] = None
+                    self.nreplaced += 1
+                    continue
+                key += step
+                self.slot_keys[slot] = key
+            cells[key] = slot
+        self.cells = cells
+
+    def release(self):
+        """Drops the index, it is rebuilt by the next search."""
+        self.cells.clear()
+        self.slot_keys = array('Q')
+        self.slot_texts = []
+        self.postings.clear()
+        self.exact.clear()
+        self.pending = []
+        self.stale = True
+
+    def display_text(self, x: int, y: int, value: Any) -> str | None:
+        if isinstance(value, str) and value.startswith('=') and self.formulas is not None:
+            value = self.formulas.value(x, y)
+        return None if value is None else str(value)
+
+    def index_cell(self, x: int, y: int, text: str | None):
+        key = cell_key(x, y)
+        if (slot := self.cells.pop(key, None)) is not None:
+            self.slot_keys[slot] = 0
+            self.slot_texts[slot] = None
+            self.nreplaced += 1
+        if text:
+            slot = len(self.slot_texts)
+            self.cells[key] = slot
+            self.slot_keys.append(key)
+            self.slot_texts.append(text)
+            folded = text.casefold()
+            for trigram in trigrams(folded):
+                self.postings[trigram].append(slot)
+            self.exact[folded].append(slot)
+
+    def index_area(self, x0: int, y0: int, x1: int, y1: int):
+        for x in range(x0, x1 + 1):
+            for cy0 in range(y0, y1 + 1, SEARCH_CHUNK):
+                cy1 = min(y1, cy0 + SEARCH_CHUNK - 1)
+                for y, value in enumerate(self.store.column_slice(x, cy0, cy1), start=cy0):
+                    self.index_cell(x, y, self.display_text(x, y, value))
+
+    def ensure_index(self):
+        """Builds the index if it is stale and indexes the pending (appended) areas."""
+        if self.stale or self.nreplaced > len(self.cells):
+            self.release()
+            self.nreplaced = 0
+            self.pending = [(1, 1, self.store.ncols, self.store.nrows)]
+            self.stale = False
+        while self.pending:
+            self.index_area(*self.pending.pop())
+
+    def candidates(self, query: str, mode: Mode) -> Iterable[int]:
+        """Returns the live slots that may match the query."""
+        folded, keys = query.casefold(), self.slot_keys
+        if mode == 'whole':
+            return {slot for slot in self.exact.get(folded, ()) if keys[slot]}
+        if mode == 'substring' and len(folded) >= 3:
+            # The rarest trigram of the query gives the shortest candidates list
+            postings = min((self.postings.get(trigram, ()) for trigram in trigrams(folded)), key=len)
+            return {slot for slot in postings if keys[slot]}
+        # Short substrings and regular expressions are verified over the indexed texts
+        return self.cells.values()
+
+    def matcher(self, query: str, mode: Mode, match_case: bool) -> re.Pattern:
+        pattern = query if mode == 'regex' else re.escape(query)
+        if mode == 'whole':
+            pattern = f"(?:{pattern})\\Z"
+        return re.compile(pattern, 0 if match_case else re.IGNORECASE)
+
+    def find(self, query: str, mode: Mode='substring', match_case: bool=False) -> list[tuple[int, int]]:
+        """Returns the cells whose display value matches query, in row-major order.
+        Raises re.error for an invalid regular expression."""
+        if not query:
+            return []
+        self.ensure_index()
+        matcher = self.matcher(query, mode, match_case)
+        match = matcher.match if mode == 'whole' else matcher.search
+        texts, keys = self.slot_texts, self.slot_keys
+        found = sorted(keys[slot] for slot in self.candidates(query, mode) if match(texts[slot]))
+        return [key_cell(key) for key in found]
+
+    def find_next(self, query: str, cell: tuple[int, int], mode: Mode='substring', match_case: bool=False,
+                  backwards: bool=False) -> tuple[int, int] | None:
+        """Returns the first match after (before if backwards) cell, wrapping around the sheet."""
+        keys = [cell_key(*match) for match in self.find(query, mode, match_case)]
+        if not keys:
+            return None
+        if backwards:
+            ndx = bisect.bisect_left(keys, cell_key(*cell)) - 1
+        else:
+            ndx = bisect.bisect_right(keys, cell_key(*cell)) % len(keys)
+        return key_cell(keys[ndx])
+
+    def replace_all(self, query: str, repl: str, mode: Mode='substring', match_case: bool=False) -> int:
+        """Replaces the matches in the stored values (formula cells are skipped). The replaced values are parsed
+        like the cell edits, so numbers stay numbers. Returns the replaced cells."""
+        matcher = self.matcher(query, mode, match_case)
+        if mode != 'regex':
+            repl = repl.replace('\\', '\\\\')
+        count = 0
+        for x, y in self.find(query, mode, match_case):
+            value = self.store.get(x, y)
+            if isinstance(value, str) and value.startswith('='):
+                continue
+            self.store.set(x, y, parse_input(matcher.sub(repl, str(value))))
+            count += 1
+        return count
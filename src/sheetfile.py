@@ -0,0 +1,235 @@
+''' Este módulo implementa el formato binario nativo de las hojas de cálculo (.wsh).
+    Los datos se guardan en páginas de tamaño fijo por columna con un índice de acceso directo,
+    de forma que el archivo se puede abrir mediante mmap y solo se decodifican las páginas visibles.
+
+    Estructura del archivo:
+        cabecera  -> HEADER (magic, version, page_rows, ncols, nrows, index_offset, meta_offset, meta_length)
+        páginas   -> PAGE_MIXED: count, count tipos uint8, (count + 1) offsets uint32, utf-8 blob
+                     PAGE_FLOAT: count float64 (NaN para celdas vacías)
+                     PAGE_NUMBER: count float64 (NaN para celdas vacías), count marcas uint8 (1 para enteros)
+        índice    -> ncols * npages entradas INDEX_ENTRY (offset, length, kind) ordenadas por (col, page)
+        metadatos -> JSON con las dimensiones de los encabezados, estado de paneles y rangos con nombre
+'''
+import collections
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Any
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, it is only used for the typed (number) columns
+    np = None
+
+MAGIC = b'WSHEET\x00\x01'
+VERSION = 1
+PAGE_ROWS = 4096        # Rows per column page
+PAGE_CACHE = 64         # Decoded pages kept in memory
+
+HEADER = struct.Struct('<8sIIIIQQQ')
+INDEX_ENTRY = struct.Struct('<QII')
+
+PAGE_EMPTY = 0
+PAGE_TEXT = 1           # Text pages of the first files, an empty text was read as an empty cell
+PAGE_FLOAT = 2
+PAGE_NUMBER = 3
+PAGE_MIXED = 4
+TYPED_PAGES = (PAGE_EMPTY, PAGE_FLOAT, PAGE_NUMBER)     # Pages read by column_array
+
+CELL_EMPTY = 0          # Cell types of the mixed pages
+CELL_TEXT = 1
+CELL_INT = 2
+CELL_FLOAT = 3
+
+MAX_EXACT_INT = 2 ** 53     # Larger ints are not exact in a float64, their pages are mixed
+
+
+def _cell_type(value: Any) -> int:
+    if value is None:
+        return CELL_EMPTY
+    if isinstance(value, bool):
+        return CELL_TEXT
+    if isinstance(value, int):
+        return CELL_INT
+    return CELL_FLOAT if isinstance(value, float) else CELL_TEXT
+
+
+def _encode_page(values: list[Any]) -> tuple[int, bytes]:
+    """Returns the (kind, payload) encoding for a page of values."""
+    types = bytes(map(_cell_type, values))
+    if not any(types):
+        return PAGE_EMPTY, b''
+    header = struct.pack('<I', len(values))
+    if CELL_TEXT not in types and all(abs(value) <= MAX_EXACT_INT for value in values if type(value) is int):
+        data = array('d', (math.nan if value is None else float(value) for value in values))
+        if CELL_INT not in types:
+            return PAGE_FLOAT, header + data.tobytes()
+        return PAGE_NUMBER, header + data.tobytes() + bytes(cell_type == CELL_INT for cell_type in types)
+    # The numbers keep their type, an empty text is told apart from an empty cell by its type
+    blobs = [b'' if value is None else str(value).encode('utf-8') for value in values]
+    offsets = array('I', [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return PAGE_MIXED, header + types + offsets.tobytes() + b''.join(blobs)
+
+
+def _decode_page(kind: int, buffer, offset: int) -> list[Any]:
+    """Decodes the page stored at offset in buffer."""
+    count, = struct.unpack_from('<I', buffer, offset)
+    offset += 4
+    if kind in (PAGE_FLOAT, PAGE_NUMBER):
+        data = array('d')
+        data.frombytes(buffer[offset: offset + 8 * count])
+        if kind == PAGE_FLOAT:
+            return [None if math.isnan(value) else value for value in data]
+        ints = buffer[offset + 8 * count: offset + 9 * count]
+        return [None if math.isnan(value) else int(value) if is_int else value for value, is_int in zip(data, ints)]
+    if kind == PAGE_MIXED:
+        types = buffer[offset: offset + count]
+        offset += count
+    else:
+        types = None
+    offsets = array('I')
+    offsets.frombytes(buffer[offset: offset + 4 * (count + 1)])
+    offset += 4 * (count + 1)
+    blob = buffer[offset: offset + offsets[-1]]
+    if types is None:
+        return [
+            blob[offsets[i]: offsets[i + 1]].decode('utf-8') if offsets[i] != offsets[i + 1] else None
+            for i in range(count)
+        ]
+    decode = {CELL_EMPTY: lambda text: None, CELL_TEXT: str, CELL_INT: int, CELL_FLOAT: float}
+    return [decode[types[i]](blob[offsets[i]: offsets[i + 1]].decode('utf-8')) for i in range(count)]
+
+
+def write_sheet(fname: str, store, meta: dict=None, page_rows: int=PAGE_ROWS):
+    """Writes the store data and the meta dictionary (look state, named ranges) to fname."""
+    ncols, nrows = store.ncols, store.nrows
+    npages = -(-nrows // page_rows)
+    index = []
+    # The store may be backed by fname itself, so the file is written aside and then replaced.
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'wb') as f:
+        f.write(b'\x00' * HEADER.size)
+        for x in range(1, ncols + 1):
+            for npage in range(npages):
+                y0 = npage * page_rows + 1
+                y1 = min(nrows, y0 + page_rows - 1)
+                kind, payload = _encode_page(store.column_slice(x, y0, y1))
+                index.append((f.tell(), len(payload), kind))
+                f.write(payload)
+        index_offset = f.tell()
+        for entry in index:
+            f.write(INDEX_ENTRY.pack(*entry))
+        meta_offset = f.tell()
+        payload = json.dumps(meta or {}).encode('utf-8')
+        f.write(payload)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, page_rows, ncols, nrows, index_offset, meta_offset, len(payload)))
+    os.replace(tmp_fname, fname)
+
+
+class SheetFile:
+    """Read-only, memory mapped sheet file. Pages are decoded on demand and kept in a small LRU cache, shared
+    with the background readers (exports, parallel recalculation) under a lock."""
+    def __init__(self, fname: str):
+        self.fname = fname
+        self.pages = collections.OrderedDict()      # (x, npage) -> decoded values
+        self.pages_decoded = 0
+        self._lock = threading.Lock()
+        self._file = open(fname, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.page_rows, self.ncols, self.nrows, self._index_offset, meta_offset, meta_length = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{fname} is not a worksheet file")
+        self.npages = -(-self.nrows // self.page_rows)
+        self.meta = json.loads(self._mmap[meta_offset: meta_offset + meta_length] or b'{}')
+
+    def close(self):
+        with self._lock:
+            self.pages.clear()
+        self._mmap.close()
+        self._file.close()
+
+    def cache_size(self) -> int:
+        """Estimates the memory held by the decoded pages."""
+        with self._lock:
+            return sum(64 * len(values) for values in self.pages.values() if values is not None)
+
+    def release(self):
+        with self._lock:
+            self.pages.clear()
+
+    def page(self, x: int, npage: int) -> list[Any] | None:
+        """Returns the decoded values for the npage page of column x (None for empty pages)."""
+        key = (x, npage)
+        with self._lock:
+            try:
+                self.pages.move_to_end(key)
+                return self.pages[key]
+            except KeyError:
+                pass
+            entry_offset = self._index_offset + ((x - 1) * self.npages + npage) * INDEX_ENTRY.size
+            offset, length, kind = INDEX_ENTRY.unpack_from(self._mmap, entry_offset)
+            values = _decode_page(kind, self._mmap, offset) if kind != PAGE_EMPTY else None
+            self.pages_decoded += 1
+            self.pages[key] = values
+            if len(self.pages) > PAGE_CACHE:
+                self.pages.popitem(last=False)
+            return values
+
+    def get(self, x: int, y: int) -> Any:
+        """Returns the value of the (x, y) cell, decoding only the page containing it."""
+        if not (1 <= x <= self.ncols and 1 <= y <= self.nrows):
+            return None
+        npage, ndx = divmod(y - 1, self.page_rows)
+        values = self.page(x, npage)
+        return values[ndx] if values is not None else None
+
+    def column_slice(self, x: int, y0: int, y1: int) -> list[Any]:
+        """Returns the values of column x from row y0 to row y1 (both included)."""
+        answ = []
+        y = y0
+        while y <= y1:
+            npage, ndx = divmod(y - 1, self.page_rows)
+            n = min(y1 - y + 1, self.page_rows - ndx)
+            values = self.page(x, npage) if 1 <= x <= self.ncols and y <= self.nrows else None
+            values = values[ndx: ndx + n] if values is not None else []
+            answ.extend(values + [None] * (n - len(values)))
+            y += n
+        return answ
+
+    def column_array(self, x: int, y0: int, y1: int):
+        """Returns column x from row y0 to row y1 as a float64 numpy array (NaN for empty cells), read directly
+        from the mapped number pages. Returns None if numpy is not available or the range holds mixed pages."""
+        if np is None or not (1 <= x <= self.ncols):
+            return None
+        pieces = []
+        y = y0
+        while y <= y1:
+            npage, ndx = divmod(y - 1, self.page_rows)
+            n = min(y1 - y + 1, self.page_rows - ndx)
+            kind = PAGE_EMPTY
+            if y <= self.nrows:
+                entry_offset = self._index_offset + ((x - 1) * self.npages + npage) * INDEX_ENTRY.size
+                offset, length, kind = INDEX_ENTRY.unpack_from(self._mmap, entry_offset)
+            if kind not in TYPED_PAGES:
+                return None
+            if kind != PAGE_EMPTY:
+                count, = struct.unpack_from('<I', self._mmap, offset)
+                piece = np.frombuffer(self._mmap, dtype='<f8', count=count, offset=offset + 4)[ndx: ndx + n]
+                pieces.append(piece)
+                n_missing = n - len(piece)
+            else:
+                n_missing = n
+            if n_missing:
+                pieces.append(np.full(n_missing, np.nan))
+            y += n
+        # The concatenation copies the mapped data, so no buffer stays exported from the mmap
+        return np.concatenate(pieces) if pieces else np.empty(0)
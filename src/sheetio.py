@@ -0,0 +1,228 @@
+''' Este módulo implementa la importación y exportación de hojas de cálculo en formatos de texto (CSV/TSV).
+    Los archivos grandes se procesan en hilos de fondo para que la interfaz siga respondiendo.
+    El portapapeles usa el mismo formato (TSV): la copia se serializa por bloques y el pegado se analiza
+    en un hilo de fondo.
+'''
+import collections
+import csv
+import io
+import os
+import queue
+import threading
+from array import array
+from typing import Any, Iterable, Iterator
+
+from cellvalues import parse_input
+
+ROW_BLOCK = 4096        # Rows per parsed block
+BLOCK_CACHE = 64        # Parsed blocks kept in memory
+EXPORT_BUFFER = 1 << 20 # Write buffer size for the exports
+EXPORT_QUEUE = 4        # Blocks of rows read ahead of the export writer
+
+
+class CsvSource:
+    """Append-only base source for the SheetStore backed by a CSV file.
+
+    The rows are parsed in blocks of ROW_BLOCK rows. The byte offset of every block is kept in a sparse
+    row-offset index, so any parsed row is reached in O(1): the block is taken from the LRU cache or
+    re-parsed from its offset in the file.
+    """
+    def __init__(self, fname: str, delimiter: str=',', encoding: str='utf-8'):
+        self.fname = fname
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.ncols = 0
+        self.nrows = 0                                  # Watermark: rows already parsed
+        self.offsets = array('Q', [0])                  # Byte offset for the first row of every block
+        self.blocks = collections.OrderedDict()         # nblock -> rows
+        self._lock = threading.Lock()
+        self._file = None
+
+    def parse(self, data: bytes) -> list[list[str]]:
+        text = data.decode(self.encoding, errors='replace')
+        return list(csv.reader(io.StringIO(text), delimiter=self.delimiter))
+
+    def append_block(self, rows: list[list[str]], end_offset: int):
+        """Publishes a new block of parsed rows ending at end_offset in the file."""
+        with self._lock:
+            self.blocks[len(self.offsets) - 1] = rows
+            if len(self.blocks) > BLOCK_CACHE:
+                self.blocks.popitem(last=False)
+            self.offsets.append(end_offset)
+        self.ncols = max(self.ncols, max(map(len, rows), default=0))
+        self.nrows += len(rows)
+
+    def block(self, nblock: int) -> list[list[str]]:
+        """Returns the rows of the nblock block, re-parsing it from the file if it is not cached."""
+        with self._lock:
+            try:
+                self.blocks.move_to_end(nblock)
+                return self.blocks[nblock]
+            except KeyError:
+                pass
+            offset0, offset1 = self.offsets[nblock], self.offsets[nblock + 1]
+            # The file is shared by the Tk thread and the export workers
+            if self._file is None:
+                self._file = open(self.fname, 'rb')
+            self._file.seek(offset0)
+            data = self._file.read(offset1 - offset0)
+        rows = self.parse(data)
+        with self._lock:
+            self.blocks[nblock] = rows
+            if len(self.blocks) > BLOCK_CACHE:
+                self.blocks.popitem(last=False)
+        return rows
+
+    def cache_size(self) -> int:
+        """Estimates the memory held by the parsed blocks."""
+        with self._lock:
+            return sum(64 * len(row) for rows in self.blocks.values() for row in rows)
+
+    def release(self):
+        """Drops the parsed blocks, they are parsed again from the file when needed."""
+        with self._lock:
+            self.blocks.clear()
+
+    def get(self, x: int, y: int) -> Any:
+        if not (1 <= y <= self.nrows):
+            return None
+        nblock, ndx = divmod(y - 1, ROW_BLOCK)
+        row = self.block(nblock)[ndx]
+        return (row[x - 1] or None) if x <= len(row) else None
+
+    def column_slice(self, x: int, y0: int, y1: int) -> list[Any]:
+        return [self.get(x, y) for y in range(y0, y1 + 1)]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CsvImporter(threading.Thread):
+    """Background worker parsing a CSV file into a CsvSource, block by block."""
+    def __init__(self, fname: str, delimiter: str=','):
+        super().__init__(name='csv_importer', daemon=True)
+        self.source = CsvSource(fname, delimiter=delimiter)
+        self.cancel_event = threading.Event()
+        self.nbytes = 0
+        self.size = 0
+        self.error = None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def progress(self) -> float:
+        return self.nbytes / self.size if self.size else 1.0
+
+    def run(self):
+        source = self.source
+        try:
+            with open(source.fname, 'rb') as f:
+                f.seek(0, io.SEEK_END)
+                self.size = f.tell()
+                f.seek(0)
+                if f.read(3) != b'\xef\xbb\xbf':
+                    f.seek(0)
+                # The first block starts after the BOM, so it is not parsed again when the block is re-read
+                offset = source.offsets[0] = f.tell()
+                lines, nrecords, quotes = [], 0, 0
+                for line in f:
+                    lines.append(line)
+                    offset += len(line)
+                    # A record is complete when its quotes are balanced (quoted fields may hold newlines)
+                    quotes += line.count(b'"')
+                    if quotes % 2:
+                        continue
+                    quotes = 0
+                    nrecords += 1
+                    if nrecords == ROW_BLOCK:
+                        source.append_block(source.parse(b''.join(lines)), offset)
+                        self.nbytes = offset
+                        lines, nrecords = [], 0
+                        if self.cancel_event.is_set():
+                            return
+                if lines:
+                    source.append_block(source.parse(b''.join(lines)), offset)
+                self.nbytes = offset
+        except Exception as e:
+            self.error = e
+
+
+class CsvExporter(threading.Thread):
+    """Background worker streaming blocks of rows to a CSV/TSV file in buffered chunks. The rows are read by the
+    owner of the data (e.g. the Tk thread from SheetLook.iter_values) and handed over as plain values with put,
+    a None block ends the export. nrows is the number of rows expected, for the progress."""
+    def __init__(self, fname: str, nrows: int, delimiter: str=','):
+        super().__init__(name='csv_exporter', daemon=True)
+        self.blocks = queue.Queue(EXPORT_QUEUE)
+        self.fname = fname
+        self.total = nrows
+        self.delimiter = delimiter
+        self.cancel_event = threading.Event()
+        self.nrows = 0
+        self.error = None
+
+    def put(self, rows: list[list[Any]] | None) -> bool:
+        """Queues a block of rows (None when there are no more), returns False if the queue is full."""
+        try:
+            self.blocks.put_nowait(rows)
+        except queue.Full:
+            return False
+        return True
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.put(None)      # Wakes up the writer if it waits for a block
+
+    def progress(self) -> float:
+        return self.nrows / self.total if self.total > 0 else 1.0
+
+    def run(self):
+        # The rows are written aside and the file is renamed when the export is complete.
+        tmp_fname = self.fname + '.tmp'
+        try:
+            with open(tmp_fname, 'w', newline='', encoding='utf-8', buffering=EXPORT_BUFFER) as f:
+                writer = csv.writer(f, delimiter=self.delimiter)
+                for rows in iter(self.blocks.get, None):
+                    if self.cancel_event.is_set():
+                        break
+                    writer.writerows(['' if value is None else value for value in row] for row in rows)
+                    self.nrows += len(rows)
+            if self.cancel_event.is_set():
+                os.remove(tmp_fname)
+            else:
+                os.replace(tmp_fname, self.fname)
+        except Exception as e:
+            self.error = e
+
+
+def tsv_chunks(blocks: Iterable[list[list[Any]]], delimiter: str='\t') -> Iterator[str]:
+    """Serialises blocks of rows as TSV text (quoted as other spreadsheets do), one text chunk per block."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator='\n')
+    for rows in blocks:
+        writer.writerows(['' if value is None else value for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class TsvParser(threading.Thread):
+    """Background worker parsing pasted TSV text into rows of values, stored like typed cells: numeric text is a
+    number and empty fields are None."""
+    def __init__(self, text: str, delimiter: str='\t'):
+        super().__init__(name='tsv_parser', daemon=True)
+        self.text = text
+        self.delimiter = delimiter
+        self.rows = None
+        self.error = None
+
+    def run(self):
+        try:
+            reader = csv.reader(io.StringIO(self.text), delimiter=self.delimiter)
+            self.rows = [[parse_input(field) if field != '' else None for field in row] for row in reader]
+        except Exception as e:
+            self.error = e
+        finally:
+            self.text = None    # The parsed rows replace the text
@@ -0,0 +1,210 @@
+''' Este módulo implementa el almacén de datos de la hoja de cálculo.
+    Las celdas se guardan por columnas en una capa editable que se superpone a una fuente base
+    de solo lectura (por ejemplo un archivo de hoja mapeado en memoria).
+'''
+from typing import Any, Callable, Iterator, Literal
+
+
+class SheetStore:
+    """Sparse columnar cell store: an editable overlay over an optional read-only base source.
+
+    The base source must provide the ``ncols``, ``nrows`` attributes and the ``get(x, y)`` and
+    ``column_slice(x, y0, y1)`` methods. Structural edits (insert/delete rows or columns) shift the
+    overlay and are journaled so that the current addresses can be translated to base addresses.
+    """
+    def __init__(self, base=None):
+        self.base = base
+        self.columns: dict[int, dict[int, Any]] = {}        # x -> {y: value}
+        self._ops = ([], [])                                 # Structural edits per axis (kind, x0, n)
+        self.ncols, self.nrows = (base.ncols, base.nrows) if base is not None else (0, 0)
+        self.listeners: list[Callable[[str, int, int, int, int], None]] = []
+
+    def add_listener(self, fnc: Callable[[str, int, int, int, int], None], first: bool=False):
+        """Registers fnc(kind, x0, y0, x1, y1) to be called after every change in the store.
+        kind is one of 'set', 'append', 'insert_rows', 'delete_rows', 'insert_cols' or 'delete_cols'.
+        The first listeners are called before the others: indexes keyed by address that shift on structural
+        edits before the formula engine reports the cells it recalculates at their new addresses."""
+        if first:
+            self.listeners.insert(0, fnc)
+        else:
+            self.listeners.append(fnc)
+
+    def remove_listener(self, fnc: Callable[[str, int, int, int, int], None]):
+        self.listeners.remove(fnc)
+
+    def notify(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        for fnc in self.listeners:
+            fnc(kind, x0, y0, x1, y1)
+
+    def sync_base(self):
+        """Updates the extent after the base source has grown (e.g. while it is being imported)."""
+        ncols, nrows = self.ncols, self.nrows
+        net = [sum(n if kind == 'insert' else -n for kind, x0, n in ops) for ops in self._ops]
+        self.ncols = max(ncols, self.base.ncols + net[0])
+        self.nrows = max(nrows, self.base.nrows + net[1])
+        if self.ncols > ncols:
+            self.notify('append', ncols + 1, 1, self.ncols, self.nrows)
+        if self.nrows > nrows:
+            self.notify('append', 1, nrows + 1, self.ncols, self.nrows)
+
+    def to_base(self, addr: int, axis: Literal[0, 1]=0) -> int | None:
+        """Translates a current column/row address to the base address (None for inserted headings)."""
+        for kind, x0, n in reversed(self._ops[axis]):
+            if kind == 'insert':
+                if addr >= x0 + n:
+                    addr -= n
+                elif addr >= x0:
+                    return None
+            elif addr >= x0:
+                addr += n
+        return addr
+
+    def get(self, x: int, y: int) -> Any:
+        """Returns the value stored in the cell or None if the cell is empty."""
+        col = self.columns.get(x)
+        if col is not None and y in col:
+            return col[y]
+        if self.base is None:
+            return None
+        bx, by = self.to_base(x, axis=0), self.to_base(y, axis=1)
+        if bx is None or by is None or bx > self.base.ncols or by > self.base.nrows:
+            return None
+        return self.base.get(bx, by)
+
+    def set(self, x: int, y: int, value: Any):
+        """Stores value in the cell. A None value clears the cell."""
+        self.columns.setdefault(x, {})[y] = value
+        self.ncols, self.nrows = max(self.ncols, x), max(self.nrows, y)
+        self.notify('set', x, y, x, y)
+
+    def set_block(self, x0: int, y0: int, rows: list[list[Any]]):
+        """Stores a block of rows with its top-left corner in the (x0, y0) cell."""
+        if not rows:
+            return
+        ncols = max(map(len, rows))
+        for dx in range(ncols):
+            col = self.columns.setdefault(x0 + dx, {})
+            for dy, row in enumerate(rows):
+                if dx < len(row):
+                    col[y0 + dy] = row[dx]
+        x1, y1 = x0 + ncols - 1, y0 + len(rows) - 1
+        self.ncols, self.nrows = max(self.ncols, x1), max(self.nrows, y1)
+        self.notify('set', x0, y0, x1, y1)
+
+    def column_slice(self, x: int, y0: int, y1: int) -> list[Any]:
+        """Returns the values of the cells in column x from row y0 to row y1 (both included)."""
+        col = self.columns.get(x, {})
+        if self.base is not None and not any(self._ops) and not any(y0 <= y <= y1 for y in col):
+            if x > self.base.ncols or y0 > self.base.nrows:
+                return [None] * (y1 - y0 + 1)
+            answ = self.base.column_slice(x, y0, min(y1, self.base.nrows))
+            return answ + [None] * (y1 - y0 + 1 - len(answ))
+        return [self.get(x, y) for y in range(y0, y1 + 1)]
+
+    def column_array(self, x: int, y0: int, y1: int):
+        """Returns column x from row y0 to row y1 as a float64 numpy array when the range is stored unedited in a
+        typed column of the base source. Returns None otherwise (the caller must iterate the values)."""
+        if self.base is None or any(self._ops) or not hasattr(self.base, 'column_array'):
+            return None
+        if any(y0 <= y <= y1 for y in self.columns.get(x, {})):
+            return None
+        return self.base.column_array(x, y0, y1)
+
+    def iter_rows(self, x0: int, y0: int, x1: int, y1: int, chunk: int=1024) -> Iterator[list[list[Any]]]:
+        """Yields the rows in the x0:x1, y0:y1 range in blocks of at most chunk rows."""
+        for cy0 in range(y0, y1 + 1, chunk):
+            cy1 = min(y1, cy0 + chunk - 1)
+            columns = [self.column_slice(x, cy0, cy1) for x in range(x0, x1 + 1)]
+            yield [list(row) for row in zip(*columns)]
+
+    def _shift(self, x0: int, n: int, axis: Literal[0, 1]=0):
+        """Shifts by n the overlay addresses >= x0, dropping the ones left in the deleted headings."""
+        if axis == 0:
+            self.columns = {
+                (x + n if x >= x0 else x): col for x, col in self.columns.items() if not (x0 <= x < x0 - n)
+            }
+        else:
+            self.columns = {
+                x: {(y + n if y >= x0 else y): value for y, value in col.items() if not (x0 <= y < x0 - n)}
+                for x, col in self.columns.items()
+            }
+
+    def insert(self, x0: int, x1: int, axis: Literal[0, 1]=0):
+        """Inserts (x1 - x0 + 1) empty columns/rows before the heading x0."""
+        n = x1 - x0 + 1
+        self._shift(x0, n, axis=axis)
+        if self.base is not None:
+            self._ops[axis].append(('insert', x0, n))
+        # Structural events report the inserted/deleted headings, the addresses after them are shifted
+        if axis == 0:
+            self.ncols += n
+            self.notify('insert_cols', x0, 1, x1, self.nrows)
+        else:
+            self.nrows += n
+            self.notify('insert_rows', 1, x0, self.ncols, x1)
+
+    def delete(self, x0: int, x1: int, axis: Literal[0, 1]=0):
+        """Deletes the columns/rows from heading x0 to heading x1 (both included)."""
+        n = x1 - x0 + 1
+        self._shift(x0, -n, axis=axis)
+        if self.base is not None:
+            self._ops[axis].append(('delete', x0, n))
+        if axis == 0:
+            self.ncols = max(0, self.ncols - n)
+            self.notify('delete_cols', x0, 1, x1, self.nrows)
+        else:
+            self.nrows = max(0, self.nrows - n)
+            self.notify('delete_rows', 1, x0, self.ncols, x1)
+
+    def extract(self, x0: int, x1: int, axis: Literal[0, 1]=0) -> dict[int, dict[int, Any]]:
+        """Returns the overlay cells in the columns/rows from heading x0 to heading x1 (e.g. before deleting them)."""
+        if axis == 0:
+            return {x: dict(col) for x, col in self.columns.items() if x0 <= x <= x1}
+        return {
+            x: cells for x, col in self.columns.items() if (cells := {y: v for y, v in col.items() if x0 <= y <= x1})
+        }
+
+    def revert(self, kind: Literal['insert', 'delete'], x0: int, x1: int, axis: Literal[0, 1]=0,
+               cells: dict[int, dict[int, Any]]=None):
+        """Reverts the last insert/delete of the x0:x1 headings, restoring the deleted overlay cells. When it is the
+        last structural edit journaled over the base, the edit is dropped so the base cells come back as they were."""
+        n = x1 - x0 + 1
+        if self.base is not None:
+            ops = self._ops[axis]
+            if ops and ops[-1] == (kind, x0, n):
+                ops.pop()
+            else:
+                ops.append(('delete' if kind == 'insert' else 'insert', x0, n))
+        if kind == 'insert':
+            self._shift(x0, -n, axis=axis)
+            if axis == 0:
+                self.ncols = max(0, self.ncols - n)
+                self.notify('delete_cols', x0, 1, x1, self.nrows)
+            else:
+                self.nrows = max(0, self.nrows - n)
+                self.notify('delete_rows', 1, x0, self.ncols, x1)
+            return
+        self._shift(x0, n, axis=axis)
+        if axis == 0:
+            self.ncols += n
+            self.notify('insert_cols', x0, 1, x1, self.nrows)
+        else:
+            self.nrows += n
+            self.notify('insert_rows', 1, x0, self.ncols, x1)
+        # The restored cells are notified as written after the shift (the formulas keep their original text)
+        for x, col in (cells or {}).items():
+            if col:
+                self.columns.setdefault(x, {}).update(col)
+                self.notify('set', x, min(col), x, max(col))
+
+    def insert_rows(self, y0: int, y1: int):
+        self.insert(y0, y1, axis=1)
+
+    def delete_rows(self, y0: int, y1: int):
+        self.delete(y0, y1, axis=1)
+
+    def insert_columns(self, x0: int, x1: int):
+        self.insert(x0, x1, axis=0)
+
+    def delete_columns(self, x0: int, x1: int):
+        self.delete(x0, x1, axis=0)
@@ -0,0 +1,96 @@
+''' Este módulo calcula la huella canónica del estado dibujado de una hoja para las pruebas de regresión de las macros.
+    La huella reúne el estado de la vista (viewports, selección, dimensiones) y la geometría y el texto de los
+    elementos del canvas agrupados por tags. Cada grupo tiene su propia huella, de forma que dos instantáneas se
+    comparan de forma compacta, grupo a grupo, sin guardar la lista completa de elementos.
+'''
+import hashlib
+import json
+from typing import Iterable, NamedTuple
+
+DIGEST_PREFIX = "#@digest "     # Macro line with the snapshot after the previous step, a comment for older readers
+DIGEST_SIZE = 16                # Bytes of the snapshot digest
+GROUP_DIGEST_SIZE = 8           # Bytes of the digest of a tag group
+IGNORED_TAGS = ('current',)     # Tags Tk adds by itself (the item under the pointer)
+FLOAT_FORMAT = '{:g}'.format    # Coordinates of the hashed items
+
+# (kind, coords, text, tags, state) of a canvas item, see SheetUI.item_records
+Record = tuple[str, tuple[float, ...], str, tuple[str, ...], str]
+
+
+def canonical_state(state: dict) -> dict:
+    """Returns the look state as it reads back from json, so that live and recorded states compare equal."""
+    return json.loads(json.dumps(state, sort_keys=True))
+
+
+class Snapshot(NamedTuple):
+    digest: str
+    state: dict                             # Canonical look state, see SheetLook.get_state
+    groups: dict[str, tuple[str, int]]      # Tags of the items -> (group digest, number of items)
+
+    def to_line(self) -> str:
+        """Returns the snapshot as a macro line."""
+        return DIGEST_PREFIX + json.dumps(dict(digest=self.digest, state=self.state, groups=self.groups),
+                                          sort_keys=True, separators=(',', ':'))
+
+    @classmethod
+    def from_line(cls, line: str) -> 'Snapshot':
+        data = json.loads(line[len(DIGEST_PREFIX):])
+        return cls(data['digest'], data['state'], {tags: tuple(group) for tags, group in data['groups'].items()})
+
+    def diff(self, recorded: 'Snapshot') -> list[str]:
+        """Returns the state keys and tag groups that differ from the recorded snapshot, one line each."""
+        answ = [
+            f"{key}: {recorded.state.get(key)} -> {self.state.get(key)}"
+            for key in sorted(self.state.keys() | recorded.state.keys())
+            if self.state.get(key) != recorded.state.get(key)
+        ]
+        for tags in sorted(self.groups.keys() | recorded.groups.keys()):
+            old, new = recorded.groups.get(tags), self.groups.get(tags)
+            if old is None:
+                answ.append(f"+ {tags}: {new[1]} items")
+            elif new is None:
+                answ.append(f"- {tags}: {old[1]} items")
+            elif old != new:
+                answ.append(f"~ {tags}: {old[1]} -> {new[1]} items")
+        return answ
+
+
+def record_hash(record: Record) -> int:
+    kind, coords, text, tags, item_state = record
+    line = f"{kind} {' '.join(map(FLOAT_FORMAT, coords))} {item_state} {text!r}"
+    return int.from_bytes(hashlib.blake2b(line.encode(), digest_size=GROUP_DIGEST_SIZE).digest(), 'little')
+
+
+def take_snapshot(state: dict, records: Iterable[Record], cache: dict=None) -> Snapshot:
+    """Returns the snapshot of the look state and the canvas items. The items are grouped by their tags and the
+    digest of a group is the sum of the hashes of its items, so it does not depend on the item ids or on the
+    stacking order inside the group.
+
+    cache keeps the hashes of the records between the snapshots of a canvas, so a macro step only formats and
+    hashes the items it redrew."""
+    previous, hashes = cache or {}, {}
+    groups: dict[str, list[int]] = {}                   # Tags -> [sum of the hashes, number of items]
+    keys: dict[tuple[str, ...], str] = {}
+    for record in records:
+        if (key := keys.get(tags := record[3])) is None:
+            key = keys[tags] = ' '.join(tag for tag in tags if tag not in IGNORED_TAGS)
+        if (value := previous.get(record)) is None:
+            value = record_hash(record)
+        hashes[record] = value
+        if (group := groups.get(key)) is None:
+            group = groups[key] = [0, 0]
+        group[0] += value
+        group[1] += 1
+    if cache is not None:
+        # Only the records of this snapshot are kept
+        cache.clear()
+        cache.update(hashes)
+    state = canonical_state(state)
+    digests = {}
+    total = hashlib.blake2b(json.dumps(state, sort_keys=True).encode(), digest_size=DIGEST_SIZE)
+    for key in sorted(groups):
+        value, count = groups[key]
+        digest = f"{value % (1 << 8 * GROUP_DIGEST_SIZE):0{2 * GROUP_DIGEST_SIZE}x}"
+        digests[key] = (digest, count)
+        total.update(f"\n{key}:{digest}".encode())
+    return Snapshot(total.hexdigest(), state, digests)
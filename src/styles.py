@@ -0,0 +1,224 @@
+''' Este módulo implementa los estilos de celda de la hoja de cálculo.
+    Los estilos (fuente, colores, alineación y formato numérico) se internan en una tabla pequeña y cada
+    columna guarda tramos de filas con el mismo identificador de estilo, de forma que dar estilo a una
+    columna entera ocupa un solo registro.
+'''
+import bisect
+from array import array
+from typing import Iterator, NamedTuple
+
+MAX_STYLES = 1 << 16    # Style ids are stored as unsigned shorts
+
+
+class Style(NamedTuple):
+    font: str | None = None             # Tk font description, None for the canvas default font
+    fill: str = "black"                 # Text color
+    background: str | None = None       # Cell background color, None for no background
+    anchor: str = "center"              # Text alignment: "w", "center" or "e"
+    number_format: str | None = None    # Format specification of the numeric values
+
+    def text_options(self) -> dict:
+        """Returns the canvas text options shared by all the cells with the style."""
+        return dict(fill=self.fill, font=self.font) if self.font else dict(fill=self.fill)
+
+
+DEFAULT_STYLE = Style()
+
+
+class StyleTable:
+    """Interned styles: every distinct style is stored once and referenced by its id (0 is the default style)."""
+    def __init__(self):
+        self.styles: list[Style] = [DEFAULT_STYLE]
+        self.ids: dict[Style, int] = {DEFAULT_STYLE: 0}
+
+    def __getitem__(self, sid: int) -> Style:
+        return self.styles[sid]
+
+    def __len__(self) -> int:
+        return len(self.styles)
+
+    def intern(self, style: Style) -> int:
+        if (sid := self.ids.get(style)) is None:
+            if len(self.styles) >= MAX_STYLES:
+                raise ValueError(f"Too many styles (max {MAX_STYLES})")
+            sid = self.ids[style] = len(self.styles)
+            self.styles.append(style)
+        return sid
+
+
+class StyleRuns:
+    """Run-length style ids of a column: the rows from starts[i] to starts[i + 1] - 1 have the style ids[i]."""
+    def __init__(self, starts: list[int]=(1,), ids: list[int]=(0,)):
+        self.starts = array('I', starts)
+        self.ids = array('H', ids)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def get(self, y: int) -> int:
+        return self.ids[bisect.bisect_right(self.starts, y) - 1]
+
+    def segments(self, y0: int, y1: int) -> Iterator[tuple[int, int, int]]:
+        """Yields the (first row, last row, style id) runs covering the rows y0 to y1."""
+        ndx = bisect.bisect_right(self.starts, y0) - 1
+        while ndx < len(self.starts) and self.starts[ndx] <= y1:
+            end = self.starts[ndx + 1] - 1 if ndx + 1 < len(self.starts) else y1
+            yield max(y0, self.starts[ndx]), min(y1, end), self.ids[ndx]
+            ndx += 1
+
+    def assign(self, y0: int, y1: int | None, sid: int):
+        """Sets the style of the rows y0 to y1 (to the last row if y1 is None)."""
+        i0 = bisect.bisect_left(self.starts, y0)
+        if y1 is None:
+            starts, ids, i1 = [y0], [sid], len(self.starts)
+        else:
+            starts, ids, i1 = [y0, y1 + 1], [sid, self.get(y1 + 1)], bisect.bisect_right(self.starts, y1 + 1)
+        self.starts[i0: i1] = array('I', starts)
+        self.ids[i0: i1] = array('H', ids)
+        self.merge(i0 - 1, i0 + len(starts))
+
+    def merge(self, lo: int, hi: int):
+        """Joins the consecutive runs with the same style between the indexes lo and hi."""
+        ndx = min(hi, len(self.starts) - 1)
+        while ndx > max(lo, 0):
+            if self.ids[ndx] == self.ids[ndx - 1]:
+                del self.starts[ndx]
+                del self.ids[ndx]
+            ndx -= 1
+
+    def shift(self, start: int, n: int):
+        """Shifts the runs for n rows inserted (n > 0) or deleted (n < 0) at row start. The inserted rows
+        take the style of the row above."""
+        if n > 0:
+            for ndx in range(1, len(self.starts)):
+                if self.starts[ndx] >= start:
+                    self.starts[ndx] += n
+            return
+        end = start - n - 1
+        starts, ids = array('I'), array('H')
+        for row, sid in zip(self.starts, self.ids):
+            row = row if row < start else (start if row <= end else row + n)
+            if starts and starts[-1] == row:
+                # The runs left empty by the delete are replaced by the next one
+                del starts[-1]
+                del ids[-1]
+            if not ids or ids[-1] != sid:
+                starts.append(row)
+                ids.append(sid)
+        self.starts, self.ids = starts, ids
+
+
+class CellStyles:
+    """Style ids of the cells of a SheetStore, kept as run-length columns of interned styles.
+
+    The columns without runs have the default style. Structural edits of the store shift the runs; the style
+    runs removed by the last delete are saved in clipped, so that undo can restore them.
+    """
+    def __init__(self, store=None):
+        self.table = StyleTable()
+        self.columns: dict[int, StyleRuns] = {}
+        self.clipped: list[tuple[int, StyleRuns | list]] = []     # (column, runs or row segments) deleted
+        if store is not None:
+            store.add_listener(self.on_store_changed)
+
+    def style_id(self, x: int, y: int) -> int:
+        return column.get(y) if (column := self.columns.get(x)) is not None else 0
+
+    def style(self, x: int, y: int) -> Style:
+        return self.table[self.style_id(x, y)]
+
+    def segments(self, x: int, y0: int, y1: int) -> list[tuple[int, int, int]]:
+        if (column := self.columns.get(x)) is None:
+            return [(y0, y1, 0)]
+        return list(column.segments(y0, y1))
+
+    def set_style(self, x0: int, y0: int, x1: int, y1: int | None, style: Style | int):
+        """Sets the style of the x0:x1, y0:y1 range (whole columns if y1 is None)."""
+        sid = style if isinstance(style, int) else self.table.intern(style)
+        for x in range(x0, x1 + 1):
+            if (column := self.columns.get(x)) is None:
+                if sid == 0:
+                    continue
+                column = self.columns[x] = StyleRuns()
+            column.assign(y0, y1, sid)
+            if len(column) == 1 and column.ids[0] == 0:
+                del self.columns[x]
+
+    def update_style(self, x0: int, y0: int, x1: int, y1: int | None, **options):
+        """Changes the given style options (e.g. fill="red") of the x0:x1, y0:y1 range, keeping the other ones."""
+        for x in range(x0, x1 + 1):
+            column = self.columns.get(x)
+            last = y1 if y1 is not None else max(y0, column.starts[-1] if column is not None else y0)
+            for s0, s1, sid in self.segments(x, y0, last):
+                style = self.table[sid]._replace(**options)
+                self.set_style(x, s0, x, None if y1 is None and s1 == last else s1, style)
+
+    def save_columns(self, x0: int, x1: int) -> dict[int, StyleRuns]:
+        """Returns a copy of the style runs of the columns x0 to x1."""
+        return {
+            x: StyleRuns(column.starts, column.ids) for x in range(x0, x1 + 1)
+            if (column := self.columns.get(x)) is not None
+        }
+
+    def restore_columns(self, x0: int, x1: int, saved: dict[int, StyleRuns]):
+        """Restores the style runs returned by save_columns."""
+        for x in range(x0, x1 + 1):
+            self.columns.pop(x, None)
+        self.columns.update(saved)
+
+    def restore(self, x: int, segments: list[tuple[int, int, int]]):
+        """Restores the segments returned by segments."""
+        for y0, y1, sid in segments:
+            self.set_style(x, y0, x, y1, sid)
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: shifts the style runs after the insert/delete of rows or columns."""
+        if kind in ('insert_rows', 'delete_rows'):
+            self.clipped = []
+            n = y1 - y0 + 1
+            for x, column in self.columns.items():
+                if kind == 'delete_rows':
+                    self.clipped.append((x, list(column.segments(y0, y1))))
+                column.shift(y0, n if kind == 'insert_rows' else -n)
+        elif kind in ('insert_cols', 'delete_cols'):
+            self.clipped = []
+            n = x1 - x0 + 1
+            columns = {}
+            for x, column in self.columns.items():
+                if x < x0:
+                    columns[x] = column
+                elif kind == 'insert_cols':
+                    columns[x + n] = column
+                elif x > x1:
+                    columns[x - n] = column
+                else:
+                    self.clipped.append((x, column))
+            self.columns = columns
+
+    def restore_clipped(self, clipped: list[tuple[int, StyleRuns | list]]):
+        """Restores the style runs saved in clipped by a delete, once the deleted headings are inserted back."""
+        for x, saved in clipped:
+            if isinstance(saved, StyleRuns):
+                self.columns[x] = saved
+            else:
+                self.restore(x, saved)
+
+    def nbytes(self) -> int:
+        """Returns the memory used by the run arrays."""
+        return sum(column.starts.itemsize * len(column.starts) + column.ids.itemsize * len(column.ids)
+                   for column in self.columns.values())
+
+    def to_dict(self) -> dict:
+        """Returns the styles as a json serializable dict."""
+        return dict(
+            table=[list(style) for style in self.table.styles],
+            columns={x: [list(column.starts), list(column.ids)] for x, column in self.columns.items()},
+        )
+
+    def load(self, state: dict):
+        """Restores the styles returned by to_dict."""
+        self.table = StyleTable()
+        sids = [self.table.intern(Style(*style)) for style in state.get('table', ())]
+        self.columns = {
+            int(x): StyleRuns(starts, [sids[sid] for sid in ids]) for x, (starts, ids) in state.get('columns', {}).items()
+        }
@@ -0,0 +1,159 @@
+''' Este módulo agrupa las órdenes al canvas de una pasada de dibujo en un solo script de Tcl.
+    Cada llamada de tkinter al canvas es un cruce Python -> Tcl y, con un display remoto, a menudo una
+    petición X. El lote acumula las órdenes y las envía de una vez con tk.eval, devolviendo juntos los
+    identificadores de los elementos creados. Un contador de cruces permite medir cada pasada.
+'''
+import re
+from contextlib import contextmanager
+from typing import Any
+
+TCL_SPECIAL = re.compile(r'[\[\]{}$;"\\\s]')
+TCL_ESCAPES = {'\n': '\\n', '\t': '\\t', '\r': '\\r'}
+
+# Replaces with "*" the texts that do not fit in their width, clips is a flat list of (create index, width)
+TCL_PROCS = r'''
+proc ::sheetui_clip {w ids clips} {
+    foreach {ndx width} $clips {
+        set id [lindex $ids $ndx]
+        lassign [$w bbox $id] x0 y0 x1 y1
+        if {$x0 ne "" && $x1 - $x0 > $width} {$w itemconfigure $id -text *}
+    }
+}
+# Returns the {kind coords text tags state} of all the items, in stacking order
+proc ::sheetui_items {w} {
+    set records {}
+    foreach id [$w find all] {
+        set kind [$w type $id]
+        set text [expr {$kind eq "text" ? [$w itemcget $id -text] : ""}]
+        lappend records [list $kind [$w coords $id] $text [$w gettags $id] [$w itemcget $id -state]]
+    }
+    return $records
+}
+'''
+
+
+def tcl_word(value: Any) -> str:
+    """Quotes the value as a single word of a Tcl script: tuples and lists as Tcl lists."""
+    if isinstance(value, (tuple, list)):
+        value = ' '.join(map(tcl_word, value))
+    text = str(value)
+    if not text:
+        return '{}'
+    return TCL_SPECIAL.sub(lambda m: TCL_ESCAPES.get(m[0], '\\' + m[0]), text)
+
+
+class TclCounter:
+    """Proxy of the Tcl interpreter of a widget counting the calls that cross from Python to Tcl."""
+    def __init__(self, tk):
+        self._tk = tk
+        self.ncalls = 0
+
+    def call(self, *args):
+        self.ncalls += 1
+        return self._tk.call(*args)
+
+    def eval(self, script: str):
+        self.ncalls += 1
+        return self._tk.eval(script)
+
+    def __getattr__(self, attr):
+        return getattr(self._tk, attr)
+
+
+class CanvasBatch:
+    """Canvas commands collected during a paint pass and submitted as a single Tcl script.
+
+    The commands run in the order they were queued, when flush is called or the batched() block ends, so the
+    canvas must not be read between the queueing and the flush. create returns the position of the item in
+    the list of ids returned by flush. The text clips run after all the commands, once the fonts of the texts
+    are configured, in a single loop of a compiled Tcl procedure.
+    """
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.commands: list[str] = []
+        self.clips: list[int] = []      # (create index, width) of the texts to clip
+        self.ncreated = 0
+        self.depth = 0
+        self.ready = False              # TCL_PROCS defined in the interpreter
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def call(self, *args):
+        """Queues the canvas subcommand with the given arguments (e.g. 'move', item, dx, dy)."""
+        self.commands.append(' '.join((self.canvas._w, *map(tcl_word, args))))
+
+    def options(self, options: dict) -> str:
+        return ' '.join(f"-{key.rstrip('_')} {tcl_word(value)}" for key, value in options.items() if value is not None)
+
+    def create(self, kind: str, *coords, **options) -> int:
+        """Queues the creation of a canvas item of the kind ('rectangle', 'text', 'line'...)."""
+        self.commands.append(
+            f"lappend ::sheetui_ids [{self.canvas._w} create {kind} {' '.join(map(str, coords))} {self.options(options)}]"
+        )
+        self.ncreated += 1
+        return self.ncreated - 1
+
+    def itemconfigure(self, tag_or_id: str | int, **options):
+        self.call('itemconfigure', tag_or_id)
+        self.commands[-1] += ' ' + self.options(options)
+
+    def clip(self, ndx: int, width: int):
+        """Queues the clip of the text created by create ndx to width (see draw_cell_content)."""
+        self.clips += (ndx, width)
+
+    def move_enclosed(self, area: tuple, dx: int, dy: int):
+        """Queues the move of the items enclosed in the area."""
+        w = self.canvas._w
+        self.commands.append(f"foreach id [{w} find enclosed {' '.join(map(str, area))}] {{{w} move $id {dx} {dy}}}")
+
+    def delete_enclosed(self, area: tuple):
+        """Queues the delete of the items enclosed in the area."""
+        w = self.canvas._w
+        self.commands.append(f"{w} delete {{*}}[{w} find enclosed {' '.join(map(str, area))}]")
+
+    def resize_lines(self, tag: str, axis: int, lo: int, hi: int):
+        """Queues setting the start and end of the tagged lines along the axis (0 horizontal, 1 vertical)."""
+        w = self.canvas._w
+        coords = f"{lo} $y0 {hi} $y1" if axis == 0 else f"$x0 {lo} $x1 {hi}"
+        self.commands.append(
+            f"foreach id [{w} find withtag {tcl_word(tag)}] {{lassign [{w} coords $id] x0 y0 x1 y1; {w} coords $id {coords}}}"
+        )
+
+    def script(self, commands: list[str]) -> str:
+        """Returns the commands as a script, defining TCL_PROCS the first time."""
+        if not self.ready:
+            commands.insert(0, TCL_PROCS)
+            self.ready = True
+        return '\n'.join(commands)
+
+    def item_records(self) -> list[tuple]:
+        """Returns the (kind, coords, text, tags, state) of all the canvas items with one Tcl call."""
+        splitlist = self.canvas.tk.splitlist
+        answ = []
+        for record in splitlist(self.canvas.tk.eval(self.script([f"::sheetui_items {self.canvas._w}"]))):
+            kind, coords, text, tags, state = splitlist(record)
+            answ.append((kind, tuple(map(float, splitlist(coords))), text, splitlist(tags), state))
+        return answ
+
+    def flush(self) -> list[int]:
+        """Runs the queued commands as one Tcl script. Returns the ids of the created items."""
+        if not self.commands:
+            return []
+        script = ["set ::sheetui_ids {}", *self.commands]
+        if self.clips:
+            script.append(f"::sheetui_clip {self.canvas._w} $::sheetui_ids {{{' '.join(map(str, self.clips))}}}")
+        script.append("set ::sheetui_ids")
+        self.commands, self.clips, self.ncreated = [], [], 0
+        return [int(tid) for tid in self.canvas.tk.splitlist(self.canvas.tk.eval(self.script(script)))]
+
+    @contextmanager
+    def batched(self):
+        """Queues the commands of the block, flushed as one script when the outermost block ends."""
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self.flush()
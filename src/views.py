@@ -0,0 +1,152 @@
+''' Este módulo implementa las vistas de filas de la hoja de cálculo (ordenación y filtros).
+    Una vista es una permutación de las filas del almacén: la hoja se dibuja y se navega en filas de la
+    vista sin mover los datos, y quitar la ordenación o el filtro es O(1).
+'''
+from typing import Any, Callable
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, the rows are sorted with python's sorted without it
+    np = None
+
+VIEW_CHUNK = 65536      # Rows per column chunk when the sort keys are read
+
+
+def sort_key(value: Any) -> tuple:
+    """Sort key of a cell value: numbers (and numeric text) first, then text, then the empty cells."""
+    if isinstance(value, str):
+        try:
+            return 0, float(value), ''
+        except ValueError:
+            return 1, 0.0, value.casefold()
+    if value is None:
+        return 2, 0.0, ''
+    return 0, float(value), ''
+
+
+class RowView:
+    """Maps the rows shown in the sheet (view rows) to the rows of the store (storage rows).
+
+    ``rows`` holds the storage row of every view row, None is the identity view. The inverse mapping is
+    computed when it is first needed.
+    """
+    def __init__(self):
+        self.rows = None
+        self._inverse = None
+        self.nrows = 0                  # Storage rows covered by the view
+
+    @property
+    def active(self) -> bool:
+        return self.rows is not None
+
+    def clear(self):
+        self.rows = self._inverse = None
+
+    def set_rows(self, rows, nrows: int):
+        self.rows, self._inverse, self.nrows = rows, None, nrows
+
+    def to_store(self, y: int) -> int | None:
+        """Returns the storage row shown in the view row y (None for rows beyond a filtered view)."""
+        if self.rows is None:
+            return y
+        if 1 <= y <= len(self.rows):
+            return int(self.rows[y - 1])
+        return y if y > self.nrows and len(self.rows) == self.nrows else None
+
+    def store_span(self, y0: int, y1: int) -> tuple[int, int] | None:
+        """Returns the (first, last) storage rows shown in the view rows y0:y1, None if they are not contiguous
+        in storage or are beyond a filtered view."""
+        if self.rows is None:
+            return y0, y1
+        n = len(self.rows)
+        if y0 > n:
+            return (y0, y1) if n == self.nrows else None
+        segment = self.rows[y0 - 1: min(y1, n)]
+        lo, hi = (int(segment.min()), int(segment.max())) if np is not None and hasattr(segment, 'min') \
+            else (min(segment), max(segment))
+        if hi - lo != len(segment) - 1:
+            return None
+        if y1 <= n:
+            return lo, hi
+        # The rows past the end of a sort are shown in storage order, after the last sorted one
+        return (lo, y1) if n == self.nrows and hi == n else None
+
+    def to_view(self, y: int) -> int | None:
+        """Returns the view row showing the storage row y (None if it is filtered out)."""
+        if self.rows is None:
+            return y
+        if self._inverse is None:
+            if np is not None:
+                self._inverse = np.zeros(self.nrows + 1, dtype=np.int64)
+                self._inverse[np.asarray(self.rows, dtype=np.int64)] = np.arange(1, len(self.rows) + 1)
+            else:
+                self._inverse = [0] * (self.nrows + 1)
+                for ndx, row in enumerate(self.rows, start=1):
+                    self._inverse[row] = ndx
+        if y > self.nrows:
+            return y if len(self.rows) == self.nrows else None
+        return int(self._inverse[y]) or None
+
+    def base_rows(self, nrows: int):
+        """Returns the storage rows of the current view (all the rows for the identity view)."""
+        if self.rows is not None:
+            return self.rows
+        return np.arange(1, nrows + 1) if np is not None else list(range(1, nrows + 1))
+
+    def sort(self, store, keys: list[tuple[int, bool]], value: Callable[[int, int, Any], Any]=None):
+        """Sorts the rows of the view by the (column, descending) keys, the first key being the primary one.
+        value(x, y, stored) maps the stored values to the sorted ones (e.g. formulas to their value)."""
+        nrows = store.nrows
+        rows = self.base_rows(nrows)
+        columns = [self.column_keys(store, x, value) for x, descending in keys]
+        if np is not None:
+            lexkeys = []
+            for (x, descending), (kinds, numbers, texts) in zip(keys, columns):
+                rank = np.unique(texts, return_inverse=True)[1].reshape(-1)
+                # The empty cells stay at the end in descending sorts too
+                lexkeys.extend((kinds, -numbers, -rank) if descending else (kinds, numbers, rank))
+            rows = np.asarray(rows, dtype=np.int64)
+            # lexsort sorts by the last key first, so the keys go from the least to the most significant
+            order = np.lexsort([part[rows - 1] for part in reversed(lexkeys)])
+            self.set_rows(rows[order], nrows)
+        else:
+            ordered = list(rows)
+            # Stable sorts from the last key to the primary one
+            for (x, descending), (kinds, numbers, texts) in reversed(list(zip(keys, columns))):
+                ordered.sort(key=lambda y: (numbers[y - 1], texts[y - 1]), reverse=descending)
+                ordered.sort(key=lambda y: kinds[y - 1])
+            self.set_rows(ordered, nrows)
+
+    def column_keys(self, store, x: int, value: Callable=None) -> tuple:
+        """Returns the (kinds, numbers, texts) sort keys for all the storage rows of column x."""
+        nrows = store.nrows
+        data = store.column_array(x, 1, nrows) if np is not None and nrows else None
+        if data is not None:
+            # Typed column: only numbers and empty cells
+            empty = np.isnan(data)
+            return np.where(empty, 2, 0), np.where(empty, 0.0, data), np.full(nrows, '', dtype=object)
+        kinds, numbers, texts = [], [], []
+        for y0 in range(1, nrows + 1, VIEW_CHUNK):
+            y1 = min(nrows, y0 + VIEW_CHUNK - 1)
+            for y, stored in enumerate(store.column_slice(x, y0, y1), start=y0):
+                kind, number, text = sort_key(value(x, y, stored) if value is not None else stored)
+                kinds.append(kind)
+                numbers.append(number)
+                texts.append(text)
+        if np is not None:
+            return np.array(kinds), np.array(numbers), np.array(texts, dtype=object)
+        return kinds, numbers, texts
+
+    def filter(self, store, x: int, predicate: Callable[[Any], bool], value: Callable[[int, int, Any], Any]=None):
+        """Keeps in the view the rows whose value in column x satisfies predicate."""
+        nrows = store.nrows
+        rows = self.base_rows(nrows)
+        values = [None] * (nrows + 1)
+        for y0 in range(1, nrows + 1, VIEW_CHUNK):
+            y1 = min(nrows, y0 + VIEW_CHUNK - 1)
+            values[y0: y1 + 1] = store.column_slice(x, y0, y1)
+        if value is not None:
+            keep = [y for y in rows if predicate(value(x, int(y), values[y]))]
+        else:
+            keep = [y for y in rows if predicate(values[y])]
+        self.set_rows(np.asarray(keep, dtype=np.int64) if np is not None else keep, nrows)
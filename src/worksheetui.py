@@ -3,6 +3,7 @@
     que consiste en un área de celdas y una barra de estado que permite cambiar a otras hojas de trabajo '
     además de la activa'
 '''
+import bisect
 import collections
 import os
 import inspect
@@ -11,15 +12,37 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import simpledialog
 from tkinter import filedialog
+from tkinter import font as tkfont
 from contextlib import contextmanager
 from types import SimpleNamespace
 from collections import Counter
 from enum import Flag, auto
 import platform
 import logging
-from typing import Callable, Literal
+import re
+import sys
+from typing import Callable, Iterable, Iterator, Literal, NamedTuple
 
 from frontend import Frontend
+from sheetstore import SheetStore
+from sheetfile import SheetFile, write_sheet
+from sheetio import CsvImporter, CsvExporter, TsvParser, tsv_chunks
+from formulas import FormulaEngine, is_formula
+from cellvalues import parse_input
+from aggregates import AggregateIndex, EMPTY, combine, summarize
+from search import SearchIndex
+from views import RowView
+from journal import ENTRY_BYTES, Journal, delta_size
+from ranges import NamedRanges
+from styles import CellStyles
+from conditional import ConditionalFormats, Rule
+from numformat import compile_format
+from autofit import LongestValues, TextMeasure
+from tclbatch import CanvasBatch, TclCounter
+from renderer import RecordingCanvas
+from snapshot import DIGEST_PREFIX, Snapshot, take_snapshot
+from eventrec import (EVENT_RENDER_MS, EventRing, load_binary, load_jsonl, record_event, save_binary, save_jsonl,
+                      to_action)
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -30,8 +53,8 @@ SHIFT_PRESSED = 0x00001
 CTRL_PRESSED = 0x00004
 ALT_PRESSED = 0x20000
 
-MAX_ROWS = 1000  # Maximum number of rows in the worksheet
-MAX_COLS = 100  # Maximum number of columns in the worksheet
+MAX_ROWS = 1000  # Default number of rows in the worksheet
+MAX_COLS = 100  # Default number of columns in the worksheet
 
 COL_CELLS_WIDTH = 40  # Default width for column cells in the worksheet
 ROW_CELLS_HEIGHT = 20  # Default height for row cells in the worksheet
@@ -39,6 +62,22 @@ CELL_WIDTH = 60  # Default width for cells in the worksheet
 CELL_HEIGHT = ROW_CELLS_HEIGHT  # Default height for cells in the worksheet
 
 GRID_COLOR = "lightgray"  # Default grid color for the worksheet
+CELL_PADDING = 3  # Space between the cell border and the text aligned to the left or to the right
+
+IMPORT_POLL_MS = 200  # Interval to check the row-count watermark of a background import
+EXPORT_POLL_MS = 200  # Interval to report the progress of a background export
+EXPORT_ROWS = 4096  # Rows read per block by a background export
+EXPORT_WAIT_MS = 20  # Wait before handing a block again to a busy export writer
+PASTE_POLL_MS = 50  # Interval to check the background parse of a paste
+RECALC_POLL_MS = 50  # Interval to merge the finished batches of a parallel recalculation
+STATS_DELAY_MS = 150  # Debounce delay for the selection statistics while the selection is dragged
+
+DISPLAY_CACHE_ENTRIES = 4096        # Default entries budget for the display-value cache
+DISPLAY_CACHE_BYTES = 1 << 20       # Default bytes budget for the display-value cache
+VIEW_DIRTY_ROWS = 256               # Written rows mapped one by one to the rows of a sort/filter view
+WORKBOOK_CACHE_BYTES = 64 << 20     # Cache budget of the inactive sheets of a workbook
+CLIPBOARD_ROWS = 4096               # Rows serialised to the clipboard per idle callback
+AUTOFIT_ROWS = 4096                 # Selected rows measured one by one by autofit, larger selections are sampled
 
 
 class SheetState(Flag):
@@ -48,6 +87,27 @@ class SheetState(Flag):
     HEADINGS = auto()
 
 
+class PaneLayout(NamedTuple):
+    """Immutable geometry of the quadrants, rebuilt only when a viewport or its coordinates change."""
+    quadrants: tuple[int, ...]                                      # Drawn quadrants: (1,) or (1, 2, 3, 4) when frozen
+    panes: tuple[tuple[tuple[int, ...], tuple[int, int]], ...]      # (viewport, coords_viewport) of quadrants 1 to 4
+    coord_split: tuple[int, int]                                    # Screen coordinates splitting the quadrants
+    cell_split: tuple[int, int]                                     # Cell address splitting the quadrants
+
+
+def pane_layout(viewport_q1: tuple[int, ...], viewport_q3: tuple[int, ...],
+                coords_vportq1: tuple[int, int], coords_vportq3: tuple[int, int]) -> PaneLayout:
+    """Computes the (viewport, coords_viewport) of the four quadrants."""
+    panes = (
+        (viewport_q1, coords_vportq1),
+        ((viewport_q1[0], viewport_q3[1], viewport_q1[2], viewport_q3[3] - 1), (coords_vportq1[0], coords_vportq3[1])),
+        ((*viewport_q3[:2], viewport_q3[2] - 1, viewport_q3[3] - 1), coords_vportq3),
+        ((viewport_q3[0], viewport_q1[1], viewport_q3[2] - 1, viewport_q1[3]), (coords_vportq3[0], coords_vportq1[1])),
+    )
+    quadrants = (1, 2, 3, 4) if coords_vportq1 != coords_vportq3 else (1,)
+    return PaneLayout(quadrants, panes, coords_vportq1, viewport_q3[2:])
+
+
 def cell_content_gen(nquadrant: int, x: int, y: int) -> str:
     """Generates the content for a cell based on its quadrant and cell coordinates."""
     if nquadrant == 1:
@@ -60,14 +120,95 @@ def cell_content_gen(nquadrant: int, x: int, y: int) -> str:
         return f"Q4_C{x}R{y}"
 
 
+class DisplayCache:
+    """LRU cache for the display values of the cells, keyed by the (x, y) cell address."""
+    def __init__(self, max_entries: int = DISPLAY_CACHE_ENTRIES, max_bytes: int = DISPLAY_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, x: int, y: int) -> str | None:
+        """Returns the cached display value for the cell or None if it is not cached."""
+        try:
+            value = self._data[(x, y)]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end((x, y))
+        self.hits += 1
+        return value
+
+    def put(self, x: int, y: int, value: str):
+        """Caches the display value for the cell, evicting the least recently used ones if needed."""
+        self.invalidate_cell(x, y)
+        self._data[(x, y)] = value
+        self.nbytes += sys.getsizeof(value)
+        while self._data and (len(self._data) > self.max_entries or self.nbytes > self.max_bytes):
+            key, old_value = self._data.popitem(last=False)
+            self.nbytes -= sys.getsizeof(old_value)
+            self.evictions += 1
+
+    def invalidate_cell(self, x: int, y: int):
+        """Drops the cached display value for the cell."""
+        value = self._data.pop((x, y), None)
+        if value is not None:
+            self.nbytes -= sys.getsizeof(value)
+
+    def invalidate_range(self, x0: int, y0: int, x1: int, y1: int):
+        """Drops the cached display values for the cells in the x0:x1, y0:y1 range."""
+        to_remove = [key for key in self._data if x0 <= key[0] <= x1 and y0 <= key[1] <= y1]
+        for key in to_remove:
+            self.nbytes -= sys.getsizeof(self._data.pop(key))
+
+    def invalidate_all(self):
+        """Drops all the cached display values."""
+        self._data.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict:
+        """Returns the cache counters for instrumentation."""
+        return dict(
+            entries=len(self._data), nbytes=self.nbytes, 
+            hits=self.hits, misses=self.misses, evictions=self.evictions
+        )
+
+
 class SheetLook:
-    def __init__(self, canvas: 'SheetUI', cell_content_gen: Callable[[int, int], str] = cell_content_gen):
+    def __init__(self, canvas: 'SheetUI', cell_content_gen: Callable[[int, int], str] = cell_content_gen, store: SheetStore = None):
         self._winfo_width = None
         self._winfo_height = None
         self.flags = SheetState.GRIDLINES | SheetState.HEADINGS
         self.cell_content = cell_content_gen
+        self.display_cache = DisplayCache()
+
+        self.store = store if store is not None else SheetStore()
+        self.formulas = FormulaEngine(self.store)
+        self.formulas.add_listener(self.on_formulas_recalc)
+        if canvas is not None:
+            # The parallel recalculations run in the background and are merged from the Tk event loop
+            self.formulas.scheduler = lambda: canvas.after(RECALC_POLL_MS, canvas.poll_recalc, self)
+        self.store.add_listener(self.on_store_changed)
+        self.aggregates = AggregateIndex(self.store, self.formulas)
+        self.search = SearchIndex(self.store, self.formulas)
+        self.view = RowView()                           # Sort/filter view: view rows -> storage rows
+        self.journal = Journal()                        # Undo/redo of the structural and dimension edits
+        self.names = NamedRanges(self.store)            # Named ranges, shifted with the rows and columns
+        self.styles = CellStyles(self.store)            # Style runs of the storage rows
+        self.conditional = ConditionalFormats(self.store, self.formulas, self.aggregates)
+        self.longest = LongestValues(self.store, self.formulas, self.aggregates)   # Rows measured by autofit
+        self.dirty_areas = []                           # Visible cell areas to redraw after a change
+        self.max_cols = max(MAX_COLS, self.store.ncols)
+        self.max_rows = max(MAX_ROWS, self.store.nrows)
 
         self.canvas = canvas
+        self._layout = None                             # Cached PaneLayout, dropped when the viewports change
         self.headings_dim = {}
         self.headings_hided = {}
 
@@ -79,6 +220,108 @@ class SheetLook:
         self.selected_cells = (*self.active_cell, *self.active_cell)    # Variable to store the selected cell
         pass
 
+    def get_state(self) -> dict:
+        """Returns the headings dimensions and freeze panes state as a json serializable dict."""
+        return dict(
+            flags=self.flags.value,
+            headings_dim=self.headings_dim,
+            headings_hided=self.headings_hided,
+            coords_vportq3=self.coords_vportq3,
+            viewport_q3=self.viewport_q3,
+            coords_vportq1=self.coords_vportq1,
+            viewport_q1=self.viewport_q1,
+            active_cell=self.active_cell,
+            selected_cells=self.selected_cells,
+        )
+
+    def set_state(self, state: dict):
+        """Restores the state returned by get_state."""
+        self.flags = SheetState(state['flags'])
+        self.headings_dim = dict(state['headings_dim'])
+        self.headings_hided = dict(state['headings_hided'])
+        for key in ('coords_vportq3', 'viewport_q3', 'coords_vportq1', 'viewport_q1', 'active_cell', 'selected_cells'):
+            setattr(self, key, tuple(state[key]))
+
+    def on_store_changed(self, kind: str, x0: int, y0: int, x1: int, y1: int):
+        """Store listener: invalidates the display values of the changed cells."""
+        self.max_cols = max(self.max_cols, self.store.ncols)
+        self.max_rows = max(self.max_rows, self.store.nrows)
+        if kind == 'set':
+            self.conditional_dirty(x0, y0, x1, y1)
+        if self.view.active:
+            if kind in ('set', 'append') and y1 - y0 < VIEW_DIRTY_ROWS:
+                for y in range(y0, y1 + 1):
+                    if (vy := self.view.to_view(y)) is not None:
+                        self.display_cache.invalidate_range(x0, vy, x1, vy)
+                        if kind == 'set':
+                            self.dirty_areas.append((x0, vy, x1, vy))
+                return
+            if kind.endswith('rows'):
+                # Row edits shift the storage rows under the view: all the view rows show other rows now
+                self.view.clear()
+                self.display_cache.invalidate_all()
+                return
+            y0, y1 = 1, max(y1, self.max_rows)
+        if kind not in ('set', 'append'):
+            # Structural edits shift the addresses up to the sheet limits
+            x1, y1 = max(x1, self.max_cols), max(y1, self.max_rows)
+        self.display_cache.invalidate_range(x0, y0, x1, y1)
+        if kind == 'set':
+            self.dirty_areas.append((x0, y0, x1, y1))
+
+    def on_formulas_recalc(self, cells: list[tuple[int, int]]):
+        """Formula engine listener: invalidates the recalculated cells, marking as dirty the visible ones."""
+        if cells and self.conditional.rules:
+            xs, ys = [x for x, y in cells], [y for x, y in cells]
+            self.conditional_dirty(min(xs), min(ys), max(xs), max(ys))
+        for x, y in cells:
+            if (y := self.view.to_view(y)) is None:
+                continue
+            self.display_cache.invalidate_cell(x, y)
+            if self.is_visible(x, y):
+                self.dirty_areas.append((x, y, x, y))
+
+    def conditional_dirty(self, x0: int, y0: int, x1: int, y1: int):
+        """Marks as dirty the ranges of the conditional formats that depend on the written x0:x1, y0:y1 storage cells."""
+        for rx0, ry0, rx1, ry1 in self.conditional.depends(x0, y0, x1, y1):
+            if self.view.active:
+                ry0, ry1 = 1, self.max_rows
+            self.dirty_areas.append((rx0, ry0, rx1, ry1))
+
+    def is_visible(self, x: int, y: int) -> bool:
+        """Returns True if the cell is inside the viewport of any of the quadrants."""
+        layout = self.layout
+        for nquadrant in layout.quadrants:
+            vx0, vy0, vx1, vy1 = layout.panes[nquadrant - 1][0]
+            if vx0 <= x <= vx1 and vy0 <= y <= vy1:
+                return True
+        return False
+
+    def visible_names(self) -> list[str]:
+        """Returns the sorted names whose range intersects the viewport of any of the quadrants."""
+        layout = self.layout
+        answ = set()
+        for nquadrant in layout.quadrants:
+            answ.update(self.names.search(layout.panes[nquadrant - 1][0]))
+        return sorted(answ)
+
+    def cache_size(self) -> int:
+        """Estimates the memory held by the caches and indexes of the sheet, which can be rebuilt on demand."""
+        nbytes = self.display_cache.nbytes
+        nbytes += 128 * len(self.search.cells)
+        nbytes += sum(32 * len(column.tree) for column in self.aggregates.columns.values())
+        if (base := self.store.base) is not None and hasattr(base, 'cache_size'):
+            nbytes += base.cache_size()
+        return nbytes
+
+    def release_caches(self):
+        """Releases the caches and indexes of the sheet. The data and the look state are kept."""
+        self.display_cache.invalidate_all()
+        self.aggregates.columns.clear()
+        self.search.release()
+        if (base := self.store.base) is not None and hasattr(base, 'release'):
+            base.release()
+
     @property
     def winfo_width(self):
         return self._winfo_width
@@ -108,6 +351,49 @@ class SheetLook:
     def efective_height(self):
         f_headings = bool((self.flags & SheetState.HEADINGS).value)
         return self._winfo_height + int(f_headings) * ROW_CELLS_HEIGHT
+
+    @property
+    def viewport_q1(self):
+        return self._viewport_q1
+
+    @viewport_q1.setter
+    def viewport_q1(self, value):
+        self._viewport_q1 = value
+        self._layout = None
+
+    @property
+    def viewport_q3(self):
+        return self._viewport_q3
+
+    @viewport_q3.setter
+    def viewport_q3(self, value):
+        self._viewport_q3 = value
+        self._layout = None
+
+    @property
+    def coords_vportq1(self):
+        return self._coords_vportq1
+
+    @coords_vportq1.setter
+    def coords_vportq1(self, value):
+        self._coords_vportq1 = value
+        self._layout = None
+
+    @property
+    def coords_vportq3(self):
+        return self._coords_vportq3
+
+    @coords_vportq3.setter
+    def coords_vportq3(self, value):
+        self._coords_vportq3 = value
+        self._layout = None
+
+    @property
+    def layout(self) -> PaneLayout:
+        """Returns the geometry of the quadrants, rebuilding it after a scroll, resize or freeze panes change."""
+        if self._layout is None:
+            self._layout = pane_layout(self._viewport_q1, self._viewport_q3, self._coords_vportq1, self._coords_vportq3)
+        return self._layout
     
     def efective_area(self):
         lt_corner_x = self.coords_vportq3[0] - COL_CELLS_WIDTH
@@ -174,7 +460,12 @@ class SheetLook:
             viewport = self.viewport_q1[:2]
         if coords_viewport is None:
             coords_viewport = self.coords_vportq1
-        hidden_width = [self.headings_dim[f"{prefix}{ikey}"] for ikey in range(min(viewport[axis], tag), max(viewport[axis], tag)) if f"{prefix}{ikey}" in self.headings_dim]
+        lo, hi = min(viewport[axis], tag), max(viewport[axis], tag)
+        if len(self.headings_dim) < hi - lo:
+            # Far from the viewport origin it is cheaper to scan the resized headings than the span
+            hidden_width = [dim for key, dim in self.headings_dim.items() if key[0] == prefix and lo <= int(key[1:]) < hi]
+        else:
+            hidden_width = [self.headings_dim[f"{prefix}{ikey}"] for ikey in range(lo, hi) if f"{prefix}{ikey}" in self.headings_dim]
         scr_x0 = coords_viewport[axis] + ((-1) ** int(tag < viewport[axis]))*((abs(tag - viewport[axis]) - len(hidden_width)) * cell_width + sum(hidden_width))
         scr_x1 = scr_x0 + self.headings_dim.get(f"{prefix}{tag}", cell_width)
         return scr_x0, scr_x1
@@ -209,20 +500,18 @@ class SheetLook:
         return scr_x0, scr_y0, scr_x1, scr_y1
     
     def area_coordinates(self, x0:int, y0:int, x1:int, y1:int) -> tuple[int, int, int, int]:
-        nquadrant = self.cell_quadrant(x0, y0, isCoord=False)
-        orig, coords_orig = self.quadrant_data(nquadrant)
+        panes = self.layout.panes
+        orig, coords_orig = panes[self.cell_quadrant(x0, y0, isCoord=False) - 1]
         sel_x0, sel_y0 = self.cell_coordinates(x0, y0, orig, coords_orig)[:2]
-        nquadrant = self.cell_quadrant(x1, y1, isCoord=False)
-        orig, coords_orig = self.quadrant_data(nquadrant)
+        orig, coords_orig = panes[self.cell_quadrant(x1, y1, isCoord=False) - 1]
         sel_x1, sel_y1 = self.cell_coordinates(x1, y1, orig, coords_orig)[2:]
         return (sel_x0, sel_y0, sel_x1, sel_y1)
     
     def area_cells(self, sel_x0:int, sel_y0:int, sel_x1:int, sel_y1:int) -> tuple[int, int, int, int]:
-        nquadrant = self.cell_quadrant(sel_x0, sel_y0, isCoord=True)
-        orig, coords_orig = self.quadrant_data(nquadrant)
+        panes = self.layout.panes
+        orig, coords_orig = panes[self.cell_quadrant(sel_x0, sel_y0, isCoord=True) - 1]
         x0, y0 = self.cell_containing_coords(sel_x0, sel_y0, orig, coords_orig)
-        nquadrant = self.cell_quadrant(sel_x1 - 1, sel_y1 - 1, isCoord=True)
-        orig, coords_orig = self.quadrant_data(nquadrant)
+        orig, coords_orig = panes[self.cell_quadrant(sel_x1 - 1, sel_y1 - 1, isCoord=True) - 1]
         x1, y1 = self.cell_containing_coords(sel_x1 - 1, sel_y1 - 1, orig, coords_orig)
         return (x0, y0, x1, y1)
     
@@ -235,8 +524,8 @@ class SheetLook:
         xcell = self.tag_id(ptx, viewport, coords_viewport, axis=0)
         ycell = self.tag_id(pty, viewport, coords_viewport, axis=1)
         
-        xcell = max(1, min(MAX_COLS, int(xcell)))
-        ycell = max(1, min(MAX_ROWS, int(ycell)))
+        xcell = max(1, min(self.max_cols, int(xcell)))
+        ycell = max(1, min(self.max_rows, int(ycell)))
         return (xcell, ycell)
     
     def cell_inc(self, xcell: int, delta: int, axis:Literal[0, 1]=0) -> int:
@@ -251,12 +540,138 @@ class SheetLook:
                 delta = d_hided
         return xcell
     
+    def cell_display(self, nquadrant: int, x: int, y: int) -> str:
+        """Returns the display value for the cell in the view row y, using the display cache."""
+        return self.column_display(nquadrant, x, [y])[0]
+
+    def column_display(self, nquadrant: int, x: int, rows: list[int]) -> list[str]:
+        """Returns the display values for the cells of column x in the view rows, using the display cache.
+        The missing values are formatted in one pass per number format of the column. Empty cells show the
+        cell_content placeholder with the storage address, rows beyond a filtered view are blank."""
+        answ = [self.display_cache.get(x, y) for y in rows]
+        missing = [ndx for ndx, value in enumerate(answ) if value is None]
+        if not missing:
+            return answ
+        srows = [self.view.to_store(rows[ndx]) for ndx in missing]
+        if not self.view.active and srows[-1] - srows[0] == len(srows) - 1:
+            # Consecutive storage rows are read as a single column slice
+            stored = self.store.column_slice(x, srows[0], srows[-1])
+        else:
+            stored = [None if sy is None else self.store.get(x, sy) for sy in srows]
+        groups = collections.defaultdict(list)      # Number format -> (ndx, value) to format
+        for ndx, sy, value in zip(missing, srows, stored):
+            if sy is None:
+                answ[ndx] = ""
+            elif (value := self.cell_value(x, sy, value)) is None:
+                answ[ndx] = self.cell_content(nquadrant, x, sy)
+            else:
+                groups[self.styles.style(x, sy).number_format].append((ndx, value))
+        for code, items in groups.items():
+            texts = compile_format(code).format_column([value for ndx, value in items])
+            for (ndx, value), text in zip(items, texts):
+                answ[ndx] = text
+        for ndx in missing:
+            self.display_cache.put(x, rows[ndx], answ[ndx])
+        return answ
+
+    def cell_value(self, x: int, y: int, stored):
+        """Returns the value shown for the stored value of the (x, y) storage cell (the computed value of formulas)."""
+        return self.formulas.value(x, y) if is_formula(stored) else stored
+
+    def visible_rows(self) -> list[int]:
+        """Returns the storage rows shown in the viewports."""
+        layout = self.layout
+        rows = set()
+        for nquadrant in layout.quadrants:
+            vx0, vy0, vx1, vy1 = layout.panes[nquadrant - 1][0]
+            rows.update(range(vy0, vy1 + 1))
+        return sorted(sy for y in rows if (sy := self.view.to_store(y)) is not None and sy <= self.store.nrows)
+
+    def autofit_texts(self, x: int) -> list[tuple[str | None, str]]:
+        """Returns the (font, display text) pairs measured to fit column x: the longest values of the column, the
+        minimum and maximum numbers in the number formats of the column and the visible rows."""
+        if x > self.store.ncols:
+            return []
+        answ = []
+        for sy in set(self.longest.longest(x)).union(self.visible_rows()):
+            if (value := self.cell_value(x, sy, self.store.get(x, sy))) is not None:
+                style = self.styles.style(x, sy)
+                answ.append((style.font, compile_format(style.number_format).format_value(value)))
+        total, count, lo, hi = self.aggregates.query(x, 1, x, self.store.nrows)
+        if count:
+            for sid in {sid for s0, s1, sid in self.styles.segments(x, 1, self.store.nrows)}:
+                style = self.styles.table[sid]
+                answ.extend((style.font, compile_format(style.number_format).format_value(value)) for value in (lo, hi))
+        return answ
+
+    def rows_texts(self, ys: Iterable[int], chunk: int=AUTOFIT_ROWS) -> Iterator[tuple[int, list[tuple[str | None, str]]]]:
+        """Yields (view row, (font, display text) pairs) for the view rows ys, the pairs of the cells that may need
+        more than the default height: the ones with a style font or with several lines. The storage rows are read
+        in chunked passes over runs of consecutive rows."""
+        rows = sorted((sy, y) for y in ys if (sy := self.view.to_store(y)) is not None and sy <= self.store.nrows)
+        ncols = self.store.ncols
+        start = 0
+        while start < len(rows):
+            end = start + 1
+            while end < len(rows) and rows[end][0] == rows[end - 1][0] + 1:
+                end += 1
+            run = iter(rows[start: end])
+            for block in self.store.iter_rows(1, rows[start][0], ncols, rows[end - 1][0], chunk=chunk):
+                for values, (sy, y) in zip(block, run):
+                    fonts = {
+                        x: font for x, column in self.styles.columns.items()
+                        if (font := self.styles.table[column.get(sy)].font)
+                    }
+                    answ = []
+                    for x, value in enumerate(values, start=1):
+                        if value is None or (x not in fonts and not (isinstance(value, str) and '\n' in value)):
+                            continue
+                        answ.append((fonts.get(x), str(self.cell_value(x, sy, value))))
+                    yield y, answ
+            start = end
+
+    def iter_values(self, x0: int, y0: int, x1: int, y1: int, chunk: int=CLIPBOARD_ROWS):
+        """Yields the values of the x0:x1, y0:y1 range of view rows (formulas replaced by their value) in blocks
+        of at most chunk rows."""
+        for cy0 in range(y0, y1 + 1, chunk):
+            cy1 = min(y1, cy0 + chunk - 1)
+            if self.view.active:
+                srows = [self.view.to_store(y) for y in range(cy0, cy1 + 1)]
+                rows = [[None if sy is None else self.store.get(x, sy) for x in range(x0, x1 + 1)] for sy in srows]
+            else:
+                srows = range(cy0, cy1 + 1)
+                rows = next(self.store.iter_rows(x0, cy0, x1, cy1, chunk=chunk))
+            if self.formulas.formulas:
+                for sy, row in zip(srows, rows):
+                    for dx, value in enumerate(row):
+                        if is_formula(value):
+                            row[dx] = self.formulas.value(x0 + dx, sy)
+            yield rows
+
+    def selection_stats(self, x0: int, y0: int, x1: int, y1: int) -> tuple:
+        """Returns (sum, count, min, max) of the numeric values in the x0:x1, y0:y1 range of view rows. The view
+        rows showing a contiguous run of storage rows (e.g. the whole height of a sort) are answered by the
+        aggregate index; only the other selections under a view scan their cells (the viewer debounces the call)."""
+        view = self.view
+        if view.active and len(view.rows) < view.nrows:
+            y1 = min(y1, len(view.rows))    # No rows beyond a filter
+        if y1 < y0:
+            return 0, 0, None, None
+        if (span := view.store_span(y0, y1)) is not None:
+            return self.aggregates.query(x0, span[0], x1, span[1])
+        answ = EMPTY
+        rows = [int(sy) for sy in view.rows[y0 - 1: min(y1, self.store.nrows)]]
+        first, last = min(rows), max(rows)
+        for x in range(x0, min(x1, self.store.ncols) + 1):
+            values = self.aggregates.values(x, first, last)
+            answ = combine(answ, summarize([values[sy - first] for sy in rows]))
+        total, count, lo, hi = answ
+        return (total, count, lo, hi) if count else (0, 0, None, None)
+
     def cell_quadrant(self, x: int, y:int, isCoord: bool=True) -> int:
         """Returns the quadrant of the cell containing the given x and y screen coordinates."""
-        if self.coords_vportq1 == self.viewport_q3:
-            return 1
-        xdiscr = self.coords_vportq1[0] if isCoord else self.viewport_q3[2]
-        ydiscr = self.coords_vportq1[1] if isCoord else self.viewport_q3[3]
+        layout = self.layout
+        xdiscr, ydiscr = layout.coord_split if isCoord else layout.cell_split
         if x >= xdiscr and y >= ydiscr:
             return 1
         if x >= xdiscr and y <= ydiscr:
@@ -272,16 +687,7 @@ class SheetLook:
 
     def quadrant_data(self, nquadrant:int) -> tuple[tuple[int, ...], tuple[int, int]]:
         """Returns the (vieport, coords_viewport) for the given quadrant."""
-        if nquadrant == 1:
-            return self.viewport_q1, self.coords_vportq1
-        elif nquadrant == 2:
-            orig = self.viewport_q1[0], self.viewport_q3[1], self.viewport_q1[2], self.viewport_q3[3] - 1
-            return orig, (self.coords_vportq1[0], self.coords_vportq3[1])
-        elif nquadrant == 3:
-            return (*self.viewport_q3[:2], self.viewport_q3[2] - 1, self.viewport_q3[3] - 1), self.coords_vportq3
-        else: # nquadrant == 4
-            orig = self.viewport_q3[0], self.viewport_q1[1], self.viewport_q3[2] - 1, self.viewport_q1[3]
-            return orig, (self.coords_vportq3[0], self.coords_vportq1[1])
+        return self.layout.panes[nquadrant - 1]
 
     def map_cell_to_coords(self, x, y, coords=None, coords_viewport=None):
         """Link a cell coordinates to the canvas coordinates."""
@@ -292,8 +698,8 @@ class SheetLook:
             pass
         viewport_x0, viewport_y0 = viewport
         winfo_width, winfo_height = self.efective_width(), self.efective_height()
-        x = max(1, min(MAX_COLS, x))
-        y = max(1, min(MAX_ROWS, y))
+        x = max(1, min(self.max_cols, x))
+        y = max(1, min(self.max_rows, y))
         linf_x, linf_y = self.cell_coordinates(x, y, viewport, coords_viewport)[:2]
         deltax, deltay = linf_x - coords_viewport[0], linf_y - coords_viewport[1]
         clinf_x, clinf_y, lsup_x, lsup_y = self.efective_area()
@@ -301,114 +707,94 @@ class SheetLook:
         ptx0 =  ptx1 = pty0 = pty1 = None
         gx1, gy1 = map(int, self.canvas.coords("background")[2:])
 
-        if deltax and abs(deltax) >= winfo_width:
-            # All the cell information and column headings need to be updated
-            items = self.canvas.find_enclosed(coords_viewport[0] - 1, clinf_y - 1, gx1 + 1, gy1 + 1)
-            self.canvas.delete(*items)
-            viewport_x0 = x
-            ptx0 = coords_viewport[0], clinf_y
-        elif deltax < 0:
-            # left displacement
-            x0 = x
-            dx = deltax
-            viewport_x1, dmy = self.cell_containing_coords(winfo_width + dx, 0, viewport, coords_viewport)
-            linf_x = self.cell_coordinates(viewport_x1, dmy, viewport, coords_viewport)[2]
-
-            items = self.canvas.find_enclosed(linf_x - 1, clinf_y - 1, gx1 + 1, gy1 + 1)
-            self.canvas.delete(*items)
-
-            # Move the viewport dx pixel to the left
-            items = self.canvas.find_enclosed(coords_viewport[0] - 1, clinf_y - 1, linf_x + 1, gy1 + 1)
-            for item in items:
-                self.canvas.move(item, -dx, 0)
+        # The canvas is not read until the tag_area calls, so the deletes and moves are sent as one Tcl script
+        with self.canvas.batch.batched() as batch:
+            if deltax and abs(deltax) >= winfo_width:
+                # All the cell information and column headings need to be updated
+                batch.delete_enclosed((coords_viewport[0] - 1, clinf_y - 1, gx1 + 1, gy1 + 1))
+                viewport_x0 = x
+                ptx0 = coords_viewport[0], clinf_y
+            elif deltax < 0:
+                # left displacement
+                x0 = x
+                dx = deltax
+                viewport_x1, dmy = self.cell_containing_coords(winfo_width + dx, 0, viewport, coords_viewport)
+                linf_x = self.cell_coordinates(viewport_x1, dmy, viewport, coords_viewport)[2]
+
+                batch.delete_enclosed((linf_x - 1, clinf_y - 1, gx1 + 1, gy1 + 1))
+
+                # Move the viewport dx pixel to the left
+                batch.move_enclosed((coords_viewport[0] - 1, clinf_y - 1, linf_x + 1, gy1 + 1), -dx, 0)
             
-            # Resize the horizontal gridlines
-            if gx1 != lsup_x:
-                for item in self.canvas.find_withtag("hgrid_lines"):
-                    y0, y1 = self.canvas.coords(item)[::2]
-                    self.canvas.coords(item, coords_viewport[0], y0, lsup_x, y1)
-
-            viewport_x0 = x0
-            ptx0, ptx1 =(coords_viewport[0], clinf_y), (coords_viewport[0] - dx, lsup_y)
-            # self.canvas.tag_area(*area, tag="invalid_area")
-        elif deltax > 0:
-            # Rigth displacement
-            dx = deltax
+                # Resize the horizontal gridlines
+                if gx1 != lsup_x:
+                    batch.resize_lines("hgrid_lines", 0, coords_viewport[0], lsup_x)
+
+                viewport_x0 = x0
+                ptx0, ptx1 =(coords_viewport[0], clinf_y), (coords_viewport[0] - dx, lsup_y)
+                # self.canvas.tag_area(*area, tag="invalid_area")
+            elif deltax > 0:
+                # Rigth displacement
+                dx = deltax
             
-            items = self.canvas.find_enclosed(coords_viewport[0] - 1, clinf_y - 1, linf_x + 1, gy1 + 1)
-            self.canvas.delete(*items)
-            # Move the viewport dx pixel to the left
-            items = self.canvas.find_enclosed(linf_x - 1, clinf_y - 1, gx1 + 1, gy1 + 1)
-            for item in items:
-                self.canvas.move(item, -dx, 0)
-            viewport_x0 = self.cell_containing_coords(linf_x + 1, 0, viewport, coords_viewport)[0]
-
-            # Resize the horizontal gridlines
-            if gx1 != lsup_x:
-                for item in self.canvas.find_withtag("hgrid_lines"):
-                    y0, y1 = self.canvas.coords(item)[::2]
-                    self.canvas.coords(item, coords_viewport[0], y0, lsup_x, y1)
-
-            ptx0 = lsup_x - dx, clinf_y
-            pass
-        if ptx0:
-            viewport_x1 = self.cell_containing_coords(winfo_width, 0, (viewport_x0, viewport[1]), coords_viewport)[0]
-            viewport_x0 = viewport_x0 if isViewportOrig else self.viewport_q1[0]
-            self.viewport_q1 = (viewport_x0, self.viewport_q1[1],viewport_x1, self.viewport_q1[3])
-            pass
-
-        if deltay and abs(deltay) >= winfo_height:
-            # All the cell information and row headings need to be updated
-            items = self.canvas.find_enclosed(clinf_x - 1, coords_viewport[1] - 1, gx1 + 1, gy1 + 1)
-            self.canvas.delete(*items)
-            viewport_y0 = y
-            pty0 = clinf_x, coords_viewport[1]
-        elif deltay < 0:
-            # top displacement
-            y0 = y
-            dy = deltay
-            dmy, viewport_y1 = self.cell_containing_coords(0, winfo_height + dy, viewport, coords_viewport)
-            linf_y = self.cell_coordinates(dmy, viewport_y1, viewport, coords_viewport)[3]
-
-            items = self.canvas.find_enclosed(clinf_x - 1, linf_y - 1, gx1 + 1, gy1 + 1)
-            self.canvas.delete(*items)
-
-            # Move the viewport dy pixel up
-            items = self.canvas.find_enclosed(clinf_x - 1, coords_viewport[1] - 1,  gx1 + 1, linf_y + 1)
-            for item in items:
-                self.canvas.move(item, 0, -dy)
-
-            # Resize the vertical gridlines
-            if gy1 != lsup_y:
-                for item in self.canvas.find_withtag("vgrid_lines"):
-                    x0, x1 = self.canvas.coords(item)[1::2]
-                    self.canvas.coords(item, x0, clinf_y, x1, lsup_y)
-
-            viewport_y0 = y0
-            pty0, pty1 =(clinf_x, coords_viewport[1]), (lsup_x, coords_viewport[1] - dy)
-            pass
-        elif deltay > 0:
-            # bottom displacement
-            dy = deltay
-            items = self.canvas.find_enclosed(clinf_x - 1, coords_viewport[1] - 1, gx1 + 1, linf_y + 1)
-            self.canvas.delete(*items)
-            # Move the viewport dy pixel up
-            items = self.canvas.find_enclosed(clinf_x - 1, linf_y - 1, gx1 + 1, gy1 + 1)
-            for item in items:
-                self.canvas.move(item, 0, -dy)
+                batch.delete_enclosed((coords_viewport[0] - 1, clinf_y - 1, linf_x + 1, gy1 + 1))
+                # Move the viewport dx pixel to the left
+                batch.move_enclosed((linf_x - 1, clinf_y - 1, gx1 + 1, gy1 + 1), -dx, 0)
+                viewport_x0 = self.cell_containing_coords(linf_x + 1, 0, viewport, coords_viewport)[0]
+
+                # Resize the horizontal gridlines
+                if gx1 != lsup_x:
+                    batch.resize_lines("hgrid_lines", 0, coords_viewport[0], lsup_x)
+
+                ptx0 = lsup_x - dx, clinf_y
+                pass
+            if ptx0:
+                viewport_x1 = self.cell_containing_coords(winfo_width, 0, (viewport_x0, viewport[1]), coords_viewport)[0]
+                viewport_x0 = viewport_x0 if isViewportOrig else self.viewport_q1[0]
+                self.viewport_q1 = (viewport_x0, self.viewport_q1[1],viewport_x1, self.viewport_q1[3])
+                pass
+
+            if deltay and abs(deltay) >= winfo_height:
+                # All the cell information and row headings need to be updated
+                batch.delete_enclosed((clinf_x - 1, coords_viewport[1] - 1, gx1 + 1, gy1 + 1))
+                viewport_y0 = y
+                pty0 = clinf_x, coords_viewport[1]
+            elif deltay < 0:
+                # top displacement
+                y0 = y
+                dy = deltay
+                dmy, viewport_y1 = self.cell_containing_coords(0, winfo_height + dy, viewport, coords_viewport)
+                linf_y = self.cell_coordinates(dmy, viewport_y1, viewport, coords_viewport)[3]
+
+                batch.delete_enclosed((clinf_x - 1, linf_y - 1, gx1 + 1, gy1 + 1))
+
+                # Move the viewport dy pixel up
+                batch.move_enclosed((clinf_x - 1, coords_viewport[1] - 1,  gx1 + 1, linf_y + 1), 0, -dy)
+
+                # Resize the vertical gridlines
+                if gy1 != lsup_y:
+                    batch.resize_lines("vgrid_lines", 1, clinf_y, lsup_y)
+
+                viewport_y0 = y0
+                pty0, pty1 =(clinf_x, coords_viewport[1]), (lsup_x, coords_viewport[1] - dy)
+                pass
+            elif deltay > 0:
+                # bottom displacement
+                dy = deltay
+                batch.delete_enclosed((clinf_x - 1, coords_viewport[1] - 1, gx1 + 1, linf_y + 1))
+                # Move the viewport dy pixel up
+                batch.move_enclosed((clinf_x - 1, linf_y - 1, gx1 + 1, gy1 + 1), 0, -dy)
             
-            # Resize the vertical gridlines
-            if gy1 != lsup_y:
-                for item in self.canvas.find_withtag("vgrid_lines"):
-                    x0, x1 = self.canvas.coords(item)[1::2]
-                    self.canvas.coords(item, x0, clinf_y, x1, lsup_y)
-
-            viewport_y0 = self.cell_containing_coords(0, linf_y + 1, viewport, coords_viewport)[1]
-            pty0 = clinf_x, lsup_y - dy
-        if pty0:
-            viewport_y1 = self.cell_containing_coords(0, winfo_height, (viewport_x0, viewport_y0), coords_viewport)[1]
-            viewport_y0 = viewport_y0 if isViewportOrig else self.viewport_q1[1]
-            self.viewport_q1 = (self.viewport_q1[0], viewport_y0, self.viewport_q1[2], viewport_y1)
+                # Resize the vertical gridlines
+                if gy1 != lsup_y:
+                    batch.resize_lines("vgrid_lines", 1, clinf_y, lsup_y)
+
+                viewport_y0 = self.cell_containing_coords(0, linf_y + 1, viewport, coords_viewport)[1]
+                pty0 = clinf_x, lsup_y - dy
+            if pty0:
+                viewport_y1 = self.cell_containing_coords(0, winfo_height, (viewport_x0, viewport_y0), coords_viewport)[1]
+                viewport_y0 = viewport_y0 if isViewportOrig else self.viewport_q1[1]
+                self.viewport_q1 = (self.viewport_q1[0], viewport_y0, self.viewport_q1[2], viewport_y1)
         if ptx0:
             if ptx1 is None:
                 ptx1 = self.cell_coordinates(*self.viewport_q1[2:])[2:]
@@ -448,6 +834,30 @@ class SheetLook:
         self.viewport_q1 = (*self.viewport_q1[:2], *rbcorner_vp)
         return delta
     
+    def save_headings(self, x0: int, x1: int, axis: Literal[0, 1]=0) -> tuple[dict, dict]:
+        """Returns the (dimensions, hidden dimensions) entries of the headings x0 to x1."""
+        prefix = 'C' if axis == 0 else 'R'
+        if x1 - x0 < len(self.headings_dim) + len(self.headings_hided):
+            keys = [f"{prefix}{x}" for x in range(x0, x1 + 1)]
+        else:
+            keys = [key for key in (*self.headings_dim, *self.headings_hided) if key[0] == prefix and x0 <= int(key[1:]) <= x1]
+        return (
+            {key: self.headings_dim[key] for key in keys if key in self.headings_dim},
+            {key: self.headings_hided[key] for key in keys if key in self.headings_hided},
+        )
+
+    def restore_headings(self, x0: int, x1: int, axis: Literal[0, 1], saved: tuple[dict, dict]):
+        """Restores the heading entries returned by save_headings."""
+        dims, hided = self.save_headings(x0, x1, axis)
+        for key in dims:
+            del self.headings_dim[key]
+        for key in hided:
+            del self.headings_hided[key]
+        self.headings_dim.update(saved[0])
+        self.headings_hided.update(saved[1])
+        rbcorner_vp = self.cell_containing_coords(self.canvas.efective_width(), self.canvas.efective_height())
+        self.viewport_q1 = (*self.viewport_q1[:2], *rbcorner_vp)
+
     def insert(self, x0:int, x1:int, axis:Literal[0, 1]=0) -> int:
         """Inserts (x1 - x0) headings with default dimension before heading x0."""
         prefix = 'C' if axis == 0 else 'R'
@@ -473,13 +883,93 @@ class SheetLook:
         return -delta
 
 
-class SheetUI(tk.Canvas):
-    def __init__(self, parent, **kwargs):
-        super().__init__(parent, **kwargs)
+class Workbook:
+    """Named sheets shown one at a time in a SheetUI canvas.
+
+    Every sheet is a SheetLook: its store, formulas, indexes and look state (viewport, selection, dimensions and
+    freeze panes) survive while it is inactive, only the active sheet has items in the canvas. When the caches of
+    the inactive sheets exceed max_cache_bytes the least recently used ones are released.
+    """
+    def __init__(self, max_cache_bytes: int=WORKBOOK_CACHE_BYTES):
+        self.max_cache_bytes = max_cache_bytes
+        self.sheets: dict[str, SheetLook] = {}
+        self.recent = collections.OrderedDict()     # Sheet names, the least recently activated first
+        self.active = None
+
+    def __len__(self):
+        return len(self.sheets)
+
+    def new_name(self) -> str:
+        n = len(self.sheets) + 1
+        while f"Sheet{n}" in self.sheets:
+            n += 1
+        return f"Sheet{n}"
+
+    def add(self, name: str, look: SheetLook):
+        if name in self.sheets:
+            raise ValueError(f"Sheet {name!r} already exists")
+        self.sheets[name] = look
+        self.recent[name] = None
+        self.recent.move_to_end(name, last=False)
+        if self.active is None:
+            self.active = name
+
+    def replace(self, look: SheetLook):
+        """Replaces the active sheet (e.g. after opening a file in it)."""
+        self.sheets[self.active] = look
+
+    def remove(self, name: str):
+        if len(self.sheets) == 1:
+            raise ValueError("A workbook needs at least one sheet")
+        del self.sheets[name]
+        del self.recent[name]
+        if self.active == name:
+            self.active = next(reversed(self.recent))
+
+    def rename(self, name: str, new_name: str):
+        if new_name in self.sheets:
+            raise ValueError(f"Sheet {new_name!r} already exists")
+        self.sheets = {(new_name if key == name else key): look for key, look in self.sheets.items()}
+        self.recent = collections.OrderedDict((new_name if key == name else key, None) for key in self.recent)
+        if self.active == name:
+            self.active = new_name
+
+    def activate(self, name: str) -> SheetLook:
+        """Makes name the active sheet, releasing the caches of the inactive sheets over the budget."""
+        self.active = name
+        self.recent.move_to_end(name)
+        inactive = [key for key in self.recent if key != name]
+        sizes = {key: self.sheets[key].cache_size() for key in inactive}
+        total = sum(sizes.values())
+        for key in inactive:
+            if total <= self.max_cache_bytes:
+                break
+            if sizes[key]:
+                logging.debug(f"Releasing the caches of sheet {key}: {sizes[key]:,} bytes")
+                self.sheets[key].release_caches()
+                total -= sizes[key]
+        return self.sheets[name]
+
+
+class SheetPainter:
+    """Worksheet logic and painting over a Renderer canvas (see renderer.py). SheetUI paints on a tk.Canvas and
+    HeadlessSheetUI on a RecordingCanvas; the canvas class gives the items, the font measures and the batch."""
+    def init_painter(self):
         self.look = SheetLook(self)
+        self.workbook = Workbook()
+        self.workbook.add(self.workbook.new_name(), self.look)
         self.f_drag = False  # Flag to indicate if a mouse drag is in progress
         self.error_report = ""
-
+        self.importer = None
+        self.exporter = None
+        self.copy_chunks = None     # TSV chunks of the copy in progress
+        self.paster = None
+        self.fonts = {}             # Font description -> Tk font measured by autofit
+        self.text_measure = TextMeasure(self.font_measure, self.font_linespace)
+        self.frame_crossings = 0
+        self.snapshot_hashes = {}   # Hashes of the canvas items of the last snapshot
+
+    def bind_events(self):
         self.bind("<Configure>", self.redraw_sheet)
         self.bind("<Button-1>", self.on_mouse_click)
         self.bind("<B1-Motion>", self.on_mouse_drag)
@@ -498,22 +988,446 @@ class SheetUI(tk.Canvas):
         self.bind("<Home>", self.on_key_press)
         self.bind("<Prior>", self.on_key_press)
         self.bind("<Next>", self.on_key_press)
+        self.bind("<Control-c>", lambda event: self.copy_cells())
+        self.bind("<Control-v>", lambda event: self.paste_cells())
+        self.bind("<Control-z>", lambda event: self.undo())
+        self.bind("<Control-y>", lambda event: self.redo())
         # self.bind("<Key>", self.on_key_press)
-        self.focus_set()  # Set focus to the canvas
 
     def __getattr__(self, attr):
         "Delegate attribute access to the look object"
-        if attr in self.look.__dir__():
+        if attr != 'look' and attr in self.look.__dir__():
             return getattr(self.look, attr)
         raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{attr}'")
     
-    def reset_sheet(self):
-        self.look = SheetLook(self)
+    def reset_sheet(self, store: SheetStore=None, state: dict=None, formulas: list=None):
+        self.look = SheetLook(self, store=store)
+        self.workbook.replace(self.look)
+        if state:
+            self.look.set_state(state)
+        if formulas:
+            self.look.formulas.load(formulas)
         #flags
         self.f_drag = False  # Flag to indicate if a mouse drag is in progress
+        self.redraw_all()
+
+    def redraw_all(self):
+        """Deletes all the canvas items and draws the sheet again from the look state."""
         self.delete("all")
         width, height = self.winfo_width(), self.winfo_height()
         self.redraw_sheet(width=width, height=height)
+        if self.look.flags & SheetState.FREEZE:
+            self.set_freeze_lines()
+
+    def add_sheet(self, name: str=None) -> str:
+        """Adds an empty sheet to the workbook and activates it."""
+        name = name or self.workbook.new_name()
+        self.workbook.add(name, SheetLook(self))
+        self.activate_sheet(name)
+        return name
+
+    def remove_sheet(self, name: str):
+        was_active = name == self.workbook.active
+        self.workbook.remove(name)
+        if was_active:
+            self.look = self.workbook.sheets[self.workbook.active]
+            self.redraw_all()
+        self.event_generate("<<SheetsChanged>>")
+
+    def activate_sheet(self, name: str):
+        """Shows the sheet name in the canvas. Its look state is restored as it was left."""
+        if name != self.workbook.active:
+            self.f_drag = False
+            self.look = self.workbook.activate(name)
+            self.redraw_all()
+        self.event_generate("<<SheetsChanged>>")
+
+    def undo(self):
+        """Undoes the last structural, dimension or freeze panes edit."""
+        if label := self.journal.undo():
+            logging.debug(f"Undo: {label}")
+
+    def redo(self):
+        if label := self.journal.redo():
+            logging.debug(f"Redo: {label}")
+
+    def journal_structural(self, kind: Literal['insert', 'delete'], x0: int, x1: int, axis: Literal[0, 1],
+                           headings: tuple[dict, dict]=None, cells: dict=None):
+        """Records the inverse of the insert/delete of the x0:x1 headings just done: the heading range plus
+        the dimensions and overlay cells it removed, and the formulas, named ranges, styles and conditional
+        formats it clipped."""
+        delta = {
+            'clipped': self.formulas.clipped, 'names': self.look.names.clipped,
+            'styles': self.look.styles.clipped, 'conditional': self.look.conditional.clipped,
+        }
+
+        def undo():
+            if kind == 'delete':
+                self.look.insert(x0, x1, axis=axis)
+                self.look.restore_headings(x0, x1, axis, headings)
+            else:
+                self.look.delete(x0, x1, axis=axis)
+            self.store.revert(kind, x0, x1, axis=axis, cells=cells)
+            for (x, y), text in delta['clipped']:
+                self.store.set(x, y, text)
+            self.look.names.update(dict(delta['names']))
+            self.look.styles.restore_clipped(delta['styles'])
+            self.look.conditional.restore(delta['conditional'])
+            self.redraw_all()
+
+        def redo():
+            if kind == 'delete':
+                self.look.delete(x0, x1, axis=axis)
+                self.store.delete(x0, x1, axis=axis)
+            else:
+                self.look.insert(x0, x1, axis=axis)
+                self.store.insert(x0, x1, axis=axis)
+            delta['clipped'] = self.formulas.clipped
+            delta['names'] = self.look.names.clipped
+            delta['styles'] = self.look.styles.clipped
+            delta['conditional'] = self.look.conditional.clipped
+            self.redraw_all()
+
+        label = f"{kind} {('columns', 'rows')[axis]} {x0}:{x1}"
+        self.journal.record(label, undo, redo, delta_size(cells or {}, *(headings or ()), delta['clipped'], delta['names'], delta['styles'], delta['conditional']))
+
+    def journal_dimension(self, x0: int, x1: int, width: int, axis: Literal[0, 1], headings: tuple[dict, dict]):
+        """Records the inverse of setting the dimension of the x0:x1 headings: their previous entries."""
+        def undo():
+            self.look.restore_headings(x0, x1, axis, headings)
+            self.redraw_all()
+
+        def redo():
+            self.look.set_dimension(x0, x1, width, axis=axis)
+            self.redraw_all()
+
+        label = f"set {('columns width', 'rows height')[axis]} {x0}:{x1}"
+        self.journal.record(label, undo, redo, delta_size(*headings))
+
+    def open_sheet(self, fname: str) -> dict:
+        """Opens the worksheet file memory mapped. Only the pages drawn by setGUI are decoded."""
+        sheet_file = SheetFile(fname)
+        old_base = self.store.base
+        meta = sheet_file.meta
+        self.reset_sheet(store=SheetStore(base=sheet_file), state=meta.get('look'), formulas=meta.get('formulas'))
+        self.look.names.update(meta.get('named_ranges', {}))
+        self.look.styles.load(meta.get('styles', {}))
+        self.look.conditional.load(meta.get('conditional', []))
+        if isinstance(old_base, SheetFile):
+            old_base.close()
+        return sheet_file.meta
+
+    def import_csv(self, fname: str, delimiter: str=',') -> CsvImporter:
+        """Opens a CSV file while it is parsed in a background thread. The sheet grows as rows arrive."""
+        self.cancel_import()
+        self.importer = importer = CsvImporter(fname, delimiter=delimiter)
+        self.reset_sheet(store=SheetStore(base=importer.source))
+        importer.start()
+        self.after(IMPORT_POLL_MS, self.poll_import, importer)
+        return importer
+
+    def cancel_import(self):
+        if self.importer and self.importer.is_alive():
+            self.importer.cancel()
+
+    def poll_import(self, importer: CsvImporter):
+        """Extends the sheet extent up to the import watermark and draws the new visible rows."""
+        look = next((look for look in self.workbook.sheets.values() if look.store.base is importer.source), None)
+        if look is None:
+            return
+        nrows = look.store.nrows
+        look.store.sync_base()
+        if look is self.look and self.store.nrows > nrows:
+            self.refresh_cells(1, nrows + 1, self.look.max_cols, self.store.nrows)
+            if scb_get := self.cget("yscrollcommand"):
+                self._root().tk.call(scb_get, *self.yview())
+        self.event_generate("<<ImportProgress>>")
+        if importer.is_alive():
+            self.after(IMPORT_POLL_MS, self.poll_import, importer)
+        elif importer.error:
+            logging.error(f"Importing {importer.source.fname}: {importer.error}")
+
+    def export_csv(self, fname: str, delimiter: str=',', whole_sheet: bool=False) -> CsvExporter:
+        """Streams the displayed values of the selected cells (or the whole sheet) to a CSV/TSV file in a background
+        thread: formulas are written as their value and the rows in the order of the sort/filter view."""
+        self.cancel_export()
+        view = self.look.view
+        nrows = len(view.rows) if view.active else self.store.nrows
+        x0, y0, x1, y1 = (1, 1, self.store.ncols, nrows) if whole_sheet else self.selected_cells
+        x1, y1 = min(x1, self.store.ncols), min(y1, nrows)
+        blocks = self.look.iter_values(x0, y0, x1, y1, chunk=EXPORT_ROWS)
+        self.exporter = exporter = CsvExporter(fname, y1 - y0 + 1, delimiter=delimiter)
+        exporter.start()
+        self.after_idle(self.export_next_block, exporter, blocks)
+        self.after(EXPORT_POLL_MS, self.poll_export, exporter)
+        return exporter
+
+    def export_next_block(self, exporter: CsvExporter, blocks: Iterator, rows: list=None):
+        """Reads the next block of an export from idle callbacks of the Tk thread, which owns the store and the
+        formula values: the exporter thread only writes the plain rows it is handed."""
+        if exporter.cancel_event.is_set():
+            return
+        if rows is None:
+            rows = next(blocks, None)
+        if not exporter.put(rows):
+            self.after(EXPORT_WAIT_MS, self.export_next_block, exporter, blocks, rows)
+        elif rows is not None:
+            self.after_idle(self.export_next_block, exporter, blocks)
+
+    def cancel_export(self):
+        if self.exporter and self.exporter.is_alive():
+            self.exporter.cancel()
+
+    def poll_export(self, exporter: CsvExporter):
+        self.event_generate("<<ExportProgress>>")
+        if exporter.is_alive():
+            self.after(EXPORT_POLL_MS, self.poll_export, exporter)
+        elif exporter.error:
+            logging.error(f"Exporting {exporter.fname}: {exporter.error}")
+
+    def poll_recalc(self, look: SheetLook):
+        """Merges the finished batches of a parallel recalculation of the look formulas and draws their cells."""
+        if look.formulas.poll() and look is self.look:
+            self.redraw_dirty()
+
+    def copy_cells(self):
+        """Copies the values of the selected cells to the clipboard as TSV. The text is serialised and appended
+        to the clipboard in chunks of CLIPBOARD_ROWS rows from idle callbacks, so the UI keeps responding."""
+        x0, y0, x1, y1 = self.selected_cells
+        x1, y1 = min(x1, self.store.ncols), min(y1, self.store.nrows)
+        self.clipboard_clear()
+        if x1 < x0 or y1 < y0:
+            return
+        self.copy_chunks = chunks = tsv_chunks(self.look.iter_values(x0, y0, x1, y1))
+        self.after_idle(self.copy_next_chunk, chunks)
+
+    def copy_next_chunk(self, chunks):
+        if chunks is not self.copy_chunks:
+            return      # A newer copy replaced this one
+        try:
+            self.clipboard_append(next(chunks))
+        except StopIteration:
+            self.copy_chunks = None
+            self.event_generate("<<CopyDone>>")
+            return
+        self.after_idle(self.copy_next_chunk, chunks)
+
+    def paste_cells(self):
+        """Pastes the TSV text of the clipboard at the active cell. The text is parsed in a background thread
+        and written as a single block, with one undo record and one redraw."""
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            return      # Empty clipboard or not text
+        self.paster = paster = TsvParser(text)
+        paster.start()
+        self.after(PASTE_POLL_MS, self.poll_paste, paster, self.look, self.active_cell)
+
+    def poll_paste(self, paster: TsvParser, look: SheetLook, cell: tuple[int, int]):
+        if paster.is_alive():
+            self.after(PASTE_POLL_MS, self.poll_paste, paster, look, cell)
+            return
+        if paster is not self.paster or look is not self.look:
+            return      # A newer paste or a sheet change
+        self.paster = None
+        if paster.error:
+            logging.error(f"Pasting: {paster.error}")
+            return
+        if rows := paster.rows:
+            self.write_block(*cell, rows, label="paste")
+
+    def write_block(self, x0: int, y0: int, rows: list[list], label: str="write"):
+        """Writes the rows with their top-left corner in the (x0, y0) cell of the view, recording the
+        previous values for undo, and selects the written cells."""
+        view = self.look.view
+        ncols = max(map(len, rows))
+        x1, y1 = x0 + ncols - 1, y0 + len(rows) - 1
+        if view.active:
+            blocks = [(sy, [row]) for y, row in zip(range(y0, y1 + 1), rows) if (sy := view.to_store(y)) is not None]
+        else:
+            blocks = [(y0, rows)]
+        saved = [
+            (sy, [list(row) for row in zip(*(self.store.column_slice(x, sy, sy + len(block) - 1) for x in range(x0, x1 + 1)))])
+            for sy, block in blocks
+        ]
+
+        def write(blocks):
+            for sy, block in blocks:
+                self.store.set_block(x0, sy, block)
+            self.redraw_dirty()
+
+        write(blocks)
+        nbytes = ENTRY_BYTES * (1 + 2 * ncols * sum(len(block) for sy, block in saved))
+        self.journal.record(f"{label} {x0},{y0}:{x1},{y1}", lambda: write(saved), lambda: write(blocks), nbytes)
+        self.set_selected_cells(x0, y0, x1, y1)
+
+    def set_cell(self, x: int, y: int, value):
+        """Writes value in the cell of the view row y (formulas start with '=', numeric text is stored as a number)
+        and redraws the visible cells affected."""
+        if (y := self.look.view.to_store(y)) is not None:
+            self.store.set(x, y, parse_input(value))
+            self.redraw_dirty()
+
+    def set_cells_style(self, **options):
+        """Changes the style options (font, fill, background, anchor, number_format) of the selected cells.
+        A selection reaching the last row styles the whole columns, one style run per column."""
+        x0, y0, x1, y1 = self.selected_cells
+        styles, view = self.look.styles, self.look.view
+        if 'number_format' in options:
+            compile_format(options['number_format'])     # Raises ValueError for an unsupported format
+        if view.active:
+            rows = [(sy, sy) for y in range(y0, y1 + 1) if (sy := view.to_store(y)) is not None]
+        else:
+            rows = [(y0, None if y1 >= self.max_rows else y1)]
+        saved = styles.save_columns(x0, x1)
+
+        def redo():
+            for ry0, ry1 in rows:
+                styles.update_style(x0, ry0, x1, ry1, **options)
+            self.display_cache.invalidate_all()
+            self.redraw_all()
+
+        def undo():
+            styles.restore_columns(x0, x1, saved)
+            self.display_cache.invalidate_all()
+            self.redraw_all()
+
+        for ry0, ry1 in rows:
+            styles.update_style(x0, ry0, x1, ry1, **options)
+        if 'number_format' in options:
+            # The cached display values were formatted with the previous number format
+            self.display_cache.invalidate_range(x0, y0, x1, y1)
+        self.refresh_cells(x0, y0, x1, y1)
+        self.journal.record(f"style {x0},{y0}:{x1},{y1}", undo, redo, delta_size(saved) + delta_size(rows))
+
+    def add_conditional_format(self, kind: str, **params) -> int:
+        """Adds a conditional format rule ('threshold', 'scale', 'bar' or 'duplicates', see conditional.Rule)
+        over the selected cells. Returns the rule id."""
+        x0, y0, x1, y1 = self.selected_cells
+        view = self.look.view
+        if view.active:
+            rows = [sy for y in (y0, y1) if (sy := view.to_store(y)) is not None] or [y0]
+            y0, y1 = min(rows), max(rows)
+        conditional = self.look.conditional
+        rid = conditional.add(Rule(kind, (x0, y0, x1, y1), **params))
+        rule = conditional.rules[rid]
+
+        def undo():
+            conditional.remove(rid)
+            self.redraw_all()
+
+        def redo():
+            conditional.restore([(rid, rule)])
+            self.redraw_all()
+
+        self.redraw_all()
+        self.journal.record(f"conditional format {kind}", undo, redo)
+        return rid
+
+    def sort_rows(self, x: int, descending: int=0):
+        """Sorts the rows of the view by the values in column x, without moving the stored data."""
+        self.look.view.sort(self.store, [(x, bool(descending))], value=self.look.cell_value)
+        self.redraw_view()
+
+    def filter_rows(self, x: int):
+        """Shows only the rows whose value in column x equals the value of the active cell."""
+        ax, ay = self.active_cell
+        if (ay := self.look.view.to_store(ay)) is None:
+            return
+        target = self.look.cell_value(x, ay, self.store.get(x, ay))
+        self.look.view.filter(self.store, x, lambda value: value == target, value=self.look.cell_value)
+        self.redraw_view()
+
+    def find_cells(self, query: str, mode: str='substring', match_case: bool=False) -> list[tuple[int, int]]:
+        """Returns the cells of the view matching query, in row-major order."""
+        view = self.look.view
+        cells = self.search.find(query, mode=mode, match_case=match_case)
+        if not view.active:
+            return cells
+        cells = sorted((vy, x) for x, y in cells if (vy := view.to_view(y)) is not None)
+        return [(x, y) for y, x in cells]
+
+    def find_next_cell(self, query: str, mode: str='substring', match_case: bool=False,
+                  backwards: bool=False) -> tuple[int, int] | None:
+        """Returns the match after the active cell (before it if backwards), wrapping around the view."""
+        if not self.look.view.active:
+            return self.search.find_next(query, self.active_cell, mode=mode, match_case=match_case, backwards=backwards)
+        cells = [(y, x) for x, y in self.find_cells(query, mode=mode, match_case=match_case)]
+        if not cells:
+            return None
+        ax, ay = self.active_cell
+        if backwards:
+            ndx = bisect.bisect_left(cells, (ay, ax)) - 1
+        else:
+            ndx = bisect.bisect_right(cells, (ay, ax)) % len(cells)
+        y, x = cells[ndx]
+        return x, y
+
+    def clear_view(self):
+        """Clears the sort and the filters, showing the rows in storage order."""
+        self.look.view.clear()
+        self.redraw_view()
+
+    def select_store_rows(self) -> bool:
+        """Row inserts and deletes address storage rows: under a sort/filter view the selected view rows are
+        mapped to the storage rows they show, the view is cleared and those rows are selected. Returns False,
+        refusing the edit, when they are not contiguous in storage."""
+        view = self.look.view
+        if not view.active:
+            return True
+        x0, y0, x1, y1 = self.selected_cells
+        if (span := view.store_span(y0, y1)) is None:
+            logging.warning(f"Rows {y0}:{y1} of the view are not contiguous in storage, clear the view to edit them")
+            return False
+        self.clear_view()
+        self.look.selected_cells = x0, span[0], x1, span[1]
+        self.look.active_cell = self.active_cell[0], span[0]
+        self.show_cell(self.viewport_q1[0], span[0])
+        return True
+
+    def redraw_view(self):
+        self.display_cache.invalidate_all()
+        self.refresh_cells(1, 1, self.look.max_cols, self.look.max_rows)
+
+    def redraw_dirty(self):
+        """Redraws the dirty cell areas recorded by the look."""
+        areas, self.look.dirty_areas = self.look.dirty_areas, []
+        for area in areas:
+            self.invalidate_cells(*area)
+        if self.find_withtag("invalid_area"):
+            self.setGUI()
+            self.show_ws_elements()
+
+    def refresh_cells(self, x0: int, y0: int, x1: int, y1: int):
+        """Redraws the content of the visible cells in the x0:x1, y0:y1 range."""
+        self.invalidate_cells(x0, y0, x1, y1)
+        if self.find_withtag("invalid_area"):
+            self.setGUI()
+            self.show_ws_elements()
+
+    def invalidate_cells(self, x0: int, y0: int, x1: int, y1: int):
+        """Deletes the drawn content of the visible cells in the x0:x1, y0:y1 range and invalidates its area."""
+        layout = self.layout
+        for nquadrant in layout.quadrants:
+            orig = layout.panes[nquadrant - 1][0]
+            cx0, cy0 = max(x0, orig[0]), max(y0, orig[1])
+            cx1, cy1 = min(x1, orig[2]), min(y1, orig[3])
+            if cx0 > cx1 or cy0 > cy1:
+                continue
+            area = self.area_coordinates(cx0, cy0, cx1, cy1)
+            for item in self.find_enclosed(area[0] - 1, area[1] - 1, area[2] + 1, area[3] + 1):
+                if {"cell_content", "cell_background"} & set(self.gettags(item)):
+                    self.delete(item)
+            self.tag_area(*area, tag="invalid_area")
+
+    def save_sheet(self, fname: str, **meta):
+        """Saves the worksheet data, headings dimensions and freeze panes state to fname."""
+        meta['look'] = self.look.get_state()
+        meta['formulas'] = list(self.formulas.formulas)
+        meta['named_ranges'] = self.look.names.to_dict()
+        meta['styles'] = self.look.styles.to_dict()
+        meta['conditional'] = self.look.conditional.to_list()
+        write_sheet(fname, self.store, meta)
 
     def move_viewport(self, x, y):
         # if self.look.move_viewport(x, y):
@@ -531,21 +1445,58 @@ class SheetUI(tk.Canvas):
         else:
             x1, y1 = (br_corner or (x0, y0))
             x0, y0, x1, y1 = self.area_coordinates(x0, y0, x1, y1)
-        items = self.find_enclosed(x0, y0, x1, y1)
+        items = [item for item in self.find_enclosed(x0, y0, x1, y1) if self.type(item) == "text"]
         if items:
             return self.itemcget(items[0], "text")
         return ""
 
-    def draw_cell_content(self, box: tuple[int, int, int, int], cell_content:str, **kwargs):
+    def draw_cell_content(self, box: tuple[int, int, int, int], cell_content:str, anchor: str="center",
+                          clip: bool=True, **kwargs) -> int:
         x0, y0, x1, y1 = box
         if old_text := self.screen_cell_content(x0, y0, x1, y1):
             logging.debug(f"replacing {old_text} with {cell_content}")
             self.error_report += f" {old_text}"
-        tid = self.create_text((x0 + x1) // 2, (y0 + y1) // 2, text=cell_content, anchor="center", **kwargs)
+        tx = {'w': x0 + CELL_PADDING, 'e': x1 - CELL_PADDING}.get(anchor, (x0 + x1) // 2)
+        tid = self.create_text(tx, (y0 + y1) // 2, text=cell_content, anchor=anchor, **kwargs)
+        if clip:
+            self.clip_cell_content(tid, box)
+        return tid
+
+    def queue_cell_content(self, box: tuple[int, int, int, int], cell_content: str, anchor: str="center",
+                           clip: bool=True, **kwargs) -> int:
+        """Queues in the canvas batch the text of draw_cell_content. Returns its create index in the batch."""
+        x0, y0, x1, y1 = box
+        tx = {'w': x0 + CELL_PADDING, 'e': x1 - CELL_PADDING}.get(anchor, (x0 + x1) // 2)
+        ndx = self.batch.create('text', tx, (y0 + y1) // 2, text=cell_content, anchor=anchor, **kwargs)
+        if clip:
+            self.batch.clip(ndx, x1 - x0)
+        return ndx
+
+    def report_overlaps(self, area: tuple[int, int, int, int], texts: set[int]):
+        """Reports the texts already drawn in the area about to be drawn (see draw_cell_content)."""
+        if old := [item for item in self.find_enclosed(*area) if item in texts]:
+            old_text = self.itemcget(old[0], "text")
+            logging.debug(f"replacing {len(old)} texts, {old_text} first")
+            self.error_report += f" {old_text}"
+
+    def clip_cell_content(self, tid: int, box: tuple[int, int, int, int]):
+        """Replaces with "*" the text that does not fit in the cell box."""
         tx0, tx1 = self.bbox(tid)[::2]
-        if (tx1 - tx0) > (x1 - x0):
-            self.delete(tid)
-            tid = self.create_text((x0 + x1) // 2, (y0 + y1) // 2, text="*", **kwargs)
+        if (tx1 - tx0) > (box[2] - box[0]):
+            self.itemconfigure(tid, text="*")
+
+    def apply_styles(self, drawn: dict[int, list[tuple[int, tuple[int, int, int, int]]]]):
+        """Queues the configuration of the cells drawn by setGUI, one itemconfigure per style tag, then the clip
+        of their text. drawn maps the style ids to the (batch create index, cell box) drawn with them."""
+        table = self.look.styles.table
+        for sid, items in drawn.items():
+            style = table[sid]
+            self.batch.itemconfigure(f"style{sid}", **style.text_options())
+            if style.background:
+                self.batch.itemconfigure(f"style{sid}_bg", fill=style.background)
+                self.batch.call('raise', f"style{sid}_bg", "background")
+            for ndx, box in items:
+                self.batch.clip(ndx, box[2] - box[0])
 
     def validate_areas(self):
         iareas = self.find_withtag("invalid_area")
@@ -602,85 +1553,119 @@ class SheetUI(tk.Canvas):
         return self.create_rectangle(*area, **kwargs)
 
     def setGUI(self):
+        ncalls = self.crossings()
         winfo_width, winfo_height = self.efective_width(), self.efective_height()
         self.validate_areas()
-
-        # Draw the background
-        linf_coordx, linf_coordy = self.coords_vportq3[0] - COL_CELLS_WIDTH, self.coords_vportq3[1] - ROW_CELLS_HEIGHT
-        lsup_coordx, lsup_coordy = self.cell_coordinates(*self.viewport_q1[2:])[2:]
-        self.coords("background", linf_coordx, linf_coordy, lsup_coordx, lsup_coordy)
-        self.tag_lower("background")  # Ensure the background is at the bottom of the stack
-        # Draw column headings
-        for item in self.find_withtag("cols_to_draw"):
-            cx0, cy0, cx1, cy1 = map(int, self.coords(item))
-            xcell = 1
-            while cx0 < cx1 and xcell < MAX_COLS:
-                nquadrant = self.cell_quadrant(cx0, cy1, isCoord=True)
-                orig, coords_orig = self.quadrant_data(nquadrant)
-                xcell = self.cell_containing_coords(cx0, cy0, orig, coords_orig)[0]
-                y0, y1 = cy0, cy1
-                x0, x1 = self.cell_coordinates(xcell, 0, orig, coords_orig)[::2]
-                self.create_rectangle(x0, y0, x1, y1, fill="green", outline="black", tags="column")
-                # Draw cell headings
-                self.draw_cell_content((x0, y0, x1, y1), f"C{xcell}", fill="white", tags="columns_tag")
-                # Draw vertical lines
-                self.create_line(x0, y0, x0, winfo_height, fill=GRID_COLOR, tags="vgrid_lines")
-                cx0 = x1
-            assert xcell >= MAX_COLS or cx0 == cx1
-            logging.debug(f"Last column draw {xcell}")
-            self.itemconfig(item, tags="cols_drawn", state="hidden")
-            pass
-
-        # Draw row headings
-        for item in self.find_withtag("rows_to_draw"):
-            cx0, cy0, cx1, cy1 = map(int, self.coords(item))
-            ycell = 1
-            while cy0 < cy1 and ycell < MAX_ROWS:
-                nquadrant = self.cell_quadrant(cx1, cy0, isCoord=True)
-                orig, coords_orig = self.quadrant_data(nquadrant)
-                ycell = self.cell_containing_coords(cx0, cy0, orig, coords_orig)[1]
-                x0, x1 = cx0, cx1
-                y0, y1 = self.cell_coordinates(0, ycell, orig, coords_orig)[1::2]
-                self.create_rectangle(x0, y0, x1, y1, fill="green", outline="black", tags="row")
-                # Draw cell headings
-                self.draw_cell_content((x0, y0, x1, y1), f"R{ycell}", fill="white", tags="rows_tag")
-                # Draw horizontal lines
-                self.create_line(x0, y1, winfo_width, y1, fill=GRID_COLOR, tags="hgrid_lines")
-                cy0 = y1
-            assert ycell >= MAX_ROWS or cy0 == cy1
-            logging.debug(f"Last row draw {ycell}")
-            self.itemconfig(item, tags="rows_drawn", state="hidden")
-            pass
-
-        # Draw cells content
-        quadrants = [1, 2, 3, 4] if self.coords_vportq1 != self.coords_vportq3 else [1]
-        for item in self.find_withtag("cells_to_draw"):
-            ix0, iy0, ix1, iy1 = map(int, self.coords(item))
-            assert tuple(map(min, zip((ix1, iy1), self.cell_coordinates(MAX_COLS, MAX_ROWS)[2:]))) == self.area_coordinates(*self.area_cells(ix0, iy0, ix1, iy1))[2:]
-            for nquadrant in quadrants:
-                orig, coords_orig = self.quadrant_data(nquadrant)
-                ax0, ay0, ax1, ay1 = self.area_coordinates(*orig)
-                # Overlaping area
-                cx0, cy0 = max(ix0, ax0), max(iy0, ay0)
-                cx1, cy1 = min(ix1, ax1), min(iy1, ay1)
-                if not (cx1 > cx0 and cy1 > cy0):
-                    continue
-                while cx0 < cx1:
-                    y0 = cy0
-                    while y0 < cy1:
-                        xcell, ycell = self.cell_containing_coords(cx0, y0, orig, coords_orig)
-                        x0, y0, x1, y1 = self.cell_coordinates(xcell, ycell, orig, coords_orig)
-                        cell_content = self.cell_content(nquadrant, xcell, ycell)
-                        self.draw_cell_content((x0, y0, x1, y1), cell_content, fill="black", tags="cell_content")
-                        y0 = y1
+        # The canvas items are created, configured and clipped by a single Tcl script
+        old_texts = {item for tag in ("cell_content", "columns_tag", "rows_tag") for item in self.find_withtag(tag)}
+        with self.batch.batched() as batch:
+            # Draw the background
+            linf_coordx, linf_coordy = self.coords_vportq3[0] - COL_CELLS_WIDTH, self.coords_vportq3[1] - ROW_CELLS_HEIGHT
+            lsup_coordx, lsup_coordy = self.cell_coordinates(*self.viewport_q1[2:])[2:]
+            batch.call('coords', "background", linf_coordx, linf_coordy, lsup_coordx, lsup_coordy)
+            batch.call('lower', "background")  # Ensure the background is at the bottom of the stack
+            # Draw column headings
+            for item in self.find_withtag("cols_to_draw"):
+                cx0, cy0, cx1, cy1 = map(int, self.coords(item))
+                self.report_overlaps((cx0, cy0, cx1, cy1), old_texts)
+                xcell = 1
+                while cx0 < cx1 and xcell < self.look.max_cols:
+                    nquadrant = self.cell_quadrant(cx0, cy1, isCoord=True)
+                    orig, coords_orig = self.quadrant_data(nquadrant)
+                    xcell = self.cell_containing_coords(cx0, cy0, orig, coords_orig)[0]
+                    y0, y1 = cy0, cy1
+                    x0, x1 = self.cell_coordinates(xcell, 0, orig, coords_orig)[::2]
+                    batch.create('rectangle', x0, y0, x1, y1, fill="green", outline="black", tags="column")
+                    # Draw cell headings
+                    self.queue_cell_content((x0, y0, x1, y1), f"C{xcell}", fill="white", tags="columns_tag")
+                    # Draw vertical lines
+                    batch.create('line', x0, y0, x0, winfo_height, fill=GRID_COLOR, tags="vgrid_lines")
                     cx0 = x1
-            self.itemconfig(item, tags="cells_drawn", state="hidden")
-            pass
+                assert xcell >= self.look.max_cols or cx0 == cx1
+                logging.debug(f"Last column draw {xcell}")
+                batch.itemconfigure(item, tags="cols_drawn", state="hidden")
+                pass
+
+            # Draw row headings
+            for item in self.find_withtag("rows_to_draw"):
+                cx0, cy0, cx1, cy1 = map(int, self.coords(item))
+                self.report_overlaps((cx0, cy0, cx1, cy1), old_texts)
+                ycell = 1
+                while cy0 < cy1 and ycell < self.look.max_rows:
+                    nquadrant = self.cell_quadrant(cx1, cy0, isCoord=True)
+                    orig, coords_orig = self.quadrant_data(nquadrant)
+                    ycell = self.cell_containing_coords(cx0, cy0, orig, coords_orig)[1]
+                    x0, x1 = cx0, cx1
+                    y0, y1 = self.cell_coordinates(0, ycell, orig, coords_orig)[1::2]
+                    batch.create('rectangle', x0, y0, x1, y1, fill="green", outline="black", tags="row")
+                    # Draw cell headings
+                    self.queue_cell_content((x0, y0, x1, y1), f"R{ycell}", fill="white", tags="rows_tag")
+                    # Draw horizontal lines
+                    batch.create('line', x0, y1, winfo_width, y1, fill=GRID_COLOR, tags="hgrid_lines")
+                    cy0 = y1
+                assert ycell >= self.look.max_rows or cy0 == cy1
+                logging.debug(f"Last row draw {ycell}")
+                batch.itemconfigure(item, tags="rows_drawn", state="hidden")
+                pass
+
+            # Draw cells content
+            layout = self.layout
+            styles, view, conditional = self.look.styles, self.look.view, self.look.conditional
+            drawn = collections.defaultdict(list)      # Style id -> (batch create index, cell box) drawn with the style
+            for item in self.find_withtag("cells_to_draw"):
+                ix0, iy0, ix1, iy1 = map(int, self.coords(item))
+                self.report_overlaps((ix0, iy0, ix1, iy1), old_texts)
+                assert tuple(map(min, zip((ix1, iy1), self.cell_coordinates(self.look.max_cols, self.look.max_rows)[2:]))) == self.area_coordinates(*self.area_cells(ix0, iy0, ix1, iy1))[2:]
+                for nquadrant in layout.quadrants:
+                    orig, coords_orig = layout.panes[nquadrant - 1]
+                    ax0, ay0, ax1, ay1 = self.area_coordinates(*orig)
+                    # Overlaping area
+                    cx0, cy0 = max(ix0, ax0), max(iy0, ay0)
+                    cx1, cy1 = min(ix1, ax1), min(iy1, ay1)
+                    if not (cx1 > cx0 and cy1 > cy0):
+                        continue
+                    while cx0 < cx1:
+                        # The cells of the column are located first, so that their values are formatted at once
+                        y0, cells = cy0, []
+                        while y0 < cy1:
+                            xcell, ycell = self.cell_containing_coords(cx0, y0, orig, coords_orig)
+                            box = self.cell_coordinates(xcell, ycell, orig, coords_orig)
+                            cells.append((ycell, box))
+                            y0 = box[3]
+                        texts = self.look.column_display(nquadrant, xcell, [ycell for ycell, box in cells])
+                        for (ycell, (x0, y0, x1, y1)), cell_content in zip(cells, texts):
+                            sid = styles.style_id(xcell, sy) if (sy := view.to_store(ycell)) is not None else 0
+                            if sy is not None and conditional.rules and conditional.covers(xcell, sy):
+                                # Conditional formats are evaluated only for the cells being drawn
+                                options = conditional.format(xcell, sy, self.look.cell_value(xcell, sy, self.store.get(xcell, sy)))
+                                if bar := options.pop('bar', None):
+                                    fraction, color = bar
+                                    batch.create('rectangle', x0, y0 + 2, x0 + max(1, round(fraction * (x1 - x0))), y1 - 2,
+                                                 fill=color, width=0, tags=("cell_background", "data_bar"))
+                                if options:
+                                    sid = styles.table.intern(styles.table[sid]._replace(**options))
+                            style = styles.table[sid]
+                            if style.background:
+                                batch.create('rectangle', x0, y0, x1, y1, width=0, tags=("cell_background", f"style{sid}_bg"))
+                            ndx = self.queue_cell_content((x0, y0, x1, y1), cell_content, anchor=style.anchor, clip=False,
+                                                          tags=("cell_content", f"style{sid}"))
+                            drawn[sid].append((ndx, (x0, y0, x1, y1)))
+                        cx0 = x1
+                batch.itemconfigure(item, tags="cells_drawn", state="hidden")
+                pass
+            self.apply_styles(drawn)
+        self.frame_crossings = self.crossings() - ncalls
         # [self.tag_lower(tag) for tag in ("cols_drawn", "rows_drawn", "cells_drawn")]
         if logger.isEnabledFor(logging.DEBUG):
             logging.debug(sorted(Counter([self.itemcget(item, 'tags') for item in self.find_all()]).items()))
+            logging.debug(f"Display cache: {self.display_cache.stats()}")
+            logging.debug(f"Tcl crossings: {self.frame_crossings} in setGUI")
         pass
     
+    def snapshot(self) -> Snapshot:
+        """Returns the digest of the look state and of the canvas items grouped by tags."""
+        return take_snapshot(self.look.get_state(), self.item_records(), self.snapshot_hashes)
+
     def show_ws_elements(self):
         """Shows the elements as active cell, selected cells, freeze lines, rows/cols selected in the worksheet."""
 
@@ -760,7 +1745,7 @@ class SheetUI(tk.Canvas):
         """Sets the height of the rows in the range y0:y1 and returns the change in height"""
         height = max(-1, height)
         sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
-        if (sel_x0, sel_x1) != (1, MAX_COLS):
+        if (sel_x0, sel_x1) != (1, self.look.max_cols):
             return
         linf_y, lsup_y = self.look.area_coordinates(sel_x0, sel_y0, sel_x1, sel_y1)[1::2]
         clinf_x = self.coords_vportq3[0] - COL_CELLS_WIDTH
@@ -768,7 +1753,9 @@ class SheetUI(tk.Canvas):
         to_delete = (clinf_x - 1, linf_y - 1, vplsup_x0 + 1, lsup_y + 1)
         to_move = (clinf_x - 1, linf_y - 1, vplsup_x0 + 1, vplsup_y0 + 1)
 
+        headings = self.look.save_headings(sel_y0, sel_y1, axis=1)
         delta = self.look.set_dimension(sel_y0, sel_y1, height, axis=1)
+        self.journal_dimension(sel_y0, sel_y1, height, 1, headings)
 
         self.delete(*self.find_enclosed(*to_delete))
         for item in self.find_enclosed(*to_move):
@@ -792,9 +1779,9 @@ class SheetUI(tk.Canvas):
 
     def insert_rows(self):
         """Inserts (y1 - y0) headings with default dimension before heading y0."""
-        sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
-        if (sel_x0, sel_x1) != (1, MAX_COLS):
+        if self.selected_cells[::2] != (1, self.look.max_cols) or not self.select_store_rows():
             return
+        sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
         linf_y, lsup_y = self.look.area_coordinates(sel_x0, sel_y0, sel_x1, sel_y1)[1::2]
         clinf_x = self.coords_vportq3[0] - COL_CELLS_WIDTH
         vplsup_x0, vplsup_y0 = self.cell_coordinates(*self.viewport_q1[2:])[2:]
@@ -802,6 +1789,8 @@ class SheetUI(tk.Canvas):
         to_move = (clinf_x - 1, linf_y - 1, vplsup_x0 + 1, vplsup_y0 + 1)
 
         delta = self.look.insert(sel_y0, sel_y1, axis=1)
+        self.store.insert_rows(sel_y0, sel_y1)   # Invalidates the display cache for the shifted cells
+        self.journal_structural('insert', sel_y0, sel_y1, 1)
 
         self.delete(*self.find_enclosed(*to_delete))
         for item in self.find_enclosed(*to_move):
@@ -827,9 +1816,9 @@ class SheetUI(tk.Canvas):
 
     def delete_rows(self):
         """Deletes the rows in the range y0:y1 and returns the change in height."""
-        sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
-        if (sel_x0, sel_x1) != (1, MAX_COLS):
+        if self.selected_cells[::2] != (1, self.look.max_cols) or not self.select_store_rows():
             return
+        sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
         linf_y, lsup_y = self.look.area_coordinates(sel_x0, sel_y0, sel_x1, sel_y1)[1::2]
         clinf_x = self.coords_vportq3[0] - COL_CELLS_WIDTH
         vplsup_x0, vplsup_y0 = self.cell_coordinates(*self.viewport_q1[2:])[2:]
@@ -838,7 +1827,10 @@ class SheetUI(tk.Canvas):
 
         # MArks for movement the rows from sel_y1 < y < viewport_y1
         to_move = (clinf_x - 1, lsup_y - 1, vplsup_x0 + 1, vplsup_y0 + 1)
+        saved = self.look.save_headings(sel_y0, sel_y1, axis=1), self.store.extract(sel_y0, sel_y1, axis=1)
         delta = self.look.delete(sel_y0, sel_y1, axis=1)
+        self.store.delete_rows(sel_y0, sel_y1)   # Invalidates the display cache for the shifted cells
+        self.journal_structural('delete', sel_y0, sel_y1, 1, *saved)
 
         self.delete(*self.find_enclosed(*to_delete))
         for item in self.find_enclosed(*to_move):
@@ -867,7 +1859,7 @@ class SheetUI(tk.Canvas):
         """Sets the width of the columns in the range x0:x1 and returns the change in width."""
         width = max(-1, width)
         sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
-        if (sel_y0, sel_y1) != (1, MAX_ROWS):
+        if (sel_y0, sel_y1) != (1, self.look.max_rows):
             return
         linf_x, lsup_x = self.look.area_coordinates(sel_x0, sel_y0, sel_x1, sel_y1)[::2]
         clinf_y = self.coords_vportq3[1] - ROW_CELLS_HEIGHT
@@ -875,7 +1867,9 @@ class SheetUI(tk.Canvas):
         to_delete = (linf_x - 1, clinf_y - 1, lsup_x + 1, vplsup_y0 + 1)
         to_move = (lsup_x - 1, clinf_y - 1, vplsup_x0 + 1, vplsup_y0 + 1)
 
+        headings = self.look.save_headings(sel_x0, sel_x1, axis=0)
         delta = self.look.set_dimension(sel_x0, sel_x1, width)
+        self.journal_dimension(sel_x0, sel_x1, width, 0, headings)
 
         self.delete(*self.find_enclosed(*to_delete))
         for item in self.find_enclosed(*to_move):
@@ -897,10 +1891,69 @@ class SheetUI(tk.Canvas):
         self.setGUI()
         self.show_ws_elements()
 
+    def set_fitted_dimensions(self, dims: dict[int, int], axis: Literal[0, 1]):
+        """Sets the {heading: dimension} dimensions of the headings, one set_dimension per run of headings with
+        the same dimension, as a single journal entry."""
+        if not dims:
+            return
+        x0, x1 = min(dims), max(dims)
+        runs = []
+        for x, dim in sorted(dims.items()):
+            if runs and runs[-1][1] == x - 1 and runs[-1][2] == dim:
+                runs[-1][1] = x
+            else:
+                runs.append([x, x, dim])
+        headings = self.look.save_headings(x0, x1, axis=axis)
+
+        def redo():
+            for rx0, rx1, dim in runs:
+                self.look.set_dimension(rx0, rx1, dim, axis=axis)
+            self.redraw_all()
+
+        def undo():
+            self.look.restore_headings(x0, x1, axis, headings)
+            self.redraw_all()
+
+        redo()
+        label = f"autofit {('columns width', 'rows height')[axis]} {x0}:{x1}"
+        self.journal.record(label, undo, redo, delta_size(*headings) + delta_size(runs))
+
+    def autofit_columns(self):
+        """Sets the width of the selected columns to fit their widest display value. Hidden columns are skipped."""
+        x0, y0, x1, y1 = self.selected_cells
+        dims = {}
+        for x in range(x0, x1 + 1):
+            if self.look.headings_dim.get(f"C{x}") == 0:
+                continue
+            texts = self.look.autofit_texts(x)
+            width = max((self.text_measure.width(font, text) for font, text in texts), default=0)
+            dims[x] = width + 2 * CELL_PADDING if width else CELL_WIDTH
+        self.set_fitted_dimensions(dims, axis=0)
+
+    def autofit_rows(self):
+        """Sets the height of the selected rows to fit their tallest display value. Hidden rows are skipped. In
+        selections of more than AUTOFIT_ROWS rows only the visible rows and the rows of the longest values of every
+        column are measured, the rest keep their height."""
+        x0, y0, x1, y1 = self.selected_cells
+        view = self.look.view
+        y1 = min(y1, len(view.rows) if view.active else self.store.nrows)
+        if y1 - y0 + 1 > AUTOFIT_ROWS:
+            srows = set(self.look.visible_rows())
+            for x in range(1, self.store.ncols + 1):
+                srows.update(self.look.longest.longest(x))
+            ys = [y for sy in srows if (y := view.to_view(sy)) is not None and y0 <= y <= y1]
+        else:
+            ys = range(y0, y1 + 1)
+        dims = {}
+        for y, texts in self.look.rows_texts(y for y in ys if self.look.headings_dim.get(f"R{y}") != 0):
+            height = max((self.text_measure.height(font, text) for font, text in texts), default=0)
+            dims[y] = max(CELL_HEIGHT, height + 2 * CELL_PADDING) if height else CELL_HEIGHT
+        self.set_fitted_dimensions(dims, axis=1)
+
     def insert_columns(self):
         """Inserts (x1 - x0) headings with default dimension before heading x0."""
         sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
-        if (sel_y0, sel_y1) != (1, MAX_ROWS):
+        if (sel_y0, sel_y1) != (1, self.look.max_rows):
             return
         linf_x, lsup_x = self.look.area_coordinates(sel_x0, sel_y0, sel_x1, sel_y1)[::2]
         clinf_y = self.coords_vportq3[1] - ROW_CELLS_HEIGHT
@@ -908,6 +1961,8 @@ class SheetUI(tk.Canvas):
         to_move = (linf_x - 1, clinf_y - 1, vplsup_x0 + 1, vplsup_y0 + 1)
 
         delta = self.look.insert(sel_x0, sel_x1)
+        self.store.insert_columns(sel_x0, sel_x1)   # Invalidates the display cache for the shifted cells
+        self.journal_structural('insert', sel_x0, sel_x1, 0)
 
         for item in self.find_enclosed(*to_move):
             self.move(item, delta, 0)
@@ -932,7 +1987,7 @@ class SheetUI(tk.Canvas):
     def delete_columns(self):
         """Deletes the columns in the range x0:x1 and returns the change in width."""
         sel_x0, sel_y0, sel_x1, sel_y1 = self.selected_cells
-        if (sel_y0, sel_y1) != (1, MAX_ROWS):
+        if (sel_y0, sel_y1) != (1, self.look.max_rows):
             return
         linf_x, lsup_x = self.look.area_coordinates(sel_x0, sel_y0, sel_x1, sel_y1)[::2]
         clinf_y = self.coords_vportq3[1] - ROW_CELLS_HEIGHT
@@ -942,7 +1997,10 @@ class SheetUI(tk.Canvas):
 
         # MArks for movement the columns from sel_x1 < x < viewport_x1
         to_move = (lsup_x - 1, clinf_y - 1, vplsup_x0 + 1, vplsup_y0 + 1)
+        saved = self.look.save_headings(sel_x0, sel_x1, axis=0), self.store.extract(sel_x0, sel_x1, axis=0)
         delta = self.look.delete(sel_x0, sel_x1)
+        self.store.delete_columns(sel_x0, sel_x1)   # Invalidates the display cache for the shifted cells
+        self.journal_structural('delete', sel_x0, sel_x1, 0, *saved)
 
         self.delete(*self.find_enclosed(*to_delete))
         for item in self.find_enclosed(*to_move):
@@ -1074,18 +2132,18 @@ class SheetUI(tk.Canvas):
         isup = (dx < 0) * 0x1 + (dy < 0) * 0x2
         with self.pivot_point(isActiveCell=not isShiftPressed, isUp=isup) as pivot:
             if isCtrlPressed:
-                dx = dx * ((pivot.x - 1) if dx < 0 else (MAX_COLS - pivot.x))
-                dy = dy * ((pivot.y - 1) if dy < 0 else (MAX_ROWS - pivot.y))
+                dx = dx * ((pivot.x - 1) if dx < 0 else (self.look.max_cols - pivot.x))
+                dy = dy * ((pivot.y - 1) if dy < 0 else (self.look.max_rows - pivot.y))
             # nquadrant = self.cell_quadrant(pivot.x, pivot.y, isCoord=False)
             linf_x, linf_y = 1, 1
-            pivot.x = max(linf_x, min(MAX_COLS, self.look.cell_inc(pivot.x, dx, axis=0)))
-            pivot.y = max(linf_y, min(MAX_ROWS, self.look.cell_inc(pivot.y, dy, axis=1)))
+            pivot.x = max(linf_x, min(self.look.max_cols, self.look.cell_inc(pivot.x, dx, axis=0)))
+            pivot.y = max(linf_y, min(self.look.max_rows, self.look.cell_inc(pivot.y, dy, axis=1)))
             xin, yin = pivot.x, pivot.y
         orig = self.quadrant_data(3)[0]
         if self.look.flags & SheetState.FREEZE is SheetState.NONE:
-            if self.selected_cells[::2] == (1, MAX_COLS):
+            if self.selected_cells[::2] == (1, self.look.max_cols):
                xin, yin = self.viewport_q1[0], self.selected_cells[1::2][int(dy > 0)]
-            elif self.selected_cells[1::2] == (1, MAX_ROWS):
+            elif self.selected_cells[1::2] == (1, self.look.max_rows):
                xin, yin = self.selected_cells[::2][int(dx > 0)],self.viewport_q1[1]
         nquadrant = self.cell_quadrant(xin, yin, isCoord=False)
         if (xin >= orig[0] and yin >= orig[1]) and nquadrant != 3:
@@ -1161,6 +2219,8 @@ class SheetUI(tk.Canvas):
         self.look.flags ^= SheetState.GRIDLINES
     
     def toggle_freeze_panes(self):
+        panes = ('coords_vportq3', 'viewport_q3', 'coords_vportq1', 'viewport_q1')
+        before = {key: getattr(self.look, key) for key in ('flags', *panes)}
         if self.look.flags & SheetState.FREEZE is SheetState.NONE:
             x0, y0, x1, y1 = self.viewport_q3
             coord_acx, coord_acy = self.cell_coordinates(*self.active_cell)[:2]
@@ -1183,7 +2243,17 @@ class SheetUI(tk.Canvas):
             self.look.viewport_q3 = 1, 1, 1, 1
             items = self.find_withtag("freeze_line")
             self.delete(*items)
+        # The display value depends on the quadrant showing the cell
+        self.display_cache.invalidate_all()
         self.look.flags ^= SheetState.FREEZE
+        after = {key: getattr(self.look, key) for key in ('flags', *panes)}
+
+        def restore(state: dict):
+            for key, value in state.items():
+                setattr(self.look, key, value)
+            self.display_cache.invalidate_all()
+            self.redraw_all()
+        self.journal.record("toggle freeze panes", lambda: restore(before), lambda: restore(after))
 
     def on_key_press(self, event):
         """Sets the active cell based on the arrow key pressed."""
@@ -1269,7 +2339,7 @@ class SheetUI(tk.Canvas):
         if not items:
             return "break"
         if event.x < COL_CELLS_WIDTH and event.y < ROW_CELLS_HEIGHT:
-            self.selected_cells = (1, 1, MAX_COLS, MAX_ROWS)
+            self.selected_cells = (1, 1, self.look.max_cols, self.look.max_rows)
             self.look.active_cell = self.viewport_q1[:2]
             self.show_ws_elements()
             return "break"
@@ -1282,12 +2352,12 @@ class SheetUI(tk.Canvas):
             pivot.y = clk_y
         if row_clk := event.x < COL_CELLS_WIDTH: # and event.y >= ROW_CELLS_HEIGHT:
             sel_y0, sel_y1 = self.selected_cells[1::2]
-            self.look.selected_cells = 1, sel_y0, MAX_COLS, sel_y1
+            self.look.selected_cells = 1, sel_y0, self.look.max_cols, sel_y1
             if not event.state & SHIFT_PRESSED:
                 self.look.active_cell = (self.viewport_q1[0], clk_y)
         elif col_clk := event.y < ROW_CELLS_HEIGHT: # and event.x >= COL_CELLS_WIDTH:
             sel_x0, sel_x1 = self.selected_cells[::2]
-            self.look.selected_cells = sel_x0, 1, sel_x1, MAX_ROWS
+            self.look.selected_cells = sel_x0, 1, sel_x1, self.look.max_rows
             if not event.state & SHIFT_PRESSED:
                 self.look.active_cell = (clk_x, self.viewport_q1[1])
         # if (row_clk or col_clk) and not event.state & SHIFT_PRESSED:
@@ -1305,7 +2375,7 @@ class SheetUI(tk.Canvas):
                 logging.debug("Mouse drag event triggered for col o row selection")
             if event_x >= COL_CELLS_WIDTH and event_y < ROW_CELLS_HEIGHT:
                 # mouse over column headings
-                if self.selected_cells[1::2] != (1, MAX_ROWS):
+                if self.selected_cells[1::2] != (1, self.look.max_rows):
                     # Not column selection
                     self.yview('scroll', '-1', 'units')
                     clk_x, clk_y = self.cell_containing_coords(event_x, ROW_CELLS_HEIGHT + 1)
@@ -1338,7 +2408,7 @@ class SheetUI(tk.Canvas):
                 self.show_ws_elements()
             elif event_x < COL_CELLS_WIDTH and event_y >= ROW_CELLS_HEIGHT:
                 # mouse over row headings
-                if self.selected_cells[::2] != (1, MAX_COLS):
+                if self.selected_cells[::2] != (1, self.look.max_cols):
                     # Not row selection
                     self.xview('scroll', '-1', 'units')
                     clk_x, clk_y = self.cell_containing_coords(COL_CELLS_WIDTH + 1, event_y)
@@ -1365,12 +2435,12 @@ class SheetUI(tk.Canvas):
                 # mouse over corners
                 viewport_x0, viewport_y0 = self.viewport_q1[:2]
                 event = tk.Event()
-                if self.selected_cells[::2] == (1, MAX_COLS):
+                if self.selected_cells[::2] == (1, self.look.max_cols):
                     # Column selection
                     self.move_viewport(viewport_x0, viewport_y0 - 1)
                     event.x, event.y = COL_CELLS_WIDTH - 1, ROW_CELLS_HEIGHT
                     self.on_mouse_click(event)
-                elif self.selected_cells[1::2] == (1, MAX_ROWS):
+                elif self.selected_cells[1::2] == (1, self.look.max_rows):
                     # Row selection
                     self.move_viewport(viewport_x0 - 1, viewport_y0)
                     event.x, event.y = COL_CELLS_WIDTH, ROW_CELLS_HEIGHT - 1
@@ -1397,16 +2467,16 @@ class SheetUI(tk.Canvas):
         fnc("scroll", delta, 'units')
 
     def ymin_fraction(self):
-            y1 = MAX_ROWS
+            y1 = self.look.max_rows
             y0 = int(y1 - (self.winfo_height() - ROW_CELLS_HEIGHT) // CELL_HEIGHT)
-            min_fraction = 1 - (y1 - y0) / (MAX_ROWS - self.viewport_q3[3])
+            min_fraction = 1 - (y1 - y0) / (self.look.max_rows - self.viewport_q3[3])
             return min_fraction
     
     def yview(self, *args):
         if not args:
             min_fraction = self.ymin_fraction()
             viewport_y0, viewport_y1 = self.viewport_q1[1::2]
-            denom = MAX_ROWS - self.viewport_q3[3]
+            denom = self.look.max_rows - self.viewport_q3[3]
             first = (viewport_y0 - self.viewport_q3[3]) / denom
             first = min(first, min_fraction)
             last = (viewport_y1 - self.viewport_q3[3]) / denom if first < min_fraction else 1.0
@@ -1428,7 +2498,7 @@ class SheetUI(tk.Canvas):
                 else:
                     ytop, ybottom = self.cell_coordinates(0, viewport_y0)[1::2]
                     viewport_y0 = self.cell_containing_coords(0, ybottom - (self.winfo_height() - ytop))[1]
-                viewport_y0 = min(MAX_ROWS, max(1, viewport_y0))
+                viewport_y0 = min(self.look.max_rows, max(1, viewport_y0))
                 self.yview_moveto(viewport_y0)
             self.show_ws_elements()
         elif args[0] == 'moveto':
@@ -1443,10 +2513,10 @@ class SheetUI(tk.Canvas):
                 viewport_y0 = cell_y
             case _:
                 fraction = min(self.ymin_fraction(), float(fraction))
-                viewport_y0 = int(fraction * (MAX_ROWS - self.viewport_q3[3]) + self.viewport_q3[3])
+                viewport_y0 = int(fraction * (self.look.max_rows - self.viewport_q3[3]) + self.viewport_q3[3])
 
         viewport_x0 = self.viewport_q1[0]
-        viewport_y0 = max(self.viewport_q3[3], min(MAX_ROWS, viewport_y0))
+        viewport_y0 = max(self.viewport_q3[3], min(self.look.max_rows, viewport_y0))
         self.move_viewport(viewport_x0, viewport_y0)
 
         if scb_get := self.cget("yscrollcommand"):  #vertical scrollbar (scb) get command
@@ -1454,16 +2524,16 @@ class SheetUI(tk.Canvas):
             return _tk.call(scb_get, *self.yview())
 
     def xmin_fraction(self):
-        x1 = MAX_COLS
+        x1 = self.look.max_cols
         x0 = int(x1 - (self.winfo_width() - COL_CELLS_WIDTH) // CELL_WIDTH)
-        min_fraction = 1 - (x1 - x0) / (MAX_COLS - self.viewport_q3[2])
+        min_fraction = 1 - (x1 - x0) / (self.look.max_cols - self.viewport_q3[2])
         return min_fraction
     
     def xview(self, *args):
         if not args:
             min_fraction = self.xmin_fraction()
             viewport_x0, viewport_x1 = self.viewport_q1[::2]
-            denom = MAX_COLS - self.viewport_q3[2]
+            denom = self.look.max_cols - self.viewport_q3[2]
             first = (viewport_x0 - self.viewport_q3[2]) / denom
             first = min(first, min_fraction)
             last = (viewport_x1 - self.viewport_q3[2]) / denom if first < min_fraction else 1.0
@@ -1485,7 +2555,7 @@ class SheetUI(tk.Canvas):
                 else:
                     xtop, xbottom = self.cell_coordinates(viewport_x0, 0)[::2]
                     viewport_x0 = self.cell_containing_coords(xbottom - (self.winfo_width() - xtop), 0)[0]
-                viewport_x0 = min(MAX_COLS, max(1, viewport_x0))
+                viewport_x0 = min(self.look.max_cols, max(1, viewport_x0))
                 self.xview_moveto(viewport_x0)
             self.show_ws_elements()
         elif args[0] == 'moveto':
@@ -1500,10 +2570,10 @@ class SheetUI(tk.Canvas):
                 viewport_x0 = cell_y
             case _:
                 fraction = min(self.xmin_fraction(), float(fraction))
-                viewport_x0 = int(fraction * (MAX_COLS - self.viewport_q3[2]) + self.viewport_q3[2])
+                viewport_x0 = int(fraction * (self.look.max_cols - self.viewport_q3[2]) + self.viewport_q3[2])
 
         viewport_y0 = self.viewport_q1[1]
-        viewport_x0 = max(self.viewport_q3[2], min(MAX_COLS, viewport_x0))
+        viewport_x0 = max(self.viewport_q3[2], min(self.look.max_cols, viewport_x0))
         self.move_viewport(viewport_x0, viewport_y0)
 
         if scb_get := self.cget("xscrollcommand"):  #vertical scrollbar (scb) get command
@@ -1511,30 +2581,79 @@ class SheetUI(tk.Canvas):
             return _tk.call(scb_get, *self.xview())
 
 
+class SheetUI(SheetPainter, tk.Canvas):
+    def __init__(self, parent, **kwargs):
+        tk.Canvas.__init__(self, parent, **kwargs)
+        self.init_painter()
+        self.tk = TclCounter(self.tk)           # Python -> Tcl crossings, logged per setGUI pass
+        self.batch = CanvasBatch(self)
+        self.bind_events()
+        self.focus_set()  # Set focus to the canvas
+
+    def crossings(self) -> int:
+        return self.tk.ncalls
+
+    def item_records(self) -> list[tuple]:
+        return self.batch.item_records()
+
+    def tk_font(self, desc: str) -> tkfont.Font:
+        """Returns the Tk font of the font description, created once."""
+        if (answ := self.fonts.get(desc)) is None:
+            answ = self.fonts[desc] = tkfont.Font(root=self, font=desc)
+        return answ
+
+    def font_measure(self, desc: str, text: str) -> int:
+        return self.tk_font(desc).measure(text)
+
+    def font_linespace(self, desc: str) -> int:
+        return self.tk_font(desc).metrics('linespace')
+
+
+class HeadlessSheetUI(SheetPainter, RecordingCanvas):
+    """SheetUI painting on a RecordingCanvas: the sheet is laid out and drawn without a display, for tests,
+    benchmarks and snapshots (export_svg, export_ppm)."""
+    def __init__(self, width: int=600, height: int=400, **kwargs):
+        RecordingCanvas.__init__(self, width, height, **kwargs)
+        self.init_painter()
+        self.bind_events()
+
+
 class SheetViewer(tk.Tk):
     def __init__(self):
         super().__init__()
         self.front_end = None
         self.top_child = None
-        self.named_range = {}
+        self.stats_job = None
+        self.findui = None
         self.fnc_to_test = [
             "choose an action",
             "set_selected_cells", 
             "delete_rows", "insert_rows", "set_rows_height", 
             "delete_columns", "insert_columns", "set_cols_width", 
+            "autofit_columns", "autofit_rows",
             "toggle_areas_drawn", "toggle_headings", 
             "toggle_gridlines", "toggle_freeze_panes", 
-            "show_cell", "move_viewport"
+            "show_cell", "move_viewport",
+            "sort_rows", "filter_rows", "clear_view"
         ]
         self.setGui()
         self.bind("<<ActiveCellChanged>>", self.on_active_cell_changed)
         self.bind("<<SelectedCellsChanged>>", self.on_selected_cells_changed)
         self.bind("<<errorReport>>", self.on_error_report)
+        self.bind("<<ImportProgress>>", self.on_import_progress)
+        self.bind("<<ExportProgress>>", self.on_export_progress)
+        self.bind("<Escape>", self.on_cancel_tasks)
+        self.bind("<<SheetsChanged>>", lambda event: self.draw_tabs())
+        self.bind("<Control-f>", lambda event: self.show_findui())
+        self.bind("<F3>", lambda event: self.findui and self.findui.find_next())
+        self.bind("<Shift-F3>", lambda event: self.findui and self.findui.find_next(backwards=True))
         self.geometry("600x400")
 
     def on_active_cell_changed(self, event):
         active_cell = event.widget.active_cell
-        self.activeCell.set(f"Active Cell: {active_cell}")
+        names = self.sheetui.names.at(*active_cell)
+        self.activeCell.set(f"Active Cell: {active_cell}" + (f" in {', '.join(names)}" if names else ""))
+        self.schedule_selection_stats()
 
     def on_selected_cells_changed(self, event):
         selected_cells = event.widget.selected_cells
@@ -1542,6 +2661,85 @@ class SheetViewer(tk.Tk):
         nrows = sel_y1 - sel_y0 + 1
         ncols = sel_x1 - sel_x0 + 1
         self.activeCell.set(f"Selected Cells: {nrows}R x {ncols}C ({sel_x0}, {sel_y0}) to ({sel_x1}, {sel_y1})")
+        self.schedule_selection_stats()
+
+    def schedule_selection_stats(self):
+        """Debounces the selection statistics, they are computed once the selection stops changing."""
+        if self.stats_job is not None:
+            self.after_cancel(self.stats_job)
+        self.stats_job = self.after(STATS_DELAY_MS, self.show_selection_stats)
+
+    def show_selection_stats(self):
+        """Shows Sum/Average/Count/Min/Max of the numeric values in the selected cells."""
+        self.stats_job = None
+        sel_x0, sel_y0, sel_x1, sel_y1 = self.sheetui.selected_cells
+        if (sel_x0, sel_y0) == (sel_x1, sel_y1):
+            self.selStats.config(text="")
+            return
+        total, count, lo, hi = self.sheetui.look.selection_stats(sel_x0, sel_y0, sel_x1, sel_y1)
+        if count:
+            text = f"Sum: {total:,.10g}  Average: {total / count:,.10g}  Count: {count:,}  Min: {lo:,.10g}  Max: {hi:,.10g}"
+        else:
+            text = "Count: 0"
+        self.selStats.config(text=text)
+
+    def on_import_progress(self, event):
+        importer: CsvImporter = event.widget.importer
+        state = "Imported" if not importer.is_alive() else f"Importing {importer.progress():.0%}"
+        self.activeCell.set(f"{state}: {importer.source.nrows:,} rows from {os.path.basename(importer.source.fname)}")
+
+    def on_export_progress(self, event):
+        exporter: CsvExporter = event.widget.exporter
+        if exporter.is_alive():
+            state = f"Exporting {exporter.progress():.0%} (Esc to cancel)"
+        else:
+            state = "Export cancelled" if exporter.cancel_event.is_set() else "Exported"
+        self.activeCell.set(f"{state}: {exporter.nrows:,} rows to {os.path.basename(exporter.fname)}")
+
+    def on_cancel_tasks(self, event):
+        """Cancels the background import/export tasks."""
+        self.sheetui.cancel_import()
+        self.sheetui.cancel_export()
+
+    def draw_tabs(self):
+        """Draws a tab for every sheet of the workbook, plus the button adding a new sheet."""
+        for child in self.tabs.winfo_children():
+            child.destroy()
+        workbook = self.sheetui.workbook
+        self.sheet_name.set(workbook.active)
+        self.activeCell.config(values=sorted(self.sheetui.names))
+        for name in workbook.sheets:
+            tab = ttk.Radiobutton(
+                self.tabs, text=name, value=name, variable=self.sheet_name, style="Toolbutton",
+                command=lambda name=name: self.sheetui.activate_sheet(name)
+            )
+            tab.pack(side="left")
+            tab.bind("<Double-Button-1>", lambda event, name=name: self.rename_sheet(name))
+            tab.bind("<Button-3>", lambda event, name=name: self.remove_sheet(name))
+        ttk.Button(self.tabs, text="+", width=2, command=self.sheetui.add_sheet).pack(side="left")
+
+    def rename_sheet(self, name: str):
+        new_name = simpledialog.askstring("Rename sheet", "Sheet name:", initialvalue=name, parent=self)
+        if new_name and new_name != name:
+            try:
+                self.sheetui.workbook.rename(name, new_name)
+            except ValueError as e:
+                self.activeCell.set(str(e))
+            self.draw_tabs()
+
+    def remove_sheet(self, name: str):
+        try:
+            self.sheetui.remove_sheet(name)
+        except ValueError as e:
+            self.activeCell.set(str(e))
+
+    def show_findui(self):
+        """Opens the Find/Replace window, or raises it if it is already open."""
+        if self.findui is None or not self.findui.winfo_exists():
+            self.findui = FindUI(self, self.sheetui, name='findui')
+        self.findui.deiconify()
+        self.findui.lift()
+        self.findui.query_entry.focus_set()
 
     def on_error_report(self, event):
         widget: SheetUI = event.widget
@@ -1567,7 +2765,7 @@ class SheetViewer(tk.Tk):
                 widget.config(values=sorted(current_values))
                 # The new value is already displayed as it was typed by the user.
                 widget.set(new_value)
-                self.named_range[new_value] = self.sheetui.selected_cells
+                self.sheetui.names.add(new_value, self.sheetui.selected_cells)
         else:
             self.sheetui.set_selected_cells(*new_value)
         self.sheetui.focus_set()
@@ -1592,6 +2790,14 @@ class SheetViewer(tk.Tk):
         cbox.bind("<<ComboboxSelected>>", self.on_combobox_change)  # <-- Bind the event here
         btn = ttk.Button(frame, text="Macros", command=self.show_macrosui)
         btn.pack(side="right")
+        btn = ttk.Button(frame, text="Save", command=self.save_sheet)
+        btn.pack(side="right")
+        btn = ttk.Button(frame, text="Open", command=self.open_sheet)
+        btn.pack(side="right")
+        btn = ttk.Button(frame, text="Export", command=self.export_csv)
+        btn.pack(side="right")
+        btn = ttk.Button(frame, text="Import", command=self.import_csv)
+        btn.pack(side="right")
 
         # self.activeCell = ttk.Label(frame, text="Active Cell: ", background="magenta", font=("Arial", 10))
         # self.activeCell.pack(side="left",expand=True, fill="x", padx=4)
@@ -1601,6 +2807,8 @@ class SheetViewer(tk.Tk):
         cbox.bind("<FocusIn>", self.on_activecell_click)
         cbox.bind("<Button-1>", self.on_activecell_click)
         cbox.bind("<<ComboboxSelected>>", self.on_combobox_change)
+        self.selStats = ttk.Label(frame, name='selstats', font=("Arial", 10))
+        self.selStats.pack(side="left", padx=4)
 
         # Create a frame to hold the canvas and scrollbars
         frame = ttk.Frame(self, name='testfrm')
@@ -1628,19 +2836,88 @@ class SheetViewer(tk.Tk):
         v_scroll.grid(row=0, column=1, sticky="ns")
         h_scroll.grid(row=1, column=0, sticky="ew")
 
+        # Sheet tabs of the workbook
+        self.sheet_name = tk.StringVar(self, value=sheetui.workbook.active)
+        self.tabs = ttk.Frame(self, name='tabsfrm')
+        self.tabs.grid(row=2, column=0, sticky="ew", padx=4)
+        self.draw_tabs()
+
+    def open_sheet(self, fname: str=None):
+        """Opens a worksheet file, restoring its look state and named ranges."""
+        fname = fname or filedialog.askopenfilename(
+            parent=self,
+            title="Open",
+            defaultextension=".wsh",
+            filetypes=[("Worksheet Files", "*.wsh"), ("All Files", "*.*")],
+        )
+        if fname:
+            logging.debug(f"Opening sheet:{fname}")
+            self.sheetui.open_sheet(fname)
+            self.activeCell.config(values=sorted(self.sheetui.names))
+            self.title(os.path.basename(fname))
+        self.sheetui.focus_set()
+
+    def import_csv(self, fname: str=None):
+        """Imports a CSV/TSV file in the background, the sheet can be browsed while it is parsed."""
+        fname = fname or filedialog.askopenfilename(
+            parent=self,
+            title="Import",
+            filetypes=[("CSV Files", "*.csv"), ("TSV Files", "*.tsv *.tab"), ("All Files", "*.*")],
+        )
+        if fname:
+            logging.debug(f"Importing:{fname}")
+            delimiter = '\t' if os.path.splitext(fname)[1].lower() in ('.tsv', '.tab') else ','
+            self.sheetui.import_csv(fname, delimiter=delimiter)
+            self.activeCell.config(values=[])
+            self.title(os.path.basename(fname))
+        self.sheetui.focus_set()
+
+    def export_csv(self, fname: str=None):
+        """Exports the selected cells, or the whole sheet when a single cell is selected, to a CSV/TSV file."""
+        fname = fname or filedialog.asksaveasfilename(
+            parent=self,
+            title="Export",
+            defaultextension=".csv",
+            filetypes=[("CSV Files", "*.csv"), ("TSV Files", "*.tsv *.tab"), ("All Files", "*.*")],
+        )
+        if fname:
+            logging.debug(f"Exporting to:{fname}")
+            delimiter = '\t' if os.path.splitext(fname)[1].lower() in ('.tsv', '.tab') else ','
+            sel_x0, sel_y0, sel_x1, sel_y1 = self.sheetui.selected_cells
+            whole_sheet = (sel_x0, sel_y0) == (sel_x1, sel_y1)
+            self.sheetui.export_csv(fname, delimiter=delimiter, whole_sheet=whole_sheet)
+        self.sheetui.focus_set()
+
+    def save_sheet(self, fname: str=None):
+        """Saves the worksheet and the named ranges to a worksheet file."""
+        fname = fname or filedialog.asksaveasfilename(
+            parent=self,
+            title="Save As",
+            defaultextension=".wsh",
+            filetypes=[("Worksheet Files", "*.wsh"), ("All Files", "*.*")],
+        )
+        if fname:
+            logging.debug(f"Saving sheet to:{fname}")
+            self.sheetui.save_sheet(fname)
+            self.title(os.path.basename(fname))
+        self.sheetui.focus_set()
+
     def show_macrosui(self):
+        self.create_macrosui().mainloop()
+
+    def create_macrosui(self) -> 'MacrosUI':
         self.state("normal")
         self.geometry("600x400+78+78")
         self.action_map = {'self': self, 'logging': logging, 'sheetui': self.sheetui}
-        self.top_child = top_child = MacrosUI(self, name='console', geometry="600x400+680+78", context=self.action_map)
-        top_child.mainloop()
+        self.top_child = MacrosUI(self, name='console', geometry="600x400+680+78", context=self.action_map)
+        return self.top_child
             
     def on_combobox_change(self, event):
         wdg: ttk.Combobox = event.widget
         wdg_name = wdg.winfo_name()
         if wdg_name == 'activecell':
             fname = wdg.get()
-            self.sheetui.set_selected_cells(*self.named_range[fname])
+            self.sheetui.set_selected_cells(*self.sheetui.names[fname])
         else:
             fname = self.cbox.get()
             fnc = getattr(self.sheetui, fname)
@@ -1675,6 +2952,78 @@ class SheetViewer(tk.Tk):
         self.sheetui.focus_set()
 
 
+class FindUI(tk.Toplevel):
+    """Find/Replace window. The matches come from the sheet search index and are selected in the sheet."""
+    def __init__(self, parent, sheetui: SheetUI, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        self.title("Find and Replace")
+        self.resizable(False, False)
+        self.transient(parent)
+        self.sheetui = sheetui
+        self.query = tk.StringVar(self)
+        self.replacement = tk.StringVar(self)
+        self.mode = tk.StringVar(self, value='substring')
+        self.match_case = tk.BooleanVar(self, value=False)
+        self.setGUI()
+        self.bind("<Return>", lambda event: self.find_next())
+        self.bind("<Escape>", lambda event: self.withdraw())
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+
+    def setGUI(self):
+        frame = ttk.Frame(self, padding=4)
+        frame.grid(row=0, column=0, sticky="nsew")
+        ttk.Label(frame, text="Find:").grid(row=0, column=0, sticky="w")
+        self.query_entry = ttk.Entry(frame, textvariable=self.query, width=30)
+        self.query_entry.grid(row=0, column=1, columnspan=3, sticky="ew", padx=4)
+        ttk.Label(frame, text="Replace:").grid(row=1, column=0, sticky="w")
+        entry = ttk.Entry(frame, textvariable=self.replacement, width=30)
+        entry.grid(row=1, column=1, columnspan=3, sticky="ew", padx=4)
+        for ncol, (text, mode) in enumerate((("Substring", 'substring'), ("Whole cell", 'whole'), ("Regex", 'regex'))):
+            ttk.Radiobutton(frame, text=text, value=mode, variable=self.mode).grid(row=2, column=ncol + 1, sticky="w")
+        ttk.Checkbutton(frame, text="Match case", variable=self.match_case).grid(row=3, column=1, sticky="w")
+        btns = ttk.Frame(frame)
+        btns.grid(row=4, column=0, columnspan=4, sticky="e", pady=(4, 0))
+        ttk.Button(btns, text="Find Next", command=self.find_next).pack(side="left")
+        ttk.Button(btns, text="Find All", command=self.find_all).pack(side="left")
+        ttk.Button(btns, text="Replace All", command=self.replace_all).pack(side="left")
+        self.status = ttk.Label(frame, text="", anchor="w")
+        self.status.grid(row=5, column=0, columnspan=4, sticky="ew")
+
+    def search(self, action: Callable, *args, **kwargs):
+        """Runs a search index action with the query, mode and match case of the window."""
+        query, mode, match_case = self.query.get(), self.mode.get(), self.match_case.get()
+        self.status.config(text="")
+        try:
+            return action(query, *args, mode=mode, match_case=match_case, **kwargs)
+        except re.error as e:
+            self.status.config(text=f"Invalid regex: {e}")
+            return None
+
+    def find_next(self, backwards: bool=False):
+        """Selects the next match after the active cell (the previous one if backwards)."""
+        cell = self.search(self.sheetui.find_next_cell, backwards=backwards)
+        if cell is not None:
+            self.status.config(text=f"Found at {cell}")
+            self.sheetui.set_selected_cells(*cell)
+        elif not self.status.cget('text'):
+            self.status.config(text="No matches")
+
+    def find_all(self):
+        """Reports the number of matches and selects the first one."""
+        cells = self.search(self.sheetui.find_cells)
+        if cells is not None:
+            self.status.config(text=f"{len(cells):,} matches")
+            if cells:
+                self.sheetui.set_selected_cells(*cells[0])
+
+    def replace_all(self):
+        """Replaces all the matches and redraws the visible cells changed."""
+        count = self.search(self.sheetui.search.replace_all, self.replacement.get())
+        if count is not None:
+            self.sheetui.redraw_dirty()
+            self.status.config(text=f"{count:,} cells replaced")
+
+
 class MacrosUI(tk.Toplevel):
 
     def __init__(self, parent, geometry="600x400+78+78", context=None, *args, **kwargs):
@@ -1682,6 +3031,13 @@ class MacrosUI(tk.Toplevel):
         self.geometry(geometry)
         self.context = context
         self.f_rec = False
+        self.f_digest = False       # Record the snapshot digest after every step (see snapshot.py)
+        self.digest_job = None
+        self.mismatch = None        # Compact diff of the first step whose snapshot differs from the recorded one
+        self.recorder = EventRing()
+        self.rendered = 0           # Records of the recorder already rendered as text actions
+        self.digests = {}           # Records count -> digest line recorded after them
+        self.status_job = None
         self.action_stack = collections.deque()
         self.action_map = {'self': self, 'logging': logging}
 
@@ -1709,6 +3065,10 @@ class MacrosUI(tk.Toplevel):
         btn.pack(side="left")
         btn = ttk.Button(lframe, text="run", command=lambda: self.action_cmds('run'))
         btn.pack(side="left")
+        chkbtn = ttk.Checkbutton(lframe, name="digest", text="Digest", command=lambda: self.action_cmds('digest'))
+        chkbtn.pack(side="left")
+        btn = ttk.Button(lframe, text="show", command=lambda: self.action_cmds('show'))
+        btn.pack(side="left")
 
         lframe = ttk.LabelFrame(frame, text="Reset", name="reset_actions")
         lframe.pack(side="left", padx=4, pady=4)
@@ -1740,60 +3100,66 @@ class MacrosUI(tk.Toplevel):
         pass
     
     def event_monitor(self, event):
+        """Records the event in the ring buffer. It is rendered as a text action later, see render_events."""
         if self.front_end.event_simulation:
             return
-        wdg = event.widget
-        # wname = f"{wdg.winfo_parent()}.{wdg.winfo_name()}"
-        wname = wdg.winfo_name()
-        sevent = str(event)
-        # Action string
-        sevent = sevent.strip('<>').replace(' event ', ' ')
-        eseq, *kwargs = sevent.split()
-        kwargs = dict(item.split('=') for item in kwargs)
-        if eseq == 'Configure':
-            # Why?
-            # <Configure> is a system event (not a user event like <Button-1> or <KeyPress>).
-            # Tkinter/Tk will ignore attempts to generate it manually.
-            if self.state() == "zoomed":
-                saction = f'self.state("zoomed")'
-            else:
-                saction = f'self.state("normal")\nself.geometry("{self.geometry()}")'
-        else:
-            if eseq in ('ButtonPress', 'ButtonRelease',):
-                eseq = f"{eseq}-{kwargs.pop('num')}"
-            if 'state' in kwargs:
-                mods = ('Shift', 'Lock', 'Control', 
-                        'Mod1', 'Mod2', 'Mod3', 'Mod4', 'Mod5',
-                        'Button1', 'Button2', 'Button3', 'Button4', 'Button5'
-                    )
-                val = []
-                for mod in  kwargs['state'].split('|'):
-                    try:
-                        n = mods.index(mod)
-                        val.append(f"0x{1 << n:05x}")
-                    except ValueError:
-                        val.append(mod)
-                kwargs['state'] = '|'.join(val)
-
-            for key in set(['keysym',]).intersection(kwargs.keys()):
-                kwargs[key] = f"'{kwargs[key]}'"
+        self.recorder.append(record_event(event))
+        if self.status_job is None:
+            self.status_job = self.after(EVENT_RENDER_MS, self.show_record_status)
+        if self.f_digest and self.digest_job is None:
+            # Once the sheetui handlers of the pending events have run
+            self.digest_job = self.after_idle(self.record_digest)
+
+    def show_record_status(self):
+        self.status_job = None
+        if self.recorder.records:
+            record = self.recorder.records[-1]
+            self.nametowidget('errorfrm.txt')['text'] = (
+                f"{self.recorder.total - self.rendered} events to show, last {record.kind} x={record.x} y={record.y}"
+            )
 
-            if 'send_event' in kwargs:
-                kwargs['sendevent'] = kwargs.pop('send_event')
-                
-            kwargs.pop('char', None)
-            
-            kwargs = ', '.join(f'{k}={v}' for k, v in kwargs.items())
-            # saction = f"self.nametowidget('{wname}').event_generate('<{eseq}>', {kwargs})"
-            saction = f"{wname}.event_generate('<{eseq}>', {kwargs})"
-        if not len(self.action_stack):
-            self.action_stack.append('<start/>')
-        self.action_stack.append(saction)
-        # Get widget wit the name 'txt'
-        wdg = self.nametowidget('errorfrm.txt')
-        wdg['text'] = saction.rsplit('.', 1)[-1]
+    def render_events(self):
+        """Renders the records not rendered yet as text actions, in the action stack and the console."""
+        dropped, records = self.recorder.since(self.rendered)
+        if dropped:
+            logging.warning(f"{dropped} events dropped by the recorder ring buffer")
         fend: Frontend = self.front_end
-        fend.input_code(saction, toArchive=True, genOutput=False)
+        count = self.rendered + dropped
+        for record in records:
+            saction = to_action(record)
+            if not len(self.action_stack):
+                self.action_stack.append('<start/>')
+            self.action_stack.append(saction)
+            fend.input_code(saction, toArchive=True, genOutput=False)
+            count += 1
+            if (line := self.digests.pop(count, None)) is not None:
+                self.action_stack.append(line)
+                fend.input_code(line, toArchive=True, genOutput=False)
+        self.rendered = self.recorder.total
+        if records:
+            self.nametowidget('errorfrm.txt')['text'] = saction.rsplit('.', 1)[-1]
+
+    def record_digest(self):
+        """Appends the snapshot of the sheetui to the macro, as a digest line after the last action."""
+        self.digest_job = None
+        sheetui = self.nametowidget(self.winfo_parent()).sheetui
+        line = sheetui.snapshot().to_line()
+        if self.f_rec:
+            # Rendered with the events recorded so far
+            self.digests[self.recorder.total] = line
+            return
+        self.action_stack.append(line)
+        self.front_end.input_code(line, toArchive=True, genOutput=False)
+
+    def check_digest(self, line: str):
+        """Compares the snapshot of the sheetui with the digest line, keeping the diff of the first mismatch."""
+        sheetui = self.nametowidget(self.winfo_parent()).sheetui
+        sheetui.update_idletasks()
+        recorded = Snapshot.from_line(line)
+        snapshot = sheetui.snapshot()
+        if snapshot.digest != recorded.digest and self.mismatch is None:
+            self.mismatch = snapshot.diff(recorded) or ["digest"]
+            logging.warning("Snapshot mismatch:\n" + '\n'.join(self.mismatch))
 
     def action_cmds(self, cmd):
         parent = self.nametowidget(self.winfo_parent())
@@ -1805,11 +3171,15 @@ class MacrosUI(tk.Toplevel):
                 parent=self,
                 title="Save As", 
                 defaultextension=".tx",
-                filetypes=[("Macro Files", "*.txt"), ("All Files", "*.*")],
+                filetypes=[("Macro Files", "*.txt"), ("Event records", "*.jsonl *.evb"), ("All Files", "*.*")],
                 initialdir=os.path.join(os.getcwd(), "macros"),
                 initialfile="current_bug.txt"
             )
-            if fname:
+            if fname and fname.endswith(('.jsonl', '.evb')):
+                logging.debug(f"Saving {len(self.recorder)} events to:{fname}")
+                (save_jsonl if fname.endswith('.jsonl') else save_binary)(fname, self.recorder)
+            elif fname:
+                self.render_events()
                 if self.f_rec:
                     wdg = self.nametowidget('actionfrm.recorder_actions.rec')
                     # wdg.click()
@@ -1842,16 +3212,11 @@ class MacrosUI(tk.Toplevel):
                 title="Open",
                 defaultextension=".txt",
                 initialfile="current_bug.txt",
-                filetypes=[("Macro Files", "*.txt"), ("All Files", "*.*")],
+                filetypes=[("Macro Files", "*.txt"), ("Event records", "*.jsonl *.evb"), ("All Files", "*.*")],
                 initialdir=os.path.join(idir, "macros"),
             )
             if fname:
-                # Load your data from 'filename'
-                logging.debug(f"Loading from:{fname}")
-                with open(fname, "r") as f:
-                    content = ['<start/>'] + f.readlines()
-                self.action_stack = collections.deque(content)
-                self.nametowidget('errorfrm.txt')['text'] = content[0].strip()
+                self.load_macro(fname)
         elif cmd == 'rec':
             wdg = self.nametowidget('actionfrm.recorder_actions.rec')
             self.f_rec = not self.f_rec
@@ -1868,22 +3233,32 @@ class MacrosUI(tk.Toplevel):
                     bnd_cb = bnd_cb.split('\n\n')[1]
                     sheetui.bind(bind, bnd_cb)
                 wdg['text'] = "Rec"
+                self.render_events()
             pass
+        elif cmd == 'digest':
+            self.f_digest = not self.f_digest
+        elif cmd == 'show':
+            self.render_events()
         elif cmd == 'run':
+            self.mismatch = None
             while True:
                 self.action_cmds('step')
-                if (action := self.action_stack[0].strip()) == '<start/>':
+                if self.mismatch or (action := self.action_stack[0].strip()) == '<start/>':
                     break
             self.action_map = {'self': self, 'logging': logging}
         elif cmd == 'step':
             if (action := self.action_stack[0]).strip() == '<start/>':
                 self.action_map = {'self': self, 'logging': logging}
+                self.mismatch = None
                 self.action_stack.append(self.action_stack.popleft())
             comment = ''
             while True:
                 action = self.action_stack[0]
                 self.action_stack.append(self.action_stack.popleft())
                 action = action.rstrip()
+                if action.startswith(DIGEST_PREFIX):
+                    self.check_digest(action)
+                    continue
                 # Comments skipped (allowed as a complete line).
                 if action: 
                     if action[0] != '#':
@@ -1906,7 +3281,17 @@ class MacrosUI(tk.Toplevel):
             self.front_end.event_simulation = True
             self.front_end.input_code(action, toArchive=True)
             self.front_end.event_simulation = False
-            self.nametowidget('errorfrm.txt')['text'] = self.action_stack[0].strip()
+            # The digest lines after the action hold the snapshot recorded once it ran
+            if self.action_stack[0].startswith(DIGEST_PREFIX):
+                while self.action_stack[0].startswith(DIGEST_PREFIX):
+                    self.check_digest(self.action_stack[0].rstrip())
+                    self.action_stack.append(self.action_stack.popleft())
+            elif self.f_digest:
+                self.record_digest()
+            if self.mismatch:
+                self.nametowidget('errorfrm.txt')['text'] = f"Snapshot mismatch: {'; '.join(self.mismatch)}"
+            else:
+                self.nametowidget('errorfrm.txt')['text'] = self.action_stack[0].strip()
         elif cmd == 'reset_sheet':
             # Put the canvas in a clean slate
             # self.action_stack = []
@@ -1922,12 +3307,32 @@ class MacrosUI(tk.Toplevel):
         elif cmd == 'reset_stack':
             # Reset the action stack
             self.action_stack = collections.deque()
+            self.recorder.clear()
+            self.rendered = 0
+            self.digests.clear()
             self.nametowidget('errorfrm.txt')['text'] = "...."
         elif cmd == 'reset_history':
             # Reset the action history
             self.front_end.reset_history()
             self.nametowidget('errorfrm.txt')['text'] = "...."
 
+    def load_macro(self, fname: str):
+        """Loads the macro file in the action stack, ready to step or run from its start. The event records
+        files (.jsonl, .evb) are loaded in the recorder too."""
+        logging.debug(f"Loading from:{fname}")
+        if fname.endswith(('.jsonl', '.evb')):
+            records = (load_jsonl if fname.endswith('.jsonl') else load_binary)(fname)
+            self.recorder.clear()
+            self.recorder.extend(records)
+            self.digests.clear()
+            self.rendered = self.recorder.total
+            content = ['<start/>'] + list(map(to_action, records))
+        else:
+            with open(fname, "r") as f:
+                content = ['<start/>'] + f.readlines()
+        self.action_stack = collections.deque(content)
+        self.nametowidget('errorfrm.txt')['text'] = content[0].strip()
+
     def destroy(self):
         parent = self.nametowidget(self.winfo_parent())
         parent.top_child = None
@@ -0,0 +1,18 @@
+import pytest
+
+from worksheetui import HeadlessSheetUI
+
+
+@pytest.fixture
+def make_ui():
+    """Returns a factory of headless sheets drawn in an 800x600 canvas."""
+    def make_ui() -> HeadlessSheetUI:
+        ui = HeadlessSheetUI(800, 600)
+        ui.redraw_sheet(width=800, height=600)
+        return ui
+    return make_ui
+
+
+@pytest.fixture
+def ui(make_ui) -> HeadlessSheetUI:
+    return make_ui()
@@ -0,0 +1,79 @@
+import random
+
+import aggregates
+from aggregates import AggregateIndex, summarize
+from formulas import FormulaEngine
+from sheetstore import SheetStore
+
+
+def brute_force(store, x0, y0, x1, y1, engine=None):
+    values = []
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            value = store.get(x, y)
+            values.append(engine.value(x, y) if engine and isinstance(value, str) and value.startswith('=') else value)
+    total, count, lo, hi = summarize(values)
+    return (total, count, lo, hi) if count else (0, 0, None, None)
+
+
+def test_queries_match_a_scan(monkeypatch):
+    monkeypatch.setattr(aggregates, 'AGG_BLOCK', 8)
+    rnd = random.Random(3)
+    store = SheetStore()
+    store.set_block(1, 1, [[rnd.choice([rnd.randint(-50, 50), 'text', None, '4.5']) for x in range(3)]
+                           for y in range(200)])
+    index = AggregateIndex(store)
+    for _ in range(100):
+        y0 = rnd.randint(1, 200)
+        area = (rnd.randint(1, 3), y0, 3, rnd.randint(y0, 200))
+        assert index.query(*area) == brute_force(store, *area)
+    # Writes mark their blocks dirty
+    store.set(2, 50, 1000)
+    store.set_block(1, 60, [[-1000], [None]])
+    assert index.query(1, 1, 3, 200) == brute_force(store, 1, 1, 3, 200)
+
+
+def test_formula_values_are_aggregated():
+    store = SheetStore()
+    engine = FormulaEngine(store)
+    index = AggregateIndex(store, engine)
+    store.set_block(1, 1, [[1], [2], ['=C1R1+C1R2'], ['=1/0']])
+    assert index.query(1, 1, 1, 4) == (6, 3, 1, 3)
+    store.set(1, 1, 10)
+    assert index.query(1, 1, 1, 4) == (24, 3, 2, 12)
+
+
+def test_empty_range():
+    store = SheetStore()
+    store.set(1, 1, 'text')
+    assert AggregateIndex(store).query(1, 1, 5, 5) == (0, 0, None, None)
+
+
+def test_summaries_are_kept_across_appends_and_structural_edits(monkeypatch):
+    monkeypatch.setattr(aggregates, 'AGG_BLOCK', 8)
+    rnd = random.Random(4)
+    store = SheetStore()
+    store.set_block(1, 1, [[rnd.randint(-50, 50), rnd.randint(0, 9)] for y in range(200)])
+    index = AggregateIndex(store)
+    assert index.query(1, 1, 2, 200) == brute_force(store, 1, 1, 2, 200)
+    summaries = []
+    block_summary = index.block_summary
+    monkeypatch.setattr(index, 'block_summary', lambda *args: summaries.append(args) or block_summary(*args))
+    column = index.columns[1]
+    # A write below the last row only summarizes the blocks from the old last one on
+    store.set(1, 230, 1000)
+    assert index.query(1, 1, 1, 230) == brute_force(store, 1, 1, 1, 230)
+    assert index.columns[1] is column and len(summaries) == 5
+    # Row edits refresh the blocks from the edit on
+    summaries.clear()
+    store.insert_rows(180, 181)
+    store.delete_rows(10, 10)
+    assert index.query(1, 1, 2, 231) == brute_force(store, 1, 1, 2, 231)
+    assert len(summaries) == 2 * 28        # Blocks 1 to 28 of both columns
+    # Column edits shift the summaries
+    summaries.clear()
+    store.insert_columns(1, 1)
+    assert index.query(2, 1, 3, 231) == brute_force(store, 2, 1, 3, 231)
+    store.delete_columns(2, 2)
+    assert index.query(2, 1, 2, 231) == brute_force(store, 2, 1, 2, 231)
+    assert not summaries
@@ -0,0 +1,69 @@
+import autofit
+from autofit import LongestValues
+from sheetstore import SheetStore
+from worksheetui import CELL_HEIGHT
+
+
+def row_height(ui, y: int) -> int:
+    return ui.look.headings_dim.get(f"R{y}", CELL_HEIGHT)
+
+
+def test_autofit_rows_fits_multiline_cells(ui):
+    ui.store.set_block(1, 1, [['one'], ['two\nlines'], ['three\nlines\nhere']])
+    ui.selected_cells = (1, 1, 1, 3)
+    ui.autofit_rows()
+    assert row_height(ui, 1) == CELL_HEIGHT
+    assert CELL_HEIGHT < row_height(ui, 2) < row_height(ui, 3)
+    ui.undo()
+    assert [row_height(ui, y) for y in (1, 2, 3)] == [CELL_HEIGHT] * 3
+
+
+def test_autofit_rows_samples_large_selections(ui, monkeypatch):
+    import worksheetui
+    monkeypatch.setattr(worksheetui, 'AUTOFIT_ROWS', 100)
+    rows = [['x'] for _ in range(5000)]
+    rows[3000] = ['a long\nvalue\nin three lines']
+    ui.store.set_block(1, 1, rows)
+    ui.look.set_dimension(4000, 4000, 40, axis=1)
+    ui.selected_cells = (1, 1, 1, 5000)
+    ui.autofit_rows()
+    # The row of the longest value is measured, an unsampled row keeps its height
+    assert row_height(ui, 3001) > CELL_HEIGHT
+    assert row_height(ui, 4000) == 40
+
+
+def test_autofit_columns_fits_the_longest_value(ui):
+    ui.store.set_block(1, 1, [['short'], ['a much longer value than the others']])
+    ui.selected_cells = (1, 1, 1, 2)
+    ui.autofit_columns()
+    assert ui.look.headings_dim["C1"] > ui.text_measure.width(None, 'short')
+
+
+def test_longest_values_are_kept_across_appends_and_structural_edits(monkeypatch):
+    monkeypatch.setattr(autofit, 'AUTOFIT_BLOCK', 8)
+    monkeypatch.setattr(autofit, 'AUTOFIT_TOP', 2)
+    store = SheetStore()
+    store.set_block(1, 1, [['x' * (y % 7), 'y'] for y in range(1, 201)])
+    index = LongestValues(store)
+    assert len(index.longest(1)) == 2
+    ranked = []
+    block_longest = index.block_longest
+    monkeypatch.setattr(index, 'block_longest', lambda *args: ranked.append(args) or block_longest(*args))
+    column = index.columns[1]
+    # A write below the last row only ranks the blocks from the old last one on
+    store.set(1, 230, 'z' * 20)
+    assert index.longest(1)[0] == 230
+    assert index.columns[1] is column and len(ranked) == 5
+    # Row edits rank again the blocks from the edit on
+    ranked.clear()
+    store.insert_rows(180, 181)
+    store.delete_rows(10, 10)
+    assert index.longest(1)[0] == 231
+    assert len(ranked) == 28
+    # Column edits shift the columns
+    ranked.clear()
+    store.insert_columns(1, 1)
+    assert index.longest(2)[0] == 231
+    store.delete_columns(1, 1)
+    assert index.longest(1)[0] == 231
+    assert not ranked
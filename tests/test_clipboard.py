@@ -0,0 +1,27 @@
+import worksheetui
+
+
+def test_copy_is_appended_in_chunks(ui, monkeypatch):
+    monkeypatch.setattr(worksheetui, 'CLIPBOARD_ROWS', 2)
+    ui.store.set_block(1, 1, [['a', 1], ['b', '=C2R1*2'], ['c', 3], ['d', 4], ['e', 5]])
+    done = []
+    ui.bind("<<CopyDone>>", done.append)
+    ui.set_selected_cells(1, 1, 2, 5)
+    ui.copy_cells()
+    assert ui.clipboard == ""
+    ui.update()
+    assert ui.clipboard.splitlines() == ['a\t1', 'b\t2', 'c\t3', 'd\t4', 'e\t5']
+    assert done
+
+
+def test_paste_writes_one_undoable_block(ui):
+    ui.store.set_block(1, 1, [['old']])
+    ui.clipboard = 'x\t1\ny\t2.5\n'
+    ui.set_selected_cells(1, 1)
+    ui.paste_cells()
+    ui.paster.join()
+    ui.update()
+    assert [[ui.store.get(x, y) for x in (1, 2)] for y in (1, 2)] == [['x', 1], ['y', 2.5]]
+    assert ui.selected_cells == (1, 1, 2, 2)
+    ui.undo()
+    assert [[ui.store.get(x, y) for x in (1, 2)] for y in (1, 2)] == [['old', None], [None, None]]
@@ -0,0 +1,63 @@
+import json
+
+from conditional import ConditionalFormats, Rule, blend
+from formulas import FormulaEngine
+from sheetstore import SheetStore
+
+
+def sheet():
+    store = SheetStore()
+    engine = FormulaEngine(store)
+    store.set_block(1, 1, [[1], [5], [10], ['=C1R1*3'], ['text']])
+    return store, engine, ConditionalFormats(store, engine)
+
+
+def test_threshold_and_between():
+    store, engine, formats = sheet()
+    formats.add(Rule('threshold', (1, 1, 1, 5), '>', 4))
+    formats.add(Rule('threshold', (1, 1, 1, 5), 'between', 0, 2, background='#000000', fill='#ffffff'))
+    assert formats.format(1, 1, 1) == dict(background='#000000', fill='#ffffff')
+    assert formats.format(1, 2, 5) == dict(background='#ffc7ce')
+    assert formats.format(1, 5, 'text') == {}
+    assert formats.format(2, 2, 5) == {}
+
+
+def test_scale_follows_writes_and_recalcs():
+    store, engine, formats = sheet()
+    rid = formats.add(Rule('scale', (1, 1, 1, 5), colors=('#000000', '#ffffff')))
+    assert formats.range_stats(rid) == (1, 10)
+    assert formats.format(1, 3, 10) == dict(background='#ffffff')
+    assert formats.format(1, 1, 1) == dict(background='#000000')
+    store.set(1, 3, 100)
+    assert formats.range_stats(rid) == (1, 100)
+    store.set(1, 1, 50)
+    assert formats.range_stats(rid) == (5, 150)
+    assert formats.depends(1, 2, 1, 2) == [(1, 1, 1, 5)]
+    # Quantized to CF_SCALE_STEPS colours
+    assert blend('#000000', '#ffffff', 0.5) == blend('#000000', '#ffffff', 0.51) == '#848484'
+
+
+def test_duplicates_counts_are_updated_cell_by_cell():
+    store, engine, formats = sheet()
+    store.set_block(2, 1, [['a'], ['A'], [3], ['3'], ['b']])
+    rid = formats.add(Rule('duplicates', (2, 1, 2, 5)))
+    assert [bool(formats.format(2, y, None)) for y in range(1, 6)] == [True, True, True, True, False]
+    store.set(2, 2, 'b')
+    assert [bool(formats.format(2, y, None)) for y in range(1, 6)] == [False, True, True, True, True]
+    assert rid in formats.counts
+
+
+def test_rules_shift_and_undo_restores_clipped():
+    store, engine, formats = sheet()
+    rid = formats.add(Rule('threshold', (1, 2, 1, 4)))
+    store.insert_rows(1, 2)
+    assert formats.rules[rid].rect == (1, 4, 1, 6)
+    store.delete_rows(5, 10)
+    assert formats.rules[rid].rect == (1, 4, 1, 4)
+    clipped = formats.clipped
+    assert clipped == [(rid, Rule('threshold', (1, 4, 1, 6)))]
+    formats.restore(clipped)
+    assert formats.rules[rid].rect == (1, 4, 1, 6)
+    loaded = ConditionalFormats(SheetStore())
+    loaded.load(json.loads(json.dumps(formats.to_list())))
+    assert loaded.rules == formats.rules
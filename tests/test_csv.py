@@ -0,0 +1,98 @@
+import csv
+import threading
+
+from sheetio import CsvImporter, TsvParser, tsv_chunks
+from sheetstore import SheetStore
+
+
+def read_csv(fname, delimiter=','):
+    with open(fname, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f, delimiter=delimiter))
+
+
+def test_import_csv(tmp_path):
+    fname = tmp_path / 'data.csv'
+    fname.write_text('a,b,c\n1,"x, y",3\n"multi\nline",,6\n', encoding='utf-8')
+    importer = CsvImporter(str(fname))
+    importer.start()
+    importer.join()
+    assert importer.error is None
+    source = importer.source
+    assert (source.ncols, source.nrows) == (3, 3)
+    store = SheetStore(base=source)
+    assert [store.get(x, 2) for x in (1, 2, 3)] == ['1', 'x, y', '3']
+    assert store.get(1, 3) == 'multi\nline'
+    assert store.get(2, 3) in (None, '')
+    source.close()
+
+
+def test_bom_is_skipped_when_a_block_is_read_again(tmp_path):
+    fname = tmp_path / 'bom.csv'
+    fname.write_bytes(b'\xef\xbb\xbfa,b\n1,2\n')
+    importer = CsvImporter(str(fname))
+    importer.run()
+    source = importer.source
+    source.release()
+    assert source.get(1, 1) == 'a' and source.get(2, 2) == '2'
+    source.close()
+
+
+def test_export_writes_displayed_values_in_view_order(ui, tmp_path, monkeypatch):
+    ui.store.set_block(1, 1, [[3, '=C1R1*10'], [1, '=C1R2*10'], [2, '=C1R3*10']])
+    ui.sort_rows(1)
+    # The values are read on the Tk thread, the exporter thread only writes them
+    threads = set()
+    value = ui.formulas.value
+    monkeypatch.setattr(ui.formulas, 'value', lambda *args: threads.add(threading.current_thread()) or value(*args))
+    fname = str(tmp_path / 'out.csv')
+    exporter = ui.export_csv(fname, whole_sheet=True)
+    ui.update()
+    exporter.join()
+    assert threads == {threading.current_thread()}
+    assert ui.exporter.error is None
+    assert read_csv(fname) == [['1', '10'], ['2', '20'], ['3', '30']]
+    assert ui.exporter.progress() == 1.0
+
+
+def test_export_selection_tsv(ui, tmp_path):
+    ui.store.set_block(1, 1, [['a', 'b', 'c'], ['d', None, '=1/0'], ['g', 'h', 'i']])
+    ui.selected_cells = (2, 2, 3, 3)
+    fname = str(tmp_path / 'out.tsv')
+    exporter = ui.export_csv(fname, delimiter='\t')
+    ui.update()
+    exporter.join()
+    assert read_csv(fname, delimiter='\t') == [['', '#DIV/0!'], ['h', 'i']]
+
+
+def test_cancelled_export_leaves_no_file(ui, tmp_path):
+    ui.store.set_block(1, 1, [['a'], ['b']])
+    fname = tmp_path / 'out.csv'
+    exporter = ui.export_csv(str(fname), whole_sheet=True)
+    exporter.cancel()
+    ui.update()
+    exporter.join(5)
+    assert not exporter.is_alive() and exporter.error is None
+    assert not fname.exists() and not (tmp_path / 'out.csv.tmp').exists()
+
+
+def test_export_import_round_trip(ui, tmp_path):
+    rows = [['name', 'text'], ['quote', 'say "hi"'], ['comma', 'a, b'], ['newline', 'one\ntwo']]
+    ui.store.set_block(1, 1, rows)
+    fname = str(tmp_path / 'out.csv')
+    exporter = ui.export_csv(fname, whole_sheet=True)
+    ui.update()
+    exporter.join()
+    importer = CsvImporter(fname)
+    importer.run()
+    store = SheetStore(base=importer.source)
+    assert [[store.get(x, y) for x in (1, 2)] for y in range(1, 5)] == rows
+    importer.source.close()
+
+
+def test_tsv_clipboard_round_trip():
+    rows = [['a', None, 'tab\there'], ['1', '2', 'line\nbreak']]
+    text = ''.join(tsv_chunks([rows]))
+    parser = TsvParser(text)
+    parser.run()
+    # Numeric text is pasted as numbers
+    assert parser.rows == [['a', None, 'tab\there'], [1, 2, 'line\nbreak']]
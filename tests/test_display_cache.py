@@ -0,0 +1,45 @@
+import sys
+
+from worksheetui import DisplayCache
+
+
+def test_lru_eviction_by_entries():
+    cache = DisplayCache(max_entries=2, max_bytes=1 << 20)
+    cache.put(1, 1, 'a')
+    cache.put(1, 2, 'b')
+    assert cache.get(1, 1) == 'a'
+    cache.put(1, 3, 'c')
+    assert cache.get(1, 2) is None
+    assert (cache.get(1, 1), cache.get(1, 3)) == ('a', 'c')
+    stats = cache.stats()
+    assert (stats['entries'], stats['evictions'], stats['hits'], stats['misses']) == (2, 1, 3, 1)
+
+
+def test_eviction_by_bytes():
+    value = 'x' * 100
+    cache = DisplayCache(max_entries=100, max_bytes=2 * sys.getsizeof(value))
+    for y in range(1, 4):
+        cache.put(1, y, value)
+    assert len(cache) == 2 and cache.nbytes == 2 * sys.getsizeof(value)
+
+
+def test_invalidation():
+    cache = DisplayCache()
+    for x in range(1, 4):
+        for y in range(1, 4):
+            cache.put(x, y, f"{x},{y}")
+    cache.invalidate_cell(2, 2)
+    assert cache.get(2, 2) is None
+    cache.invalidate_range(1, 1, 2, 3)
+    assert len(cache) == 3 and cache.get(3, 1) == '3,1'
+    cache.invalidate_all()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_store_writes_invalidate_the_sheet_cache(ui):
+    ui.store.set_block(1, 1, [[1, '=C1R1*2']])
+    ui.redraw_sheet(width=800, height=600)
+    ui.look.display_cache.put(2, 1, 'stale')
+    ui.set_cell(1, 1, '5')
+    assert ui.look.display_cache.get(2, 1) != 'stale'
+    assert ui.formulas.value(2, 1) == 10
@@ -0,0 +1,38 @@
+import pytest
+
+from eventrec import EventRecord, EventRing, load_binary, load_jsonl, save_binary, save_jsonl, to_action
+
+RECORDS = [
+    EventRecord('ButtonPress', '.sheet.canvas', 10, 20, num=1, time=1.5),
+    EventRecord('KeyPress', '.sheet.canvas', 3, 4, state=0x4, keysym='ñ', time=2.25),
+    EventRecord('MouseWheel', '.sheet.canvas', delta=-120, time=3.0),
+    EventRecord('Configure', '.', 5, 6, width=800, height=600, time=4.0),
+]
+
+
+def test_ring_since_reports_dropped_records():
+    ring = EventRing(3)
+    ring.extend(RECORDS[:2])
+    count = ring.total
+    assert ring.since(count) == (0, [])
+    ring.extend(RECORDS[2:] + RECORDS[:1])
+    assert len(ring) == 3 and ring.total == 5
+    assert ring.since(count) == (0, RECORDS[2:] + RECORDS[:1])
+    assert ring.since(0) == (2, list(ring))
+
+
+def test_jsonl_and_binary_round_trip(tmp_path):
+    save_jsonl(tmp_path / 'events.jsonl', RECORDS)
+    assert load_jsonl(tmp_path / 'events.jsonl') == RECORDS
+    save_binary(tmp_path / 'events.evb', RECORDS)
+    assert load_binary(tmp_path / 'events.evb') == RECORDS
+    (tmp_path / 'bad.evb').write_bytes(b'NOTEVENT' + bytes(12))
+    with pytest.raises(ValueError):
+        load_binary(tmp_path / 'bad.evb')
+
+
+def test_actions():
+    assert to_action(RECORDS[0]) == "canvas.event_generate('<ButtonPress-1>', x=10, y=20)"
+    assert to_action(RECORDS[1]) == "canvas.event_generate('<KeyPress>', state=0x00004, keysym='ñ', x=3, y=4)"
+    assert to_action(RECORDS[3]).endswith('self.geometry("800x600+5+6")')
+    assert to_action(RECORDS[3]._replace(state=1)) == 'self.state("zoomed")'
@@ -0,0 +1,168 @@
+from formulas import FormulaEngine
+from sheetstore import SheetStore
+
+
+def make_engine(cells: dict) -> tuple[SheetStore, FormulaEngine]:
+    store = SheetStore()
+    engine = FormulaEngine(store)
+    for (x, y), value in cells.items():
+        store.set(x, y, value)
+    return store, engine
+
+
+def test_references_and_recalc():
+    store, engine = make_engine({(1, 1): 2, (1, 2): '=C1R1*3', (1, 3): '=C1R2+C1R1'})
+    assert engine.value(1, 2) == 6
+    assert engine.value(1, 3) == 8
+    store.set(1, 1, 10)
+    assert engine.value(1, 2) == 30
+    assert engine.value(1, 3) == 40
+
+
+def test_range_functions():
+    store, engine = make_engine({(1, 1): 1, (1, 2): 2, (1, 3): '3', (2, 1): '=SUM(C1R1:C1R3)'})
+    assert engine.value(2, 1) == 6
+    store.set(1, 2, 5)
+    assert engine.value(2, 1) == 9
+
+
+def test_error_values():
+    store, engine = make_engine({(1, 1): '=1/0', (1, 2): '=C1R1+1', (1, 3): '=FOO(1)'})
+    assert engine.value(1, 1) == '#DIV/0!'
+    assert engine.value(1, 2) == '#DIV/0!'
+    assert engine.value(1, 3) == '#NAME?'
+
+
+def test_bare_range_is_value_error():
+    store, engine = make_engine({(1, 1): 1, (1, 2): 2, (2, 1): '=C1R1:C1R2'})
+    assert engine.value(2, 1) == '#VALUE!'
+
+
+def test_text_starting_with_hash_is_not_an_error():
+    store, engine = make_engine({(1, 1): '#tag', (1, 2): '=C1R1', (1, 3): '=C1R2'})
+    assert engine.value(1, 2) == '#tag'
+    assert engine.value(1, 3) == '#tag'
+
+
+def test_cycle():
+    store, engine = make_engine({(1, 1): '=C1R2', (1, 2): '=C1R1'})
+    assert engine.value(1, 1) == '#CYCLE!'
+
+
+def test_delete_referenced_row_reads_ref_error():
+    store, engine = make_engine({(1, 1): 5, (1, 2): '=C1R1+1', (1, 3): '=C1R2*2'})
+    store.delete_rows(1, 1)
+    assert store.get(1, 1) == '=#REF!+1'
+    assert engine.value(1, 1) == '#REF!'
+    assert engine.value(1, 2) == '#REF!'
+    assert engine.clipped == [((1, 2), '=C1R1+1')]
+    # The clipped formula keeps reading #REF! after further structural edits
+    store.insert_rows(1, 1)
+    assert store.get(1, 2) == '=#REF!+1'
+    assert engine.value(1, 2) == '#REF!'
+    assert engine.value(1, 3) == '#REF!'
+
+
+def count_evaluations(engine: FormulaEngine) -> list:
+    evaluated = []
+    evaluate = engine.evaluate
+    engine.evaluate = lambda cell: evaluated.append(cell) or evaluate(cell)
+    return evaluated
+
+
+def test_insert_rows_moves_formulas_and_references():
+    store, engine = make_engine({(1, 1): 1, (1, 2): 2, (1, 3): 3,
+                                 (2, 1): '=C1R1*10', (2, 3): '=C1R3+C2R1', (2, 4): '=SUM(C1R1:C1R3)'})
+    evaluated = count_evaluations(engine)
+    store.insert_rows(2, 3)
+    assert store.get(2, 1) == '=C1R1*10'
+    assert store.get(2, 5) == '=C1R5+C2R1'
+    assert store.get(2, 6) == '=SUM(C1R1:C1R5)'
+    assert (engine.value(2, 1), engine.value(2, 5), engine.value(2, 6)) == (10, 13, 6)
+    # Only the formula whose range grew is recalculated
+    assert evaluated == [(2, 6)]
+    store.set(1, 5, 30)
+    assert (engine.value(2, 5), engine.value(2, 6)) == (40, 33)
+
+
+def test_insert_after_formulas_keeps_them():
+    store, engine = make_engine({(1, 1): 1, (2, 1): '=C1R1+1'})
+    evaluated = count_evaluations(engine)
+    store.insert_rows(5, 5)
+    store.insert_columns(3, 3)
+    assert store.get(2, 1) == '=C1R1+1'
+    assert engine.value(2, 1) == 2
+    assert evaluated == []
+
+
+def test_delete_rows_inside_range_recalculates_dependents():
+    store, engine = make_engine({(1, 1): 1, (1, 2): 2, (1, 3): 3, (1, 4): '=SUM(C1R1:C1R3)', (1, 5): '=C1R4*2'})
+    store.delete_rows(2, 2)
+    assert store.get(1, 3) == '=SUM(C1R1:C1R2)'
+    assert store.get(1, 4) == '=C1R3*2'
+    assert (engine.value(1, 3), engine.value(1, 4)) == (4, 8)
+    assert engine.clipped == []
+    assert engine.value(1, 5) is None
+
+
+def test_delete_columns_moves_formulas():
+    store, engine = make_engine({(1, 1): 1, (3, 1): 2, (4, 1): '=C1R1+C3R1'})
+    store.delete_columns(2, 2)
+    assert store.get(3, 1) == '=C1R1+C2R1'
+    assert engine.value(3, 1) == 3
+    store.set(2, 1, 5)
+    assert engine.value(3, 1) == 6
+
+
+def test_unary_minus_binds_tighter_than_power():
+    store, engine = make_engine({
+        (1, 1): 3, (2, 1): '=-2^2', (2, 2): '=2^-2', (2, 3): '=-C1R1^2', (2, 4): '=-(1+2)^2',
+        (2, 5): '=2*-3^2', (2, 6): '=1-2^2', (2, 7): '=-SUM(C1R1:C1R1)^2', (2, 8): '=--2', (2, 9): '=-50%',
+    })
+    assert [engine.value(2, y) for y in range(1, 10)] == [4, 0.25, 9, 9, 18, -3, 9, 2, -0.5]
+
+
+def test_evaluate_batch_marks_only_error_values():
+    from formulas import ErrorValue, compile_formula, evaluate_batch
+    cells = {(2, 1): '=C1R1', (2, 2): '=C2R1', (2, 3): '=1/0', (2, 4): '=C2R3+1'}
+    batch = [(cell, compile_formula(text, cell)[0].template) for cell, text in cells.items()]
+    values = evaluate_batch(batch, {(1, 1): '#tag'})
+    assert values == ['#tag', '#tag', '#DIV/0!', '#DIV/0!']
+    assert [isinstance(value, ErrorValue) for value in values] == [False, False, True, True]
+
+
+def test_copied_formulas_share_one_compiled_template():
+    from formulas import compile_formula, compile_template
+    fnc, refs, ranges = compile_formula('=C1R1+SUM(C2R1:C2R3)', (3, 1))
+    copied, copied_refs, copied_ranges = compile_formula('=C1R5+SUM(C2R5:C2R7)', (3, 5))
+    assert copied is fnc
+    assert (refs, copied_refs) == ({(1, 1)}, {(1, 5)})
+    assert copied_ranges == [(2, 5, 2, 7)]
+    assert compile_template.cache_info().hits > 0
+    # Different relative references compile apart; invalid formulas have no template
+    assert compile_formula('=C1R1+SUM(C2R1:C2R3)', (3, 5))[0] is not fnc
+    assert compile_formula('=NOPE(1)', (1, 1))[0].template is None
+
+
+def test_reversed_range_bounds_survive_a_shift():
+    store, engine = make_engine({(1, 1): 5, (1, 2): 7, (2, 6): '=SUM(C1R2:C1R1)'})
+    assert engine.value(2, 6) == 12
+    store.insert_rows(5, 5)
+    assert store.get(2, 7) == '=SUM(C1R1:C1R2)' and engine.value(2, 7) == 12
+    store.insert_rows(2, 2)
+    assert store.get(2, 8) == '=SUM(C1R1:C1R3)' and engine.value(2, 8) == 12
+
+
+def test_commas_outside_calls_are_errors():
+    store, engine = make_engine({(1, 1): '=1,2', (1, 2): '=(1,2)', (1, 3): '=()', (1, 4): '=SUM((1),2)'})
+    assert [engine.value(1, y) for y in (1, 2, 3)] == ['#ERROR!'] * 3
+    assert engine.value(1, 4) == 3
+
+
+def test_powers_overflow_to_num():
+    store, engine = make_engine({(1, 1): '=9^9^9', (1, 2): '=10^400', (1, 3): '=2^10', (1, 4): '=2^0.5',
+                                 (1, 5): '=(-8)^(1/3)', (1, 6): '=0^-1'})
+    assert [engine.value(1, y) for y in (1, 2)] == ['#NUM!', '#NUM!']
+    assert engine.value(1, 3) == 1024 and isinstance(engine.value(1, 3), int)
+    assert engine.value(1, 4) == 2 ** 0.5
+    assert (engine.value(1, 5), engine.value(1, 6)) == ('#NUM!', '#DIV/0!')
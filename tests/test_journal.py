@@ -0,0 +1,69 @@
+from journal import Journal
+
+
+def test_undo_redo_order():
+    journal, log = Journal(), []
+    for n in range(3):
+        journal.record(f"action {n}", lambda n=n: log.append(-n), lambda n=n: log.append(n))
+    assert journal.undo() == 'action 2'
+    assert journal.undo() == 'action 1'
+    assert journal.redo() == 'action 1'
+    assert log == [-2, -1, 1]
+    # A new action clears the redo stack
+    journal.record('action 3', lambda: None, lambda: None)
+    assert journal.redo() is None
+    assert [journal.undo() for _ in range(4)] == ['action 3', 'action 1', 'action 0', None]
+
+
+def test_memory_budget_drops_the_oldest_records():
+    journal = Journal(max_bytes=1000)
+    for n in range(5):
+        journal.record(f"action {n}", lambda: None, lambda: None, nbytes=400)
+    assert [record.label for record in journal.undo_stack] == ['action 3', 'action 4']
+    assert journal.nbytes == 800
+
+
+def test_write_block_undo_redo(ui):
+    ui.store.set_block(1, 1, [[1, 2], [3, 4]])
+    ui.write_block(2, 2, [['a', 'b'], ['c', 'd']], label='paste')
+    assert [ui.store.get(x, y) for x, y in ((2, 2), (3, 3))] == ['a', 'd']
+    ui.undo()
+    assert [ui.store.get(x, y) for x, y in ((2, 1), (2, 2), (3, 2), (3, 3))] == [2, 4, None, None]
+    ui.redo()
+    assert [ui.store.get(x, y) for x, y in ((2, 2), (3, 2), (2, 3))] == ['a', 'b', 'c']
+
+
+def test_delete_rows_undo_restores_cells_and_formulas(ui):
+    ui.store.set_block(1, 1, [[1, '=C1R1*2'], [2, '=C1R2*2'], [3, '=C1R1+C1R3']])
+    ui.look.set_dimension(2, 2, 40, axis=1)
+    ui.selected_cells = (1, 2, ui.look.max_cols, 2)
+    ui.delete_rows()
+    assert ui.store.get(1, 2) == 3
+    assert ui.store.get(2, 2) == '=C1R1+C1R2'
+    assert ui.formulas.value(2, 2) == 4
+    ui.undo()
+    assert [ui.store.get(1, y) for y in (1, 2, 3)] == [1, 2, 3]
+    assert [ui.store.get(2, y) for y in (1, 2, 3)] == ['=C1R1*2', '=C1R2*2', '=C1R1+C1R3']
+    assert [ui.formulas.value(2, y) for y in (1, 2, 3)] == [2, 4, 4]
+    assert ui.look.headings_dim['R2'] == 40
+    ui.redo()
+    assert ui.store.get(1, 2) == 3 and ui.formulas.value(2, 2) == 4
+
+
+def test_delete_referenced_row_undo_restores_the_clipped_formula(ui):
+    ui.store.set_block(1, 1, [[5, None], [None, '=C1R1+1']])
+    ui.selected_cells = (1, 1, ui.look.max_cols, 1)
+    ui.delete_rows()
+    assert ui.formulas.value(2, 1) == '#REF!'
+    ui.undo()
+    assert ui.store.get(2, 2) == '=C1R1+1'
+    assert ui.formulas.value(2, 2) == 6
+
+
+def test_insert_columns_undo(ui):
+    ui.store.set_block(1, 1, [[1, 2, '=C1R1+C2R1']])
+    ui.selected_cells = (2, 1, 2, ui.look.max_rows)
+    ui.insert_columns()
+    assert ui.store.get(4, 1) == '=C1R1+C3R1' and ui.formulas.value(4, 1) == 3
+    ui.undo()
+    assert ui.store.get(3, 1) == '=C1R1+C2R1' and ui.formulas.value(3, 1) == 3
@@ -0,0 +1,18 @@
+from numformat import OVERFLOW_TEXT, compile_format
+
+
+def test_number_formats():
+    assert compile_format("#,##0.00").format_column([1234.5, -2, None, 'text', '3']) == \
+        ['1,234.50', '-2.00', None, 'text', '3.00']
+    assert compile_format("0.0%").format_value(0.125) == '12.5%'
+    assert compile_format("$0.00").format_value(-1.5) == '-$1.50'
+    assert compile_format(None).format_value(1.5) == '1.5'
+
+
+def test_repeated_values_share_their_text():
+    texts = compile_format("0.0").format_column([1.0, 2.0, 1.0, 1, '1'])
+    assert texts == ['1.0', '2.0', '1.0', '1.0', '1.0']
+
+
+def test_date_formats():
+    assert compile_format("yyyy-mm-dd hh:mm").format_column([45000.5, -1]) == ['2023-03-15 12:00', OVERFLOW_TEXT]
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+import formulas
+from formulas import FormulaEngine
+from sheetstore import SheetStore
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    monkeypatch.setattr(formulas, 'PARALLEL_MIN_CELLS', 8)
+    monkeypatch.setattr(formulas, 'PARALLEL_WORKERS', 2)
+    yield
+    formulas.shutdown_executors()
+
+
+def make_sheet(nrows: int) -> tuple[SheetStore, FormulaEngine]:
+    """Independent chains C2 = C1 * 2, C3 = C2 + 1 and range formulas C4 = SUM(C1)."""
+    store = SheetStore()
+    engine = FormulaEngine(store)
+    store.set_block(1, 1, [[y, f"=C1R{y}*2", f"=C2R{y}+1", f"=SUM(C1R{y}:C1R{y})"] for y in range(1, nrows + 1)])
+    return store, engine
+
+
+def wait_poll(engine: FormulaEngine, scheduled: list) -> list:
+    merged = []
+    deadline = time.monotonic() + 60
+    while scheduled and time.monotonic() < deadline:
+        scheduled.pop()
+        time.sleep(0.01)
+        merged += engine.poll()
+    assert not engine.inflight
+    return merged
+
+
+def test_blocking_parallel_recalc(parallel):
+    store, engine = make_sheet(50)
+    assert [engine.value(3, y) for y in (1, 50)] == [3, 101]
+    assert [engine.value(4, y) for y in (1, 50)] == [1, 50]
+
+
+def test_async_parallel_recalc_merges_from_poll(parallel):
+    store, engine = make_sheet(50)
+    scheduled, notified = [], []
+    engine.scheduler = lambda: scheduled.append(True)
+    engine.add_listener(notified.append)
+    store.set_block(1, 1, [[y * 10] for y in range(1, 51)])
+    assert engine.inflight and scheduled
+    merged = wait_poll(engine, scheduled)
+    assert len(merged) == 150
+    assert [engine.value(3, y) for y in (1, 50)] == [21, 1001]
+    assert [engine.value(4, y) for y in (1, 50)] == [10, 500]
+    assert set(merged) <= {cell for cells in notified for cell in cells}
+
+
+def test_stale_batches_are_recalculated(parallel):
+    store, engine = make_sheet(50)
+    scheduled = []
+    engine.scheduler = lambda: scheduled.append(True)
+    store.set_block(1, 1, [[y * 10] for y in range(1, 51)])
+    # Written while the batches are in flight: their results are stale
+    store.set(1, 1, 7)
+    wait_poll(engine, scheduled)
+    assert engine.value(3, 1) == 15
+    assert engine.value(3, 2) == 41
+
+
+def test_structural_edit_drops_batches_in_flight(parallel):
+    store, engine = make_sheet(50)
+    scheduled = []
+    engine.scheduler = lambda: scheduled.append(True)
+    store.set_block(1, 1, [[y * 10] for y in range(1, 51)])
+    store.insert_rows(1, 1)
+    wait_poll(engine, scheduled)
+    assert engine.value(3, 1) is None
+    assert [engine.value(3, y) for y in (2, 51)] == [21, 1001]
+    assert engine.value(4, 51) == 500
+
+
+def test_thread_batches_over_sheet_file(parallel, tmp_path):
+    from sheetfile import SheetFile, write_sheet
+    data = SheetStore()
+    data.set_block(1, 1, [[float(y)] for y in range(1, 101)])
+    fname = str(tmp_path / 'data.wsh')
+    write_sheet(fname, data, page_rows=16)
+    sheet = SheetFile(fname)
+    store = SheetStore(sheet)
+    engine = FormulaEngine(store)
+    scheduled = []
+    engine.scheduler = lambda: scheduled.append(True)
+    store.set_block(2, 1, [[f"=SUM(C1R1:C1R{y})"] for y in range(1, 101)])
+    wait_poll(engine, scheduled)
+    assert [engine.value(2, y) for y in (1, 10, 100)] == [1, 55, 5050]
+    sheet.close()
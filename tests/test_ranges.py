@@ -0,0 +1,63 @@
+import random
+
+from ranges import NamedRanges, intersects, shift_span
+from sheetstore import SheetStore
+
+
+def brute_force(ranges: NamedRanges, rect) -> list[str]:
+    return sorted(name for name in ranges if intersects(ranges[name], rect))
+
+
+def random_rect(rnd: random.Random, size: int=1000):
+    x0, y0 = rnd.randint(1, size), rnd.randint(1, size)
+    return x0, y0, x0 + rnd.randint(0, 30), y0 + rnd.randint(0, 30)
+
+
+def test_queries_match_a_linear_scan():
+    rnd = random.Random(7)
+    ranges = NamedRanges()
+    for n in range(2000):
+        ranges.add(f"n{n}", random_rect(rnd))
+    for n in range(0, 2000, 7):
+        ranges.remove(f"n{n}")
+    # Names added after the tree was built are searched one by one
+    ranges.intersecting(1, 1, 1, 1)
+    for n in range(2000, 2040):
+        ranges.add(f"n{n}", random_rect(rnd))
+    ranges.add("n1", (5, 5, 6, 6))
+    for _ in range(200):
+        rect = random_rect(rnd)
+        assert ranges.intersecting(*rect) == brute_force(ranges, rect)
+    assert "n1" in ranges.at(5, 6)
+
+
+def test_reversed_corners_are_normalised():
+    ranges = NamedRanges()
+    ranges.add("total", (4, 10, 2, 1))
+    assert ranges["total"] == (2, 1, 4, 10)
+    assert ranges.at(3, 5) == ["total"]
+    assert ranges.at(5, 5) == []
+
+
+def test_shift_span():
+    assert shift_span(5, 10, 3, 2) == (7, 12)
+    assert shift_span(5, 10, 8, 2) == (5, 12)
+    assert shift_span(5, 10, 5, -6) is None
+    assert shift_span(5, 10, 7, -2) == (5, 8)
+    assert shift_span(5, 10, 3, -4) == (3, 6)
+
+
+def test_ranges_follow_structural_edits():
+    store = SheetStore()
+    store.set(10, 10, 'x')
+    ranges = NamedRanges(store)
+    ranges.update({"a": (2, 2, 4, 4), "b": (1, 6, 1, 6), "c": (3, 8, 5, 9)})
+    store.insert_rows(1, 2)
+    assert (ranges["a"], ranges["b"]) == ((2, 4, 4, 6), (1, 8, 1, 8))
+    store.delete_rows(8, 8)
+    assert "b" not in ranges
+    assert ranges.clipped == [("b", (1, 8, 1, 8))]
+    store.delete_columns(4, 4)
+    assert ranges["a"] == (2, 4, 3, 6) and ranges["c"] == (3, 9, 4, 10)
+    assert ranges.at(3, 10) == ["c"]
+    assert ranges.to_dict() == {"a": [2, 4, 3, 6], "c": [3, 9, 4, 10]}
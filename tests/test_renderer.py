@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+
+from renderer import RecordingCanvas
+from worksheetui import HeadlessSheetUI
+
+GOLDEN = Path(__file__).parent / 'golden'
+
+
+def test_export_svg(tmp_path):
+    canvas = RecordingCanvas(100, 50)
+    canvas.create_rectangle(0, 0, 20, 10, fill='yellow', outline='')
+    canvas.create_line(0, 30, 100, 30, fill='lightgray')
+    canvas.create_text(5, 40, text='a<b', anchor='w')
+    canvas.create_text(50, 40, text='hidden', state='hidden')
+    fname = tmp_path / 'canvas.svg'
+    assert canvas.export_svg(str(fname)).splitlines() == [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="50">',
+        '<rect x="0" y="0" width="20" height="10" fill="yellow"/>',
+        '<line x1="0" y1="30" x2="100" y2="30" stroke="lightgray"/>',
+        '<text x="5" y="40" fill="black" text-anchor="start" dominant-baseline="middle">a&lt;b</text>',
+        '</svg>',
+    ]
+    assert fname.read_text(encoding='utf-8') == canvas.export_svg()
+
+
+def test_export_ppm(tmp_path):
+    canvas = RecordingCanvas(10, 6)
+    canvas.create_rectangle(1, 1, 4, 3, fill='red', outline='')
+    canvas.create_line(0, 5, 9, 5, fill='blue')
+    canvas.create_rectangle(6, 0, 9, 4, fill='green', state='hidden')
+    fname = tmp_path / 'canvas.ppm'
+    ppm = canvas.export_ppm(str(fname))
+    header = b'P6\n10 6\n255\n'
+    assert ppm.startswith(header) and len(ppm) == len(header) + 3 * 10 * 6
+    pixels = ppm[len(header):]
+
+    def pixel(x, y):
+        return tuple(pixels[3 * (y * 10 + x): 3 * (y * 10 + x) + 3])
+    assert pixel(2, 2) == (255, 0, 0) and pixel(4, 2) == (255, 255, 255)
+    assert pixel(9, 5) == (0, 0, 255)
+    assert pixel(7, 2) == (255, 255, 255)      # Hidden items are not drawn
+    assert fname.read_bytes() == ppm
+
+
+def test_restacking():
+    canvas = RecordingCanvas()
+    a, b, c, d = (canvas.create_rectangle(0, 0, 1, 1, tags=tag) for tag in ('a', 'b', 'c', 'd'))
+    canvas.tag_raise('a')
+    assert canvas.find_all() == (b, c, d, a)
+    canvas.tag_lower('d', 'b')
+    assert canvas.find_all() == (d, b, c, a)
+    canvas.tag_raise('d', 'c')
+    assert canvas.find_all() == (b, c, d, a)
+    # A missing anchor leaves the stacking as it is, like Tk
+    canvas.tag_lower('a', 'missing')
+    assert canvas.find_all() == (b, c, d, a)
+
+
+def test_area_searches_skip_hidden_items():
+    canvas = RecordingCanvas()
+    shown = canvas.create_rectangle(10, 10, 20, 20)
+    hidden = canvas.create_rectangle(12, 12, 18, 18, state='hidden')
+    # The outline bloats the bounding box, as in Tk
+    assert canvas.bbox(shown) == (9, 9, 21, 21)
+    assert canvas.find_enclosed(9, 9, 21, 21) == (shown,)
+    assert canvas.find_enclosed(10, 10, 20, 20) == ()
+    assert canvas.find_overlapping(15, 15, 16, 16) == (shown,)
+    canvas.itemconfigure(hidden, state='normal')
+    assert canvas.find_overlapping(15, 15, 16, 16) == (shown, hidden)
+
+
+def test_coords_sets_the_first_match_only():
+    canvas = RecordingCanvas()
+    first = canvas.create_line(0, 0, 10, 0, tags='grid')
+    second = canvas.create_line(0, 5, 10, 5, tags='grid')
+    canvas.coords('grid', 0, 1, 20, 1)
+    assert canvas.coords(first) == [0.0, 1.0, 20.0, 1.0]
+    assert canvas.coords(second) == [0.0, 5.0, 10.0, 5.0]
+    assert canvas.coords('grid') == canvas.coords(first)
+    assert canvas.coords('missing') == []
+
+
+def test_painted_sheet_matches_the_golden_svg():
+    ui = HeadlessSheetUI(240, 100)
+    ui.redraw_sheet(width=240, height=100)
+    ui.store.set_block(1, 1, [['a', 1], ['b<&>', 2.5], ['=C2R1+C2R2', None]])
+    ui.redraw_all()
+    golden = GOLDEN / 'small_sheet.svg'
+    if os.environ.get('UPDATE_GOLDEN'):
+        ui.export_svg(str(golden))
+    assert ui.export_svg() == golden.read_text(encoding='utf-8')
@@ -0,0 +1,71 @@
+from cellvalues import number, parse_input
+from formulas import FormulaEngine
+from search import SearchIndex
+from sheetstore import SheetStore
+
+
+def make_index(rows: list[list]) -> tuple[SheetStore, SearchIndex]:
+    store = SheetStore()
+    engine = FormulaEngine(store)
+    store.set_block(1, 1, rows)
+    return store, SearchIndex(store, engine)
+
+
+def test_find_modes():
+    store, index = make_index([['apple', 'pineapple'], ['Apple pie', '=1+1'], ['grape', 2]])
+    assert sorted(index.find('apple')) == [(1, 1), (1, 2), (2, 1)]
+    assert sorted(index.find('apple', match_case=True)) == [(1, 1), (2, 1)]
+    assert sorted(index.find('apple', mode='whole')) == [(1, 1)]
+    assert sorted(index.find('^gr', mode='regex')) == [(1, 3)]
+    assert sorted(index.find('2')) == [(2, 2), (2, 3)]
+
+
+def test_find_follows_writes():
+    store, index = make_index([['alpha'], ['beta']])
+    assert list(index.find('beta')) == [(1, 2)]
+    store.set(1, 2, 'gamma')
+    store.set(1, 3, 'beta')
+    assert list(index.find('beta')) == [(1, 3)]
+
+
+def test_replace_all_keeps_numbers_numeric():
+    store, index = make_index([[10, 'a1'], [12.5, '=C1R1*2'], ['x1', 'a']])
+    assert index.replace_all('1', '2') == 4
+    assert store.get(1, 1) == 20 and type(store.get(1, 1)) is int
+    assert store.get(1, 2) == 22.5
+    assert store.get(1, 3) == 'x2'
+    assert store.get(2, 1) == 'a2'
+    assert store.get(2, 2) == '=C1R1*2'
+    assert index.replace_all('a', '', mode='whole') == 1
+    assert index.replace_all('a', '') == 1
+    assert store.get(2, 1) == 2
+
+
+def test_parse_input():
+    assert [parse_input(text) for text in ('12', '-3', '1.50', '1e3', ' 7 ', 'abc', '=1+2', '', '1_000', 'nan')] == \
+        [12, -3, 1.5, 1000.0, 7, 'abc', '=1+2', '', '1_000', 'nan']
+    assert parse_input(None) is None
+    assert [number(value) for value in ('2.5', 3, True, 'x', float('nan'))] == [2.5, 3.0, None, None, None]
+
+
+def test_index_follows_structural_edits(monkeypatch):
+    import search
+    for numpy in (search.np, None):
+        monkeypatch.setattr(search, 'np', numpy)
+        store, index = make_index([['alpha', 'beta'], ['gamma', '=C1R1'], ['delta', 'alphabet']])
+        store.set_block(5, 1, [[y] for y in range(100)])     # Keeps the dead slots under the rebuild threshold
+        assert index.find('alpha') == [(1, 1), (2, 2), (2, 3)]
+        builds = []
+        monkeypatch.setattr(index, 'release', lambda: builds.append(1))
+        store.insert_rows(2, 3)
+        assert index.find('alpha') == [(1, 1), (2, 4), (2, 5)]
+        store.delete_rows(1, 1)
+        # The formula now refers to a deleted cell, its recalculated value is indexed at its new address
+        assert index.find('alpha') == [(2, 4)]
+        assert index.find('#REF!', mode='whole') == [(2, 3)]
+        store.insert_columns(1, 1)
+        store.delete_columns(3, 3)
+        assert index.find('a', mode='regex') == [(2, 3), (2, 4)]
+        assert index.find('gamma', mode='whole') == [(2, 3)]
+        assert not builds
+        monkeypatch.undo()
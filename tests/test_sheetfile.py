@@ -0,0 +1,101 @@
+import pytest
+
+import sheetfile
+from sheetfile import SheetFile, write_sheet
+from sheetstore import SheetStore
+
+
+@pytest.fixture
+def sheet(tmp_path):
+    store = SheetStore()
+    store.set_block(1, 1, [[float(y), f"row {y}" if y % 3 else None, None] for y in range(1, 101)])
+    store.set(4, 50, 'ñandú')
+    fname = str(tmp_path / 'data.wsh')
+    write_sheet(fname, store, meta={'look': {'flags': 3}}, page_rows=16)
+    sheet = SheetFile(fname)
+    yield sheet
+    sheet.close()
+
+
+def test_round_trip(sheet):
+    assert (sheet.ncols, sheet.nrows, sheet.page_rows) == (4, 100, 16)
+    assert sheet.meta == {'look': {'flags': 3}}
+    assert sheet.get(1, 17) == 17.0
+    assert sheet.get(2, 1) == 'row 1' and sheet.get(2, 3) is None
+    assert sheet.get(3, 5) is None
+    assert sheet.get(4, 50) == 'ñandú'
+    assert sheet.get(5, 1) is None and sheet.get(1, 101) is None
+    assert sheet.column_slice(2, 14, 19) == ['row 14', None, 'row 16', 'row 17', None, 'row 19']
+    assert sheet.column_slice(1, 99, 102) == [99.0, 100.0, None, None]
+
+
+def test_values_keep_their_type(tmp_path):
+    store = SheetStore()
+    store.set_block(1, 1, [[1, 1, 'a', 2 ** 60], [2.5, 2, '', None], [None, None, 3, 0.5], [4, 7, 4.0, 1]])
+    fname = str(tmp_path / 'typed.wsh')
+    write_sheet(fname, store)
+    sheet = SheetFile(fname)
+    columns = [sheet.column_slice(x, 1, 4) for x in range(1, 5)]
+    assert columns == [[1, 2.5, None, 4], [1, 2, None, 7], ['a', '', 3, 4.0], [2 ** 60, None, 0.5, 1]]
+    assert [type(value) for value in columns[0] + columns[2]] == [int, float, type(None), int, str, str, int, float]
+    if sheetfile.np is not None:
+        assert sheet.column_array(2, 1, 4).tolist()[:2] == [1.0, 2.0] and sheet.column_array(3, 1, 4) is None
+    sheet.close()
+
+
+def test_pages_are_decoded_lazily(sheet, monkeypatch):
+    monkeypatch.setattr(sheetfile, 'PAGE_CACHE', 2)
+    sheet.get(1, 1)
+    sheet.get(1, 2)
+    assert sheet.pages_decoded == 1
+    sheet.get(1, 17)
+    sheet.get(1, 33)
+    assert sheet.pages_decoded == 3 and len(sheet.pages) == 2
+    sheet.get(1, 1)
+    assert sheet.pages_decoded == 4
+    sheet.release()
+    assert sheet.cache_size() == 0
+
+
+def test_column_array(sheet):
+    np = pytest.importorskip('numpy')
+    data = sheet.column_array(1, 10, 40)
+    assert data.tolist() == [float(y) for y in range(10, 41)]
+    assert np.isnan(sheet.column_array(3, 1, 5)).all()
+    assert sheet.column_array(2, 1, 5) is None
+
+
+def test_store_over_sheet_file(sheet, tmp_path):
+    store = SheetStore(sheet)
+    store.set(2, 2, 'edited')
+    store.insert_rows(1, 2)
+    assert store.get(1, 3) == 1.0 and store.get(2, 4) == 'edited'
+    # Writing over the file backing the store
+    write_sheet(sheet.fname, store, page_rows=16)
+    reopened = SheetFile(sheet.fname)
+    assert reopened.nrows == 102
+    assert reopened.get(1, 3) == 1.0 and reopened.get(2, 4) == 'edited' and reopened.get(1, 1) is None
+    reopened.close()
+
+
+def test_not_a_worksheet_file(tmp_path):
+    fname = tmp_path / 'other.wsh'
+    fname.write_bytes(b'\x00' * 64)
+    with pytest.raises(ValueError):
+        SheetFile(str(fname))
+
+
+def test_ui_save_and_open(ui, make_ui, tmp_path):
+    ui.store.set_block(1, 1, [[1, 2, '=C1R1+C2R1'], ['text', None, '=SUM(C1R1:C2R1)']])
+    ui.look.names.add('total', (3, 1, 3, 2))
+    ui.look.set_dimension(2, 2, 150)
+    fname = str(tmp_path / 'book.wsh')
+    ui.save_sheet(fname)
+
+    other = make_ui()
+    other.open_sheet(fname)
+    assert other.store.get(3, 1) == '=C1R1+C2R1'
+    assert other.formulas.value(3, 1) == 3 and other.formulas.value(3, 2) == 3
+    assert other.look.names['total'] == (3, 1, 3, 2)
+    assert other.look.headings_dim['C2'] == 150
+    other.store.base.close()
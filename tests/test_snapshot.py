@@ -0,0 +1,52 @@
+import pytest
+
+import snapshot
+from snapshot import DIGEST_PREFIX, Snapshot, take_snapshot
+
+
+@pytest.fixture
+def ui(ui):
+    ui.store.set_block(1, 1, [['a', 1], ['b', 2], ['c', 3]])
+    ui.redraw_all()
+    return ui
+
+
+def test_digest_ignores_item_order_and_ids():
+    records = [('text', (10.0, 5.0), 'a', ('cell', 'current'), 'normal'),
+               ('rectangle', (0.0, 0.0, 20.0, 10.0), '', ('cell',), 'normal')]
+    first = take_snapshot({'zoom': 1}, records)
+    assert take_snapshot({'zoom': 1}, records[::-1]) == first
+    assert list(first.groups) == ['cell']
+    assert take_snapshot({'zoom': 2}, records).digest != first.digest
+
+
+def test_headless_redraws_are_reproducible(ui):
+    # The first pass lays out the grid, the digest is stable from then on
+    ui.redraw_sheet(width=800, height=600)
+    first = ui.snapshot()
+    ui.redraw_sheet(width=800, height=600)
+    assert ui.snapshot() == first
+    line = first.to_line()
+    assert line.startswith(DIGEST_PREFIX)
+    assert Snapshot.from_line(line) == first
+
+
+def test_diff_names_the_changed_groups(ui):
+    first = ui.snapshot()
+    ui.set_cell(1, 2, 'changed')
+    second = ui.snapshot()
+    assert second.digest != first.digest
+    diff = second.diff(first)
+    assert diff and all(line.startswith(('~', '+', '-')) for line in diff)
+    assert second.diff(second) == []
+
+
+def test_unchanged_items_are_not_hashed_again(ui, monkeypatch):
+    ui.snapshot()
+    hashed = []
+    record_hash = snapshot.record_hash
+    monkeypatch.setattr(snapshot, 'record_hash', lambda record: hashed.append(record) or record_hash(record))
+    ui.set_cell(1, 2, 'changed')
+    second = ui.snapshot()
+    assert hashed and len(hashed) < len(ui.items) // 10
+    assert second == take_snapshot(ui.look.get_state(), ui.item_records())
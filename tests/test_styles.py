@@ -0,0 +1,61 @@
+import random
+
+from sheetstore import SheetStore
+from styles import CellStyles, Style, StyleRuns
+
+
+def expand(runs: StyleRuns, nrows: int) -> list[int]:
+    return [runs.get(y) for y in range(1, nrows + 1)]
+
+
+def test_runs_match_a_per_row_model():
+    rnd = random.Random(5)
+    runs, model = StyleRuns(), [0] * 100
+    for _ in range(300):
+        y0 = rnd.randint(1, 100)
+        y1 = rnd.randint(y0, 100)
+        sid = rnd.randint(0, 3)
+        runs.assign(y0, y1, sid)
+        model[y0 - 1: y1] = [sid] * (y1 - y0 + 1)
+        assert expand(runs, 100) == model
+        # Consecutive runs never repeat a style
+        assert all(a != b for a, b in zip(runs.ids, runs.ids[1:]))
+    assert [seg for seg in runs.segments(1, 100)][0][0] == 1
+
+
+def test_shift_runs():
+    runs = StyleRuns()
+    runs.assign(5, 9, 1)
+    runs.shift(7, 2)
+    assert expand(runs, 14) == [0] * 4 + [1] * 7 + [0] * 3
+    runs.shift(3, -4)
+    assert expand(runs, 10) == [0, 0] + [1] * 5 + [0] * 3
+
+
+def test_interned_styles_and_whole_columns():
+    store = SheetStore()
+    styles = CellStyles(store)
+    styles.update_style(1, 1, 2, 3, background="yellow")
+    styles.update_style(2, 2, 2, None, font="Arial 12")
+    assert styles.style(1, 2).background == "yellow"
+    assert styles.style(2, 2) == Style(font="Arial 12", background="yellow")
+    assert styles.style(2, 1_000_000).font == "Arial 12"
+    assert styles.style(1, 4) == Style()
+    # Same options, same interned style
+    assert styles.style_id(1, 1) == styles.style_id(2, 1)
+    restored = CellStyles()
+    restored.load(styles.to_dict())
+    assert all(restored.style(x, y) == styles.style(x, y) for x in (1, 2, 3) for y in (1, 2, 3, 50))
+
+
+def test_styles_follow_row_deletes_and_undo():
+    store = SheetStore()
+    store.set(1, 10, 'x')
+    styles = CellStyles(store)
+    styles.update_style(1, 3, 1, 5, fill="red")
+    store.delete_rows(2, 4)
+    assert [styles.style(1, y).fill for y in (1, 2, 3)] == ["black", "red", "black"]
+    clipped = styles.clipped
+    store.insert_rows(2, 4)
+    styles.restore_clipped(clipped)
+    assert [styles.style(1, y).fill for y in range(1, 7)] == ["black", "black", "red", "red", "red", "black"]
@@ -0,0 +1,48 @@
+import tkinter
+from types import SimpleNamespace
+
+import pytest
+
+from tclbatch import CanvasBatch, TclCounter, tcl_word
+
+# A Tcl interpreter without Tk: a proc named as the widget stands in for the canvas command
+CANVAS_PROC = r'''
+set ::calls {}
+set ::next 0
+proc .c {cmd args} {
+    lappend ::calls [list $cmd {*}$args]
+    if {$cmd eq "create"} {return [incr ::next]}
+}
+'''
+
+
+@pytest.fixture
+def canvas():
+    tcl = tkinter.Tcl()
+    tcl.eval(CANVAS_PROC)
+    return SimpleNamespace(_w='.c', tk=TclCounter(tcl))
+
+
+@pytest.mark.parametrize('value', ['plain', 'two words', 'a{b', '[exec x]', '$var', 'tab\tline\nend', 'back\\slash', ''])
+def test_tcl_word_is_one_literal_word(value):
+    tcl = tkinter.Tcl()
+    assert tcl.splitlist(tcl.eval(f"list {tcl_word(value)}")) == (value,)
+
+
+def test_batch_is_one_crossing(canvas):
+    batch = CanvasBatch(canvas)
+    with batch.batched():
+        with batch.batched():
+            first = batch.create('text', 10, 20, text='a b', tags=('cell', 'style0'), fill=None)
+            batch.itemconfigure('cell', state='hidden')
+        second = batch.create('line', 0, 0, 5, 5)
+        assert canvas.tk.ncalls == 0 and len(batch) == 3
+    assert (first, second) == (0, 1)
+    assert canvas.tk.ncalls == 1
+    calls = canvas.tk.splitlist(canvas.tk.eval('set ::calls'))
+    assert [canvas.tk.splitlist(call) for call in calls] == [
+        ('create', 'text', '10', '20', '-text', 'a b', '-tags', 'cell style0'),
+        ('itemconfigure', 'cell', '-state', 'hidden'),
+        ('create', 'line', '0', '0', '5', '5'),
+    ]
+    assert batch.flush() == []
@@ -0,0 +1,118 @@
+from sheetstore import SheetStore
+from views import RowView
+
+
+def test_sort_mixed_values():
+    store = SheetStore()
+    store.set_block(1, 1, [['b'], [10], [None], ['2'], ['A'], [1.5]])
+    view = RowView()
+    view.sort(store, [(1, False)])
+    assert [int(y) for y in view.rows] == [6, 4, 2, 5, 1, 3]
+    view.sort(store, [(1, True)])
+    # Descending keeps the empty cells at the end
+    assert [int(y) for y in view.rows] == [2, 4, 6, 1, 5, 3]
+    assert view.to_view(2) == 1 and view.to_store(1) == 2
+
+
+def test_sort_by_several_keys_is_stable():
+    store = SheetStore()
+    store.set_block(1, 1, [[1, 'b'], [2, 'a'], [1, 'a'], [2, 'b']])
+    view = RowView()
+    view.sort(store, [(1, False), (2, True)])
+    assert [int(y) for y in view.rows] == [1, 3, 4, 2]
+
+
+def test_filter_and_clear():
+    store = SheetStore()
+    store.set_block(1, 1, [['x'], ['y'], ['x'], ['z']])
+    view = RowView()
+    view.filter(store, 1, lambda value: value == 'x')
+    assert [int(y) for y in view.rows] == [1, 3]
+    assert view.to_view(2) is None and view.to_store(3) is None
+    view.clear()
+    assert not view.active and view.to_store(3) == 3
+
+
+def test_sorted_sheet_reads_and_writes_through_the_view(ui):
+    ui.store.set_block(1, 1, [[3, '=C1R1*10'], [1, '=C1R2*10'], [2, '=C1R3*10']])
+    ui.sort_rows(2, descending=1)
+    assert next(ui.look.iter_values(1, 1, 2, 3)) == [[3, 30], [2, 20], [1, 10]]
+    ui.set_cell(1, 3, '7')
+    assert ui.store.get(1, 2) == 7 and ui.formulas.value(2, 2) == 70
+    ui.clear_view()
+    assert next(ui.look.iter_values(1, 1, 2, 3)) == [[3, 30], [7, 70], [2, 20]]
+
+
+def test_store_span():
+    view = RowView()
+    view.set_rows([3, 1, 2, 5], 5)
+    assert view.store_span(2, 3) == (1, 2)
+    assert view.store_span(1, 3) == (1, 3)
+    assert view.store_span(3, 4) is None
+    view.set_rows([2, 1, 3], 3)
+    assert view.store_span(3, 6) == (3, 6)
+    assert view.store_span(5, 6) == (5, 6)
+    view.set_rows([2, 4], 5)
+    assert view.store_span(3, 3) is None
+
+
+def test_row_delete_under_a_sort_deletes_the_shown_rows(ui):
+    ui.store.set_block(1, 1, [['c'], ['a'], ['b']])
+    ui.sort_rows(1)
+    ui.look.selected_cells = 1, 1, ui.look.max_cols, 1
+    ui.delete_rows()
+    assert not ui.look.view.active
+    assert [ui.store.get(1, y) for y in (1, 2, 3)] == ['c', 'b', None]
+    ui.undo()
+    assert [ui.store.get(1, y) for y in (1, 2, 3)] == ['c', 'a', 'b']
+
+
+def test_row_edits_of_rows_apart_in_storage_are_refused(ui):
+    ui.store.set_block(1, 1, [['c'], ['a'], ['b']])
+    ui.sort_rows(1)
+    # View rows 2:3 (b, c) are storage rows 3 and 1
+    ui.look.selected_cells = 1, 2, ui.look.max_cols, 3
+    ui.delete_rows()
+    ui.insert_rows()
+    assert ui.look.view.active
+    assert [ui.store.get(1, y) for y in (1, 2, 3)] == ['c', 'a', 'b']
+
+
+def drawn_rows(ui, nrows: int, xs: tuple) -> list[tuple]:
+    """Returns the texts drawn in the xs columns of the first nrows rows."""
+    texts = {}
+    for kind, coords, text, tags, state in ui.item_records():
+        if kind == 'text' and 'cell_content' in tags:
+            texts[ui.cell_containing_coords(*coords[:2])] = text
+    return [tuple(texts.get((x, y)) for x in xs) for y in range(1, nrows + 1)]
+
+
+def test_column_insert_keeps_the_sort(ui):
+    ui.store.set_block(1, 1, [['c', '2'], ['a', '3'], ['b', '1']])
+    ui.sort_rows(1)
+    ui.look.selected_cells = 2, 1, 2, ui.look.max_rows
+    ui.insert_columns()
+    assert ui.look.view.active
+    assert drawn_rows(ui, 3, (1, 3)) == [('a', '3'), ('b', '1'), ('c', '2')]
+    ui.store.delete_rows(1, 1)
+    ui.redraw_all()
+    assert not ui.look.view.active
+    assert drawn_rows(ui, 2, (1, 3)) == [('a', '3'), ('b', '1')]
+
+
+def test_selection_stats_under_a_view(ui, monkeypatch):
+    ui.store.set_block(1, 1, [[3], [1], ['=C1R1*10'], [2], ['x']])
+    ui.sort_rows(1)
+    import worksheetui
+    scans = []
+    monkeypatch.setattr(worksheetui, 'summarize', lambda values: scans.append(values) or worksheetui.EMPTY)
+    # The whole height of a sort is a permutation of the column: the aggregate index answers it
+    assert ui.look.selection_stats(1, 1, 1, ui.look.max_rows) == (36, 4, 1, 30)
+    assert not scans
+    monkeypatch.undo()
+    # View rows 2:3 show storage rows 4 and 1
+    assert ui.look.selection_stats(1, 2, 1, 3) == (5, 2, 2, 3)
+    ui.clear_view()
+    ui.look.active_cell = (1, 2)
+    ui.filter_rows(1)
+    assert ui.look.selection_stats(1, 1, 1, ui.look.max_rows) == (1, 1, 1, 1)
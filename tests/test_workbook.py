@@ -0,0 +1,58 @@
+import pytest
+
+from worksheetui import Workbook
+
+
+def test_sheets_keep_their_store_and_state(ui):
+    first = ui.workbook.active
+    ui.store.set(1, 1, 'first')
+    ui.set_selected_cells(2, 3)
+    second = ui.add_sheet()
+    assert ui.workbook.active == second != first
+    assert ui.store.get(1, 1) is None
+    ui.store.set(1, 1, 'second')
+    ui.activate_sheet(first)
+    assert ui.store.get(1, 1) == 'first'
+    assert ui.active_cell == (2, 3)
+    ui.remove_sheet(first)
+    assert ui.workbook.active == second and ui.store.get(1, 1) == 'second'
+    with pytest.raises(ValueError):
+        ui.remove_sheet(second)
+
+
+def test_names_and_recent_order():
+    book = Workbook()
+    looks = {name: object() for name in ('Sheet1', 'Sheet2')}
+    for name, look in looks.items():
+        book.add(name, look)
+    assert book.new_name() == 'Sheet3'
+    with pytest.raises(ValueError):
+        book.add('Sheet1', object())
+    book.rename('Sheet1', 'Data')
+    assert list(book.sheets) == ['Data', 'Sheet2'] and book.active == 'Data'
+    with pytest.raises(ValueError):
+        book.rename('Sheet2', 'Data')
+
+
+class FakeLook:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def cache_size(self):
+        return self.nbytes
+
+    def release_caches(self):
+        self.nbytes = 0
+
+
+def test_least_recent_caches_are_released_over_budget():
+    book = Workbook(max_cache_bytes=150)
+    looks = {name: FakeLook(100) for name in ('a', 'b', 'c')}
+    for name, look in looks.items():
+        book.add(name, look)
+    book.activate('b')
+    # c was never activated: it is the least recent sheet
+    assert [looks[name].nbytes for name in 'abc'] == [100, 100, 0]
+    looks['c'].nbytes = 100
+    book.activate('c')
+    assert [looks[name].nbytes for name in 'abc'] == [0, 100, 100]